@@ -1,15 +1,86 @@
 # etapa2/back/api.py
-from typing import List, Optional, Literal
-from fastapi import FastAPI, HTTPException
+import os
+import time
+import tempfile
+import threading
+from contextlib import asynccontextmanager, closing
+from typing import Dict, List, Optional, Literal
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
 from pydantic import BaseModel, Field
 
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 
-from .predict import predict as predict_fn
-from .retrain_service import retrain_from_records
-from .last_model import get_last_model_path
+from .predict import predict as predict_fn, predict_with_model
+from .explain import explain as explain_fn, top_terms as explain_top_terms, NotExplainable, EXPLAIN_TERMS
+from .jobs import retrain_jobs
+from .batching import MicroBatcher, BatcherFull, PREDICT_BATCHING
+from .cache import prediction_cache
+from .bulk import stream_scores, iter_text_chunks, BULK_CHUNK_SIZE, BULK_MAX_BYTES
+from .last_model import get_last_model_path, registry
+from .utils import get_normalizer
+from . import versions
+from . import metrics
 
-app = FastAPI(title="ODS Text Analytics API - Etapa 2")
+# Warmup al arrancar (lifespan): "sync" carga modelo y normalizador antes de aceptar peticiones;
+# "background" arranca de inmediato y calienta en un hilo (/health responde 503 hasta terminar);
+# "off" deja la carga a la primera petición
+API_WARMUP = os.environ.get("API_WARMUP", "sync")
+# si el warmup falló, /health lo reintenta como máximo una vez por este intervalo
+WARMUP_RETRY_SECONDS = float(os.environ.get("WARMUP_RETRY_SECONDS", "30"))
+WARMUP_TEXT = "La salud y la educación de calidad son prioridades para el desarrollo sostenible"
+
+_startup = {"ready": API_WARMUP == "off", "warmup_seconds": None, "steps": None, "error": None, "attempted_at": None}
+_warmup_lock = threading.Lock()
+
+def warmup() -> dict:
+    """Carga el modelo activo, prepara el normalizador (NLTK + tabla de formas) y hace una predicción de prueba."""
+    steps = {}
+    t0 = t = time.perf_counter()
+    loaded = registry.current()
+    steps["model"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    normalizer = get_normalizer()
+    X = normalizer.transform([WARMUP_TEXT])
+    steps["normalizer"] = time.perf_counter() - t
+
+    # directo al modelo: ni la caché de predicciones ni los contadores de /predict ven esta llamada
+    t = time.perf_counter()
+    predict_with_model(loaded.model, X)
+    steps["predict"] = time.perf_counter() - t
+    return {"seconds": time.perf_counter() - t0, "steps": steps}
+
+def _run_warmup():
+    # uno a la vez: el hilo de background y /health no calientan en paralelo
+    if not _warmup_lock.acquire(blocking=False):
+        return
+    try:
+        _startup["attempted_at"] = time.monotonic()
+        try:
+            out = warmup()
+        except Exception as e:  # sin modelo o artefacto inválido: el proceso sigue vivo, pero no listo
+            _startup["error"] = f"{type(e).__name__}: {e}"
+            return
+        _startup.update(ready=True, warmup_seconds=out["seconds"], steps=out["steps"], error=None)
+    finally:
+        _warmup_lock.release()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if API_WARMUP == "sync":
+        # por el threadpool, como los endpoints síncronos: también deja listo el backend de anyio
+        await run_in_threadpool(_run_warmup)
+    elif API_WARMUP == "background":
+        threading.Thread(target=_run_warmup, name="api-warmup", daemon=True).start()
+    yield
+    retrain_jobs.shutdown()
+
+app = FastAPI(title="ODS Text Analytics API - Etapa 2", lifespan=lifespan)
+
+# Micro-batching opcional de /predict (PREDICT_BATCHING=1)
+batcher = MicroBatcher(predict_fn) if PREDICT_BATCHING else None
 
 app.add_middleware(
     CORSMiddleware,
@@ -18,6 +89,39 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+if metrics.METRICS_ENABLED:
+    app.add_middleware(metrics.PrometheusMiddleware)
+
+def _component_metrics() -> list:
+    """Colector de /metrics: estado de la caché, del micro-batching y del modelo activo."""
+    out = [("api_ready", "gauge", "1 cuando terminó el warmup del arranque.", [({}, int(_startup["ready"]))])]
+    if _startup["warmup_seconds"] is not None:
+        out.append(("api_warmup_seconds", "gauge", "Duración del warmup del arranque.",
+                    [({}, _startup["warmup_seconds"])]))
+    info = registry.info()
+    if info is not None:
+        out.append(("model_info", "gauge", "Modelo activo (valor constante 1).",
+                    [({"version": info["version"], "md5": info["md5"], "artifact": info["artifact"]}, 1)]))
+    if prediction_cache is not None:
+        st = prediction_cache.stats()
+        out += [
+            ("prediction_cache_entries", "gauge", "Entradas en la caché de predicciones.", [({}, st["entries"])]),
+            ("prediction_cache_bytes", "gauge", "Bytes ocupados por la caché de predicciones.", [({}, st["bytes"])]),
+            ("prediction_cache_hits_total", "counter", "Aciertos de la caché.", [({}, st["hits"])]),
+            ("prediction_cache_misses_total", "counter", "Fallos de la caché.", [({}, st["misses"])]),
+            ("prediction_cache_evictions_total", "counter", "Entradas desalojadas por motivo.",
+             [({"reason": r}, n) for r, n in st["evictions"].items()]),
+        ]
+    if batcher is not None:
+        out += [
+            ("batcher_queued", "gauge", "Peticiones esperando en el micro-batcher.", [({}, batcher.stats()["queued"])]),
+            ("batcher_rejected_total", "counter", "Peticiones rechazadas por cola llena.", [({}, batcher.rejected)]),
+            ("batcher_batch_size", "histogram", "Textos por lote del micro-batcher.", [({}, batcher.batch_sizes)]),
+            ("batcher_queue_wait_ms", "histogram", "Espera en cola del micro-batcher (ms).", [({}, batcher.queue_wait_ms)]),
+        ]
+    return out
+
+metrics.registry.add_collector(_component_metrics)
 
 
 # ===== Esquemas =====
@@ -30,52 +134,245 @@ class LabeledInstance(Instance):
 class PredictRequest(BaseModel):
     # En Pydantic v2: usa min_length para listas
     instances: List[Instance] = Field(..., min_length=1)
+    top_k: Optional[int] = Field(None, ge=1, description="Incluye las k clases más probables por texto")
+
+class ClassProb(BaseModel):
+    label: int
+    label_name: str
+    prob: float
 
 class PredictItem(BaseModel):
     label: int
     label_name: str
     prob: Optional[float] = None
+    top: Optional[List[ClassProb]] = None
 
 class PredictResponse(BaseModel):
     predictions: List[PredictItem]
 
+class ExplainRequest(BaseModel):
+    instances: List[Instance] = Field(..., min_length=1)
+    top_k: int = Field(1, ge=1, description="Clases explicadas por texto (las más probables)")
+    n_terms: int = Field(EXPLAIN_TERMS, ge=1, le=100, description="n-gramas por clase")
+
+class TermContribution(BaseModel):
+    term: str
+    value: float = Field(..., description="Valor del n-grama en el texto (TF-IDF normalizado)")
+    weight: float = Field(..., description="Peso del n-grama para la clase en el índice del modelo")
+    contribution: float = Field(..., description="value * weight: aporte al score de la clase")
+
+class ClassExplanation(BaseModel):
+    label: int
+    label_name: str
+    prob: Optional[float] = None
+    score: float
+    intercept: float
+    terms: List[TermContribution]
+
+class ExplainItem(BaseModel):
+    label: int
+    label_name: str
+    prob: Optional[float] = None
+    explanations: List[ClassExplanation]
+
+class ExplainResponse(BaseModel):
+    model_version: str
+    predictions: List[ExplainItem]
+
 class RetrainRequest(BaseModel):
     instances: List[LabeledInstance] = Field(..., min_length=30)
-    strategy: Literal["merge_all", "reweight", "online"] = "merge_all"
+    strategy: Literal["merge_all", "reweight", "online", "search"] = "merge_all"
     pipeline: Literal["svc_calibrated", "logreg", "sgd_online"] = "svc_calibrated"
 
-class RetrainResponse(BaseModel):
-    precision: float
-    recall: float
-    f1: float
-    model_version_path: str
+class RetrainJobResponse(BaseModel):
+    job_id: str
+    status: Literal["queued", "running", "done", "failed"]
+    progress: Optional[str] = None
+    strategy: str
+    pipeline: str
+    n_records: int
+    n_requests: int = Field(1, description="Peticiones fusionadas en este trabajo")
+    created_at: str
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+    metrics: Optional[Dict[str, float]] = None
+    model_version_path: Optional[str] = None
+    error: Optional[str] = None
+
+class ModelVersion(BaseModel):
+    id: str
+    file: str
+    created_at: Optional[str] = None
+    pipeline: Optional[str] = None
+    strategy: Optional[str] = None
+    parent: Optional[str] = None
+    metrics: Optional[Dict[str, float]] = None
+    md5: Optional[str] = None
+    pinned: bool = False
+    active: bool = False
 
 # ===== Endpoints =====
 @app.get("/health")
 def health():
-    return {"status": "ok", "active_model": get_last_model_path()}
+    if _startup["error"] is not None and time.monotonic() - _startup["attempted_at"] >= WARMUP_RETRY_SECONDS:
+        _run_warmup()  # p. ej. no había modelo al arrancar y ya se publicó uno
+    warm = {k: _startup[k] for k in ("warmup_seconds", "steps", "error") if _startup[k] is not None}
+    if not _startup["ready"]:
+        # warmup en curso o fallido: 503 para que el balanceador no enrute tráfico todavía
+        body = {"status": "starting" if _startup["error"] is None else "error", "ready": False,
+                "active_model": get_last_model_path(), "warmup": warm}
+        return JSONResponse(body, status_code=503)
+    try:
+        loaded = registry.current()
+    except FileNotFoundError:
+        return {"status": "ok", "ready": True, "active_model": get_last_model_path(), "model": None}
+    out = {"status": "ok", "ready": True, "active_model": loaded.path, "model": loaded.info()}
+    if warm:
+        out["warmup"] = warm
+    if prediction_cache is not None:
+        out["cache"] = prediction_cache.stats()
+    if batcher is not None:
+        out["batching"] = batcher.stats()
+    return out
 
-@app.post("/predict", response_model=PredictResponse)
-def predict(req: PredictRequest):
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_endpoint():
+    """Métricas en formato de texto Prometheus (vacío si METRICS_ENABLED=0)."""
+    body = metrics.registry.render() if metrics.METRICS_ENABLED else ""
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
+@app.post("/predict", response_model=PredictResponse, response_model_exclude_unset=True)
+async def predict(req: PredictRequest):
+    texts = [it.textos for it in req.instances]
     try:
-        preds = predict_fn([it.textos for it in req.instances])
+        if batcher is not None and not req.top_k:
+            # espera en el event loop: la cola del batcher no queda limitada por el threadpool
+            preds = await batcher.submit_async(texts)
+        else:
+            preds = await run_in_threadpool(predict_fn, texts, top_k=req.top_k)
         return {"predictions": preds}
+    except BatcherFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-@app.post("/retrain", response_model=RetrainResponse)
-def retrain(req: RetrainRequest):
+# bytes del cuerpo de /predict/bulk que se juntan antes de cada escritura (en el threadpool)
+_BULK_SPOOL_BYTES = 1 << 20
+
+def _probe_bulk(path: str, text_col: str, in_fmt: str):
+    """Valida columna/formato leyendo el primer texto; closing cierra el archivo (y el libro xlsx)."""
+    with closing(iter_text_chunks(path, text_col, 1, in_fmt)) as probe:
+        next(probe, None)
+
+@app.post("/predict/bulk")
+async def predict_bulk(
+    request: Request,
+    in_fmt: Literal["parquet", "csv", "xlsx"] = Query("csv", alias="format"),
+    output: Literal["ndjson", "csv"] = "ndjson",
+    text_col: str = "textos",
+    chunk_size: int = BULK_CHUNK_SIZE,
+):
+    """
+    Clasifica un archivo enviado como cuerpo crudo de la petición y responde en streaming
+    (NDJSON o CSV) bloque a bloque. El cuerpo se vuelca a un temporal, sin cargarlo en memoria,
+    hasta `BULK_MAX_BYTES` (413 si lo supera). Las escrituras, la validación y el scoring corren
+    en el threadpool: el event loop sigue atendiendo /health y /predict.
+    """
+    too_large = HTTPException(status_code=413, detail=f"El archivo supera el máximo de {BULK_MAX_BYTES} bytes.")
+    declared = request.headers.get("content-length")
+    if BULK_MAX_BYTES > 0 and declared and declared.isdigit() and int(declared) > BULK_MAX_BYTES:
+        raise too_large
+    fd, path = tempfile.mkstemp(suffix=f".{in_fmt}")
+    try:
+        written, pending, pending_bytes = 0, [], 0
+        with os.fdopen(fd, "wb") as f:
+            async for chunk in request.stream():
+                written += len(chunk)
+                if BULK_MAX_BYTES > 0 and written > BULK_MAX_BYTES:
+                    raise too_large
+                pending.append(chunk)
+                pending_bytes += len(chunk)
+                if pending_bytes >= _BULK_SPOOL_BYTES:
+                    await run_in_threadpool(f.write, b"".join(pending))
+                    pending, pending_bytes = [], 0
+            if pending:
+                await run_in_threadpool(f.write, b"".join(pending))
+        # valida columna/formato antes de empezar a responder
+        await run_in_threadpool(_probe_bulk, path, text_col, in_fmt)
+    except HTTPException:
+        os.remove(path)
+        raise
+    except Exception as e:
+        os.remove(path)
+        raise HTTPException(status_code=400, detail=str(e))
+
+    def body():
+        try:
+            yield from stream_scores(path, text_col=text_col, chunk_size=chunk_size, in_fmt=in_fmt, out_fmt=output)
+        finally:
+            os.remove(path)
+
+    media_type = "application/x-ndjson" if output == "ndjson" else "text/csv"
+    return StreamingResponse(body(), media_type=media_type)
+
+@app.post("/explain", response_model=ExplainResponse)
+def explain(req: ExplainRequest):
+    """Predicción y n-gramas que más aportan a las `top_k` clases más probables de cada texto."""
     try:
-        metrics, paths = retrain_from_records(
-            [it.model_dump() for it in req.instances],
-            strategy=req.strategy,
-            pipeline_name=req.pipeline
-        )
-        return {
-            "precision": metrics["precision"],
-            "recall": metrics["recall"],
-            "f1": metrics["f1"],
-            "model_version_path": paths["model_path"],
-        }
+        return explain_fn([it.textos for it in req.instances], top_k=req.top_k, n_terms=req.n_terms)
+    except NotExplainable as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/explain/top-terms")
+def explain_terms():
+    """Términos de mayor peso por clase del modelo activo (índice calculado al publicarlo)."""
+    try:
+        return explain_top_terms()
+    except NotExplainable as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.post("/retrain", response_model=RetrainJobResponse, status_code=202)
+def retrain(req: RetrainRequest):
+    """Encola el reentrenamiento y retorna el id del trabajo de inmediato."""
+    job = retrain_jobs.submit(
+        [it.model_dump() for it in req.instances],
+        strategy=req.strategy,
+        pipeline=req.pipeline,
+    )
+    return job.info()
+
+@app.get("/retrain/jobs", response_model=List[RetrainJobResponse])
+def retrain_jobs_list():
+    return [j.info() for j in retrain_jobs.list_jobs()]
+
+@app.get("/retrain/jobs/{job_id}", response_model=RetrainJobResponse)
+def retrain_job_status(job_id: str):
+    job = retrain_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Trabajo no encontrado: {job_id}")
+    return job.info()
+
+@app.get("/models", response_model=List[ModelVersion])
+def models_list():
+    """Versiones registradas en el índice, de la más reciente a la más antigua."""
+    return versions.list_versions()
+
+@app.post("/models/{version}/promote", response_model=ModelVersion)
+def models_promote(version: str):
+    try:
+        v = versions.promote(version)
+    except versions.VersionNotFound:
+        raise HTTPException(status_code=404, detail=f"Versión no encontrada: {version}")
+    registry.refresh()
+    return v | {"active": True}
+
+@app.post("/models/rollback", response_model=ModelVersion)
+def models_rollback():
+    try:
+        v = versions.rollback()
+    except versions.VersionNotFound as e:
+        raise HTTPException(status_code=409, detail=str(e.args[0]))
+    registry.refresh()
+    return v | {"active": True}
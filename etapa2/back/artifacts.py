@@ -0,0 +1,318 @@
+# etapa2/back/artifacts.py
+"""
+Formato de exportación de modelos pensado para carga rápida y memoria compartida.
+
+`model_<ts>.export/`:
+- manifest.json   tipo de artefacto y parámetros del vectorizador
+- vocab_terms.npy términos del vocabulario TF-IDF ordenados (bytes UTF-8, ancho fijo)
+- vocab_cols.npy  columna de cada término en la matriz
+- idf.npy         vector idf_
+- clf.joblib      resto del pipeline, sin comprimir (sus arrays numpy se abren con mmap)
+- stems.json      (opcional) tabla token -> forma del normalizador "fast" (ver utils.TextNormalizer)
+- explain*.npy, explain.json  (opcional) índice de términos por clase de `/explain` (ver explain.py)
+
+Tipo `compiled_linear` (svc_calibrated): en lugar de clf.joblib, los folds de
+CalibratedClassifierCV se compilan en un solo scorer lineal:
+- coef.npy        (n_features, folds*clases) con los coef_ de todos los folds apilados
+- intercept.npy, sig_a.npy, sig_b.npy   intercepto y calibrador sigmoide de cada columna
+- fold.npy, cls.npy                     fold y clase (índice en classes.npy) de cada columna
+
+Con `mmap_mode="r"` los arrays se mapean desde disco: varios workers comparten las mismas
+páginas en lugar de tener cada uno su copia del pickle.
+"""
+import os
+import json
+import shutil
+import uuid
+from typing import Optional
+
+import joblib
+import numpy as np
+import scipy.sparse as sp
+from scipy.special import expit
+
+# scikit-learn se importa dentro de las funciones: importar el módulo (api.py) no lo carga;
+# se carga al leer el primer modelo (warmup del API)
+
+EXPORT_FORMAT_VERSION = 1
+EXPORT_SUFFIX = ".export"
+STEMS_FILE = "stems.json"
+
+# compila svc_calibrated en un scorer lineal al exportar (MODEL_COMPILE=0 lo desactiva)
+MODEL_COMPILE = os.environ.get("MODEL_COMPILE", "1") == "1"
+COMPILE_ATOL = 1e-6
+
+# parámetros del vectorizador que definen el análisis y la ponderación (no el ajuste)
+_TFIDF_PARAMS = (
+    "input", "encoding", "decode_error", "strip_accents", "lowercase", "token_pattern",
+    "ngram_range", "analyzer", "binary", "norm", "use_idf", "smooth_idf", "sublinear_tf",
+)
+
+def export_path_for(model_path: str) -> str:
+    return os.path.splitext(model_path)[0] + EXPORT_SUFFIX
+
+class MappedTfidfVectorizer:
+    """`transform` equivalente a un TfidfVectorizer ajustado, con vocabulario en arrays ordenados."""
+    def __init__(self, params: dict, terms: np.ndarray, cols: np.ndarray, idf: np.ndarray):
+        self.params = params
+        self.terms = terms
+        self.cols = cols
+        self.idf_ = idf
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.preprocessing import normalize
+        self._analyzer = TfidfVectorizer(**params).build_analyzer()
+        self._normalize = normalize
+
+    @property
+    def n_features(self) -> int:
+        return self.idf_.shape[0]
+
+    def _counts(self, raw_documents: list) -> sp.csr_matrix:
+        analyze = self._analyzer
+        n_docs = len(raw_documents)
+        feats, doc_ids = [], []
+        for i, doc in enumerate(raw_documents):
+            f = analyze(doc)
+            feats.extend(f)
+            doc_ids.extend([i] * len(f))
+
+        if not feats:
+            return sp.csr_matrix((n_docs, self.n_features), dtype=np.float64)
+
+        # búsqueda vectorizada de todos los n-gramas del lote en el vocabulario ordenado
+        keys = np.array([t.encode("utf-8") for t in feats])
+        pos = np.searchsorted(self.terms, keys)
+        pos[pos >= len(self.terms)] = 0
+        hit = self.terms[pos] == keys
+        rows = np.asarray(doc_ids, dtype=np.int64)[hit]
+        cols = self.cols[pos[hit]]
+        X = sp.csr_matrix(
+            (np.ones(len(rows), dtype=np.float64), (rows, cols)),
+            shape=(n_docs, self.n_features),
+        )
+        X.sum_duplicates()
+        X.sort_indices()
+        return X
+
+    def transform(self, raw_documents) -> sp.csr_matrix:
+        raw_documents = list(raw_documents)
+        X = self._counts(raw_documents)
+        if self.params.get("binary"):
+            X.data.fill(1.0)
+        if self.params.get("sublinear_tf"):
+            np.log(X.data, X.data)
+            X.data += 1.0
+        if self.params.get("use_idf", True):
+            X.data *= self.idf_[X.indices]
+        if self.params.get("norm") is not None:
+            X = self._normalize(X, norm=self.params["norm"], copy=False)
+        return X
+
+class CompiledCalibratedLinear:
+    """
+    CalibratedClassifierCV(método sigmoide, estimador lineal) reducido a una matmul por lote:
+    decisiones de todos los folds -> sigmoides vectorizadas -> normalización por fold -> promedio.
+    """
+    def __init__(self, classes, coef, intercept, sig_a, sig_b, fold, cls):
+        self.classes_ = classes
+        self.coef = coef            # (n_features, R)
+        self.intercept = intercept  # (R,)
+        self.sig_a = sig_a
+        self.sig_b = sig_b
+        self.fold = fold
+        self.cls = cls
+        self.n_folds = int(fold.max()) + 1
+
+    @classmethod
+    def from_calibrated(cls_, clf: "CalibratedClassifierCV") -> "CompiledCalibratedLinear":
+        classes = np.asarray(clf.classes_)
+        n_classes = len(classes)
+        coefs, intercepts, a, b, folds, idx = [], [], [], [], [], []
+        for f, cc in enumerate(clf.calibrated_classifiers_):
+            est = cc.estimator
+            if getattr(cc, "method", "sigmoid") != "sigmoid" or not hasattr(est, "coef_"):
+                raise ValueError("Solo se compilan calibraciones sigmoide sobre estimadores lineales.")
+            coef = np.atleast_2d(np.asarray(est.coef_.toarray() if sp.issparse(est.coef_) else est.coef_, dtype=np.float64))
+            pos = np.searchsorted(classes, est.classes_)
+            if n_classes == 2:
+                pos = pos[:1] + 1  # binario: una sola decisión, la de classes_[1]
+            for j, calibrator in enumerate(cc.calibrators):
+                coefs.append(coef[j])
+                intercepts.append(float(np.ravel(est.intercept_)[j]))
+                a.append(float(calibrator.a_))
+                b.append(float(calibrator.b_))
+                folds.append(f)
+                idx.append(int(pos[j]))
+        return cls_(
+            classes,
+            np.ascontiguousarray(np.vstack(coefs).T),
+            np.asarray(intercepts), np.asarray(a), np.asarray(b),
+            np.asarray(folds, dtype=np.int32), np.asarray(idx, dtype=np.int32),
+        )
+
+    def predict_proba(self, X) -> np.ndarray:
+        D = X @ self.coef
+        D += self.intercept
+        P = expit(-(self.sig_a * D + self.sig_b))
+
+        n, n_classes = P.shape[0], len(self.classes_)
+        proba = np.zeros((n, self.n_folds, n_classes))
+        proba[:, self.fold, self.cls] = P
+        if n_classes == 2:
+            proba[:, :, 0] = 1.0 - proba[:, :, 1]
+        else:
+            denom = proba.sum(axis=2, keepdims=True)
+            proba = np.divide(proba, denom, out=np.full_like(proba, 1.0 / n_classes), where=denom != 0)
+        proba[(1.0 < proba) & (proba <= 1.0 + 1e-5)] = 1.0
+        return proba.mean(axis=1)
+
+    def predict(self, X) -> np.ndarray:
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+    def save(self, path: str):
+        np.save(os.path.join(path, "classes.npy"), self.classes_)
+        for name in ("coef", "intercept", "sig_a", "sig_b", "fold", "cls"):
+            np.save(os.path.join(path, f"{name}.npy"), getattr(self, name))
+
+    @classmethod
+    def load(cls_, path: str, mmap_mode: Optional[str] = "r") -> "CompiledCalibratedLinear":
+        arr = lambda name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+        return cls_(np.load(os.path.join(path, "classes.npy")),
+                    arr("coef"), arr("intercept"), arr("sig_a"), arr("sig_b"), arr("fold"), arr("cls"))
+
+def _compile_check(clf, compiled: CompiledCalibratedLinear, n_features: int, n_rows: int = 256) -> float:
+    """Máxima diferencia absoluta vs `clf.predict_proba` sobre filas TF-IDF sintéticas (normalizadas L2)."""
+    from sklearn.preprocessing import normalize
+    rng = np.random.default_rng(0)
+    X = sp.random(n_rows, n_features, density=min(1.0, 40 / max(n_features, 1)), format="csr", random_state=rng)
+    X = normalize(X)
+    return float(np.abs(compiled.predict_proba(X) - clf.predict_proba(X)).max())
+
+def compile_classifier(clf) -> Optional[CompiledCalibratedLinear]:
+    """Versión compilada de `clf` si es compilable y coincide con `predict_proba`; None en otro caso."""
+    from sklearn.calibration import CalibratedClassifierCV
+    if not isinstance(clf, CalibratedClassifierCV) or np.asarray(clf.classes_).dtype == object:
+        return None
+    try:
+        compiled = CompiledCalibratedLinear.from_calibrated(clf)
+    except (ValueError, AttributeError):
+        return None
+    if _compile_check(clf, compiled, compiled.coef.shape[0]) > COMPILE_ATOL:
+        return None
+    return compiled
+
+class MappedPipeline:
+    """Vectorizador mapeado + clasificador (cargado con mmap). Misma API que el Pipeline."""
+    def __init__(self, vectorizer: MappedTfidfVectorizer, clf):
+        self.vectorizer = vectorizer
+        self.clf = clf
+
+    @property
+    def classes_(self):
+        return self.clf.classes_
+
+    def predict(self, X):
+        return self.clf.predict(self.vectorizer.transform(X))
+
+    def predict_proba(self, X):
+        return self.clf.predict_proba(self.vectorizer.transform(X))
+
+def _tfidf_step(model) -> Optional["TfidfVectorizer"]:
+    from sklearn.pipeline import Pipeline
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    if isinstance(model, Pipeline) and len(model.steps) >= 2 and isinstance(model.steps[0][1], TfidfVectorizer):
+        return model.steps[0][1]
+    return None
+
+def _save_vectorizer(path: str, vec: "TfidfVectorizer") -> dict:
+    items = sorted((t.encode("utf-8"), j) for t, j in vec.vocabulary_.items())
+    np.save(os.path.join(path, "vocab_terms.npy"), np.array([t for t, _ in items]))
+    np.save(os.path.join(path, "vocab_cols.npy"), np.array([j for _, j in items], dtype=np.int32))
+    np.save(os.path.join(path, "idf.npy"), np.asarray(vec.idf_, dtype=np.float64))
+    params = {k: v for k, v in vec.get_params().items() if k in _TFIDF_PARAMS}
+    params["ngram_range"] = list(params["ngram_range"])
+    return params
+
+def _load_vectorizer(path: str, params: dict, mmap_mode: Optional[str]) -> MappedTfidfVectorizer:
+    params = dict(params)
+    params["ngram_range"] = tuple(params["ngram_range"])
+    return MappedTfidfVectorizer(
+        params,
+        terms=np.load(os.path.join(path, "vocab_terms.npy"), mmap_mode=mmap_mode),
+        cols=np.load(os.path.join(path, "vocab_cols.npy"), mmap_mode=mmap_mode),
+        idf=np.load(os.path.join(path, "idf.npy"), mmap_mode=mmap_mode),
+    )
+
+def export_model(model, export_dir: str, compile: bool = MODEL_COMPILE, stem_table: Optional[dict] = None,
+                 explain_index=None) -> str:
+    """
+    Escribe el formato mmap de `model` en `export_dir` (a un temporal y luego rename).
+    Pipelines TF-IDF -> vocabulario/idf como arrays y, si `compile` y el clasificador lo permite,
+    el scorer lineal compilado; cualquier otro modelo (p. ej. sgd_online) -> un joblib sin
+    comprimir cuyos arrays también se abren con mmap. `stem_table` se guarda en stems.json y
+    `explain_index` (explain.ExplainIndex) en sus propios archivos.
+    """
+    from sklearn.pipeline import Pipeline
+    tmp = f"{export_dir}.{uuid.uuid4().hex[:8]}.tmp"
+    os.makedirs(tmp)
+    try:
+        vec = _tfidf_step(model)
+        if vec is not None:
+            params = _save_vectorizer(tmp, vec)
+            rest = model.steps[1][1] if len(model.steps) == 2 else Pipeline(model.steps[1:])
+            compiled = compile_classifier(rest) if compile else None
+            if compiled is not None:
+                compiled.save(tmp)
+                manifest = {"format": EXPORT_FORMAT_VERSION, "type": "compiled_linear", "vectorizer": params}
+            else:
+                joblib.dump(rest, os.path.join(tmp, "clf.joblib"))
+                manifest = {"format": EXPORT_FORMAT_VERSION, "type": "tfidf_mmap", "vectorizer": params}
+        else:
+            joblib.dump(model, os.path.join(tmp, "model.joblib"))
+            manifest = {"format": EXPORT_FORMAT_VERSION, "type": "joblib_mmap"}
+        if stem_table:
+            with open(os.path.join(tmp, STEMS_FILE), "w", encoding="utf-8") as f:
+                json.dump(stem_table, f, ensure_ascii=False, separators=(",", ":"))
+            manifest["stems"] = STEMS_FILE
+        if explain_index is not None:
+            explain_index.save(tmp)
+            manifest["explain"] = True
+        with open(os.path.join(tmp, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        if os.path.isdir(export_dir):
+            shutil.rmtree(export_dir)
+        os.replace(tmp, export_dir)
+    except Exception:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return export_dir
+
+def load_stem_table(export_dir: str) -> Optional[dict]:
+    """Tabla del normalizador guardada con la exportación (None si no hay)."""
+    path = os.path.join(export_dir, STEMS_FILE)
+    if not os.path.isfile(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def load_export(export_dir: str, mmap_mode: Optional[str] = "r"):
+    with open(os.path.join(export_dir, "manifest.json"), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    kind = manifest.get("type")
+
+    if kind == "tfidf_mmap":
+        vec = _load_vectorizer(export_dir, manifest["vectorizer"], mmap_mode)
+        clf = joblib.load(os.path.join(export_dir, "clf.joblib"), mmap_mode=mmap_mode)
+        return MappedPipeline(vec, clf)
+
+    if kind == "compiled_linear":
+        vec = _load_vectorizer(export_dir, manifest["vectorizer"], mmap_mode)
+        return MappedPipeline(vec, CompiledCalibratedLinear.load(export_dir, mmap_mode=mmap_mode))
+
+    if kind == "joblib_mmap":
+        return joblib.load(os.path.join(export_dir, "model.joblib"), mmap_mode=mmap_mode)
+
+    raise ValueError(f"Tipo de artefacto no soportado: {kind}")
@@ -0,0 +1,157 @@
+# etapa2/back/batching.py
+import os
+import time
+import asyncio
+import queue
+import threading
+from concurrent.futures import Future, InvalidStateError
+from typing import Callable, List, Optional
+
+from .metrics import Histogram
+
+# Micro-batching de /predict (opcional): PREDICT_BATCHING=1 lo activa
+PREDICT_BATCHING = os.environ.get("PREDICT_BATCHING", "0") == "1"
+PREDICT_BATCH_WINDOW_MS = float(os.environ.get("PREDICT_BATCH_WINDOW_MS", "5"))
+PREDICT_BATCH_MAX_TEXTS = int(os.environ.get("PREDICT_BATCH_MAX_TEXTS", "64"))
+PREDICT_BATCH_QUEUE_DEPTH = int(os.environ.get("PREDICT_BATCH_QUEUE_DEPTH", "1024"))
+
+class BatcherFull(RuntimeError):
+    """La cola del batcher alcanzó su profundidad máxima."""
+
+class MicroBatcher:
+    """
+    Junta peticiones concurrentes de /predict durante `window_ms` o hasta `max_texts`
+    textos, las pasa por `fn` como un único lote y reparte los resultados en orden.
+    """
+    def __init__(
+        self,
+        fn: Callable[[List[str]], List[dict]],
+        window_ms: float = PREDICT_BATCH_WINDOW_MS,
+        max_texts: int = PREDICT_BATCH_MAX_TEXTS,
+        queue_depth: int = PREDICT_BATCH_QUEUE_DEPTH,
+    ):
+        self.fn = fn
+        self.window = window_ms / 1000.0
+        self.max_texts = max(1, max_texts)
+        self._queue: "queue.Queue" = queue.Queue(maxsize=queue_depth)
+        self._carry = None
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.batch_sizes = Histogram([1, 2, 4, 8, 16, 32, 64, 128, 256])
+        self.queue_wait_ms = Histogram([0.5, 1, 2, 5, 10, 25, 50, 100, 250])
+        self.rejected = 0
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._loop, name="predict-batcher", daemon=True)
+                    self._thread.start()
+
+    def enqueue(self, texts: List[str]) -> Future:
+        """Encola `texts`; el Future se resuelve con sus predicciones (mismo orden y cardinalidad)."""
+        self._ensure_thread()
+        fut: Future = Future()
+        try:
+            self._queue.put_nowait((list(texts), fut, time.perf_counter()))
+        except queue.Full:
+            with self._stats_lock:
+                self.rejected += 1
+            raise BatcherFull("Cola de predicción llena; intenta de nuevo.")
+        return fut
+
+    def submit(self, texts: List[str]) -> List[dict]:
+        """Bloquea hasta tener las predicciones de `texts`."""
+        return self.enqueue(texts).result()
+
+    async def submit_async(self, texts: List[str]) -> List[dict]:
+        """
+        Como `submit`, pero espera en el event loop: no ocupa un hilo del threadpool, así que
+        las peticiones en espera las limita `queue_depth` y no el tamaño del threadpool.
+        """
+        return await asyncio.wrap_future(self.enqueue(texts))
+
+    def _next_item(self, timeout: Optional[float]):
+        if self._carry is not None:
+            item, self._carry = self._carry, None
+            return item
+        return self._queue.get(timeout=timeout) if timeout is not None else self._queue.get()
+
+    def _collect(self) -> list:
+        batch = [self._next_item(None)]
+        n = len(batch[0][0])
+        deadline = time.perf_counter() + self.window
+        while n < self.max_texts:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = self._next_item(remaining)
+            except queue.Empty:
+                break
+            if n + len(item[0]) > self.max_texts:
+                self._carry = item  # abre el siguiente lote
+                break
+            batch.append(item)
+            n += len(item[0])
+        return batch
+
+    @staticmethod
+    def _settle(fut: Future, result=None, error: Optional[BaseException] = None):
+        """Entrega el resultado; un Future ya resuelto o cancelado no detiene el hilo del batcher."""
+        try:
+            if error is not None:
+                fut.set_exception(error)
+            else:
+                fut.set_result(result)
+        except InvalidStateError:
+            pass
+
+    def _loop(self):
+        while True:
+            # las peticiones canceladas mientras esperaban (cliente desconectado, timeout) se descartan;
+            # las demás pasan a "running" y ya no se pueden cancelar
+            batch = [item for item in self._collect() if item[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            started = time.perf_counter()
+            texts = [t for item in batch for t in item[0]]
+            with self._stats_lock:
+                self.batch_sizes.observe(len(texts))
+                for _, _, enqueued in batch:
+                    self.queue_wait_ms.observe((started - enqueued) * 1000.0)
+            try:
+                results = self.fn(texts)
+            except Exception as e:
+                self._run_each(batch, e)
+                continue
+            i = 0
+            for item_texts, fut, _ in batch:
+                self._settle(fut, results[i:i + len(item_texts)])
+                i += len(item_texts)
+
+    def _run_each(self, batch: list, error: Exception):
+        """El lote falló: cada petición se predice por separado para que el error quede solo en la que lo causó."""
+        if len(batch) == 1:
+            self._settle(batch[0][1], error=error)
+            return
+        for item_texts, fut, _ in batch:
+            try:
+                result = self.fn(item_texts)
+            except Exception as e:
+                self._settle(fut, error=e)
+            else:
+                self._settle(fut, result)
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "window_ms": self.window * 1000.0,
+                "max_texts": self.max_texts,
+                "queue_depth": self._queue.maxsize,
+                "queued": self._queue.qsize(),
+                "rejected": self.rejected,
+                "batch_size": self.batch_sizes.snapshot(),
+                "queue_wait_ms": self.queue_wait_ms.snapshot(),
+            }
@@ -0,0 +1,1142 @@
+# etapa2/back/benchmark.py
+"""
+Chequeos de paridad y benchmarks reproducibles del backend.
+
+Uso:
+    python -m etapa2.back.benchmark parity
+    python -m etapa2.back.benchmark clean --sizes 2824 11296 45184 --workers 1 2 4 8
+    python -m etapa2.back.benchmark load --model etapa2/retrain_models/model_X.pkl --workers 4
+    python -m etapa2.back.benchmark compile --model etapa2/retrain_models/model_X.pkl
+    python -m etapa2.back.benchmark online --store-sizes 2824 11296 45184 --batch-sizes 30 300
+    python -m etapa2.back.benchmark features --store-sizes 2824 11296 45184 --batch-sizes 30 300
+    python -m etapa2.back.benchmark explain --batch-sizes 1 16 256
+    python -m etapa2.back.benchmark stress --workers 2 --retrains 3
+    python -m etapa2.back.benchmark suite --output bench.json
+    python -m etapa2.back.benchmark compare bench_antes.json bench_despues.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import tempfile
+import contextlib
+import subprocess
+import multiprocessing as mp
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from . import utils
+from .utils import limpiar_texto, TextNormalizer, normalize_series
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CORPUS = os.path.normpath(os.path.join(BASE_DIR, "..", "..", "data", "datos_originales_totales.xlsx"))
+
+def load_corpus(path: str = DEFAULT_CORPUS) -> list:
+    return pd.read_excel(path)["textos"].tolist()
+
+# casos que el corpus no cubre: contracciones que word_tokenize separa, espacios raros, vacíos
+PARITY_EDGE_CASES = [
+    "cannot wanna gonna gimme gotta lemme", "wanna", "CANNOT", "cannotá gonnas", "",
+    "  \t\n ", "123 !!", "ñandú ÜBER\u00a0más\u2003acción",
+]
+
+def normalizer_parity(path: str = DEFAULT_CORPUS) -> dict:
+    """
+    Compara byte a byte `TextNormalizer.transform` (engines "nltk" y "fast") contra `limpiar_texto`
+    documento a documento, y mide docs/s de cada engine en frío, en caliente y con la tabla precargada.
+    """
+    texts = load_corpus(path) + PARITY_EDGE_CASES
+
+    t0 = time.perf_counter()
+    expected = [limpiar_texto(t) for t in texts]
+    t_ref = time.perf_counter() - t0
+    out = {"n_docs": len(texts), "limpiar_texto_docs_per_s": len(texts) / t_ref, "mismatches": 0}
+
+    for engine in ("nltk", "fast"):
+        norm = TextNormalizer(engine=engine)
+        for rnd in ("cold", "warm"):
+            t0 = time.perf_counter()
+            got = norm.transform(texts)
+            out[f"{engine}_{rnd}_docs_per_s"] = len(texts) / (time.perf_counter() - t0)
+        mismatches = [i for i, (a, b) in enumerate(zip(expected, got)) if a.encode("utf-8") != b.encode("utf-8")]
+        out[f"{engine}_mismatches"] = len(mismatches)
+        out[f"{engine}_first_mismatches"] = mismatches[:10]
+        out["mismatches"] += len(mismatches)
+
+    # proceso nuevo que carga la tabla persistida con el modelo: sin llamadas al stemmer
+    table = json.loads(json.dumps(norm.stem_table()))
+    fresh = TextNormalizer(engine="fast")
+    fresh.load_stem_table(table)
+    t0 = time.perf_counter()
+    got = fresh.transform(texts)
+    out["fast_preloaded_docs_per_s"] = len(texts) / (time.perf_counter() - t0)
+    out["fast_preloaded_oov_lookups"] = fresh.oov_lookups
+    out["fast_preloaded_mismatches"] = sum(a != b for a, b in zip(expected, got))
+    out["mismatches"] += out["fast_preloaded_mismatches"]
+    out["stem_table_entries"] = len(table["forms"])
+    out["speedup_fast_vs_nltk_warm"] = out["fast_warm_docs_per_s"] / out["nltk_warm_docs_per_s"]
+    out["speedup_fast_vs_limpiar_texto"] = out["fast_warm_docs_per_s"] / out["limpiar_texto_docs_per_s"]
+    return out
+
+def synthetic_corpus(texts: list, n: int) -> list:
+    """Repite el corpus hasta `n` documentos (el vocabulario no crece, como en producción)."""
+    reps = -(-n // len(texts))
+    return (texts * reps)[:n]
+
+def clean_scaling(path: str = DEFAULT_CORPUS, sizes=(2824, 11296, 45184), workers=(1, 2, 4, 8), chunk_size: int = 500) -> list:
+    """Tiempo de `normalize_series` por tamaño de corpus y número de procesos (pool incluido)."""
+    base = load_corpus(path)
+    rows = []
+    for n in sizes:
+        s = pd.Series(synthetic_corpus(base, n), name="textos")
+        t_serial = None
+        for w in workers:
+            utils._normalizer = None  # memo frío en cada corrida (los hijos heredan el del padre)
+            t0 = time.perf_counter()
+            normalize_series(s, n_jobs=w, chunk_size=chunk_size, min_rows=0)
+            dt = time.perf_counter() - t0
+            if w == 1:
+                t_serial = dt
+            rows.append({
+                "n_docs": n,
+                "workers": w,
+                "chunk_size": chunk_size,
+                "seconds": dt,
+                "docs_per_s": n / dt,
+                "speedup_vs_serial": (t_serial / dt) if t_serial else None,
+            })
+    return rows
+
+def _memory_kb() -> dict:
+    """Rss/Pss del proceso actual (kB) según /proc/self/smaps_rollup (solo Linux)."""
+    out = {}
+    try:
+        with open("/proc/self/smaps_rollup", "r") as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                if key in ("Rss", "Pss"):
+                    out[key.lower() + "_kb"] = int(rest.split()[0])
+    except OSError:
+        pass
+    return out
+
+def _load_worker(model_path: str, fmt: str, sample: list, barrier, results):
+    from .artifacts import export_path_for, load_export
+    import joblib
+    t0 = time.perf_counter()
+    model = load_export(export_path_for(model_path)) if fmt == "export" else joblib.load(model_path)
+    load_s = time.perf_counter() - t0
+    model.predict_proba(sample)  # toca las páginas que usa una predicción real
+    barrier.wait()  # todos los workers residentes a la vez: el Pss reparte las páginas compartidas
+    results.put({"format": fmt, "load_seconds": load_s, **_memory_kb()})
+    barrier.wait()
+
+def load_comparison(model_path: str, workers: int = 4, sample_size: int = 256, path: str = DEFAULT_CORPUS) -> dict:
+    """Tiempo de carga y memoria por worker: .pkl vs exportación mmap (se exporta a un temporal si falta)."""
+    import joblib
+    from .artifacts import export_model, export_path_for
+
+    tmp = None
+    if not os.path.isdir(export_path_for(model_path)):
+        tmp = tempfile.mkdtemp(prefix="bench_export_")
+        link = os.path.join(tmp, os.path.basename(model_path))
+        os.symlink(os.path.abspath(model_path), link)
+        export_model(joblib.load(model_path), export_path_for(link))
+        model_path = link
+
+    sample = TextNormalizer().transform(load_corpus(path)[:sample_size])
+    ctx = mp.get_context("spawn")
+    out = {"model": model_path, "workers": workers}
+    try:
+        for fmt in ("pkl", "export"):
+            barrier, results = ctx.Barrier(workers + 1), ctx.Queue()
+            procs = [ctx.Process(target=_load_worker, args=(model_path, fmt, sample, barrier, results)) for _ in range(workers)]
+            for pr in procs:
+                pr.start()
+            barrier.wait()
+            rows = [results.get() for _ in procs]
+            barrier.wait()
+            for pr in procs:
+                pr.join()
+            out[fmt] = {
+                "load_seconds_avg": sum(r["load_seconds"] for r in rows) / len(rows),
+                "rss_kb_avg": sum(r.get("rss_kb", 0) for r in rows) / len(rows),
+                "pss_kb_avg": sum(r.get("pss_kb", 0) for r in rows) / len(rows),
+                "workers": rows,
+            }
+    finally:
+        if tmp:
+            import shutil
+            shutil.rmtree(tmp, ignore_errors=True)
+    return out
+
+def compile_comparison(model_path: str, batch_sizes=(1, 16, 256), repeats: int = 20, path: str = DEFAULT_CORPUS) -> dict:
+    """CalibratedClassifierCV vs scorer lineal compilado: diferencia máxima y latencia del clasificador por lote."""
+    import joblib
+    import numpy as np
+    from .artifacts import compile_classifier
+
+    model = joblib.load(model_path)
+    vec, clf = model.steps[0][1], model.steps[-1][1]
+    compiled = compile_classifier(clf)
+    if compiled is None:
+        return {"model": model_path, "compiled": False}
+
+    X = vec.transform(TextNormalizer().transform(load_corpus(path)))
+    out = {"model": model_path, "compiled": True,
+           "max_abs_diff": float(np.abs(compiled.predict_proba(X) - clf.predict_proba(X)).max()),
+           "batches": []}
+    for bs in batch_sizes:
+        Xb = X[:bs]
+        row = {"batch_size": bs}
+        for name, fn in (("sklearn_ms", clf.predict_proba), ("compiled_ms", compiled.predict_proba)):
+            t0 = time.perf_counter()
+            for _ in range(repeats):
+                fn(Xb)
+            row[name] = (time.perf_counter() - t0) * 1000.0 / repeats
+        row["speedup"] = row["sklearn_ms"] / row["compiled_ms"]
+        out["batches"].append(row)
+    return out
+
+def online_comparison(path: str = DEFAULT_CORPUS, store_sizes=(2824, 11296, 45184), batch_sizes=(30, 300),
+                      repeats: int = 3) -> list:
+    """
+    Costo de una actualización `online`: reconstrucción (fit del store + partial_fit del lote, el
+    comportamiento anterior) vs incremental (cargar el padre + partial_fit solo del lote).
+    """
+    import joblib
+    import numpy as np
+    from .pipelines import build_pipeline
+    from .retrain_service import online_update
+
+    df = pd.read_excel(path)[["textos", "labels"]].dropna()
+    X_base = np.asarray(TextNormalizer().transform(df["textos"].astype(str).tolist()), dtype=object)
+    y_base = df["labels"].astype(int).to_numpy()
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        parent_path = os.path.join(tmp, "parent.pkl")
+        for n in store_sizes:
+            idx = np.arange(n) % len(X_base)
+            X0, y0 = X_base[idx], y_base[idx]
+            joblib.dump(build_pipeline("sgd_online").fit(X0, y0), parent_path)
+            for b in batch_sizes:
+                Xn, yn = X_base[:b], y_base[:b]
+                row = {"store_rows": n, "batch_rows": b}
+                t0 = time.perf_counter()
+                for _ in range(repeats):
+                    pipe = build_pipeline("sgd_online").fit(X0, y0)
+                    pipe.partial_fit(Xn, yn)
+                row["rebuild_ms"] = (time.perf_counter() - t0) * 1000.0 / repeats
+                t0 = time.perf_counter()
+                for _ in range(repeats):
+                    online_update(joblib.load(parent_path), Xn, yn)
+                row["incremental_ms"] = (time.perf_counter() - t0) * 1000.0 / repeats
+                row["speedup"] = row["rebuild_ms"] / row["incremental_ms"]
+                rows.append(row)
+    return rows
+
+def feature_cache_comparison(path: str = DEFAULT_CORPUS, store_sizes=(2824, 11296, 45184), batch_sizes=(30, 300),
+                             vectorizer_params=None) -> list:
+    """
+    TF-IDF de un reentrenamiento: ajuste completo sobre store + lote vs conteos cacheados del store
+    (leídos de disco) + conteo del lote + `fit_from_counts`. Verifica paridad con el ajuste completo:
+    mismo vocabulario e idf_, matriz idéntica a su `transform` y a su `fit_transform` salvo
+    redondeo (sklearn suma la norma de cada fila en otro orden).
+    """
+    import numpy as np
+    from .pipelines import build_vectorizer
+    from . import features
+
+    base = TextNormalizer().transform(load_corpus(path))
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        seg_path = os.path.join(tmp, "segment.npz")
+        for n in store_sizes:
+            X0 = synthetic_corpus(base, n)
+            features._save(seg_path, features.count_documents(build_vectorizer(vectorizer_params), X0))
+            for b in batch_sizes:
+                Xn = [f"{t} lote{b}" for t in base[:b]]
+                row = {"store_rows": n, "batch_rows": b}
+
+                fresh = build_vectorizer(vectorizer_params)
+                t0 = time.perf_counter()
+                A = fresh.fit_transform(X0 + Xn)
+                row["full_fit_ms"] = (time.perf_counter() - t0) * 1000.0
+
+                vec = build_vectorizer(vectorizer_params)
+                t0 = time.perf_counter()
+                counts = features.merge_counts([features._load(seg_path), features.count_documents(vec, Xn)])
+                B = features.fit_from_counts(vec, counts)
+                row["cached_ms"] = (time.perf_counter() - t0) * 1000.0
+                row["speedup"] = row["full_fit_ms"] / row["cached_ms"]
+
+                row["same_vocabulary"] = fresh.vocabulary_ == vec.vocabulary_
+                row["same_idf"] = bool(np.array_equal(fresh.idf_, vec.idf_))
+                row["max_abs_diff_transform"] = float(abs(fresh.transform(X0 + Xn) - B).max())
+                row["max_abs_diff_fit_transform"] = float(abs(A - B).max())
+                rows.append(row)
+    return rows
+
+def cv_comparison(path: str = DEFAULT_CORPUS, store_sizes=(2824, 11296), k: int = 5, pipeline: str = "svc_calibrated",
+                  n_jobs: int = -1) -> list:
+    """
+    Validación cruzada de un candidato: k ajustes completos del pipeline sobre los textos (TF-IDF
+    re-tokenizado por fold, en serie) vs los folds de evaluation.py sobre conteos compartidos
+    (en serie y en paralelo). Verifica que las métricas por fold coincidan.
+    """
+    from functools import partial
+    from .pipelines import build_pipeline
+    from .evaluation import cross_validate
+    from . import features
+
+    df = pd.read_excel(path)[["textos", "labels"]].dropna()
+    make_pipe = partial(build_pipeline, name=pipeline)
+    rows = []
+    for n in store_sizes:
+        data = synthetic_labeled(df, n, seed=n)
+        X = TextNormalizer().transform(data["textos"].tolist())
+        y = data["labels"].astype(int).to_numpy()
+        row = {"store_rows": n, "folds": k, "pipeline": pipeline}
+
+        t0 = time.perf_counter()
+        naive = cross_validate(make_pipe, y, X=X, k=k, n_jobs=1)
+        row["refit_per_fold_ms"] = (time.perf_counter() - t0) * 1000.0
+
+        t0 = time.perf_counter()
+        counts = features.count_documents(make_pipe().steps[0][1], X)
+        row["count_once_ms"] = (time.perf_counter() - t0) * 1000.0
+        t0 = time.perf_counter()
+        shared = cross_validate(make_pipe, y, counts=counts, k=k, n_jobs=1)
+        row["shared_counts_ms"] = (time.perf_counter() - t0) * 1000.0
+        t0 = time.perf_counter()
+        cross_validate(make_pipe, y, counts=counts, k=k, n_jobs=n_jobs)
+        row["shared_counts_parallel_ms"] = (time.perf_counter() - t0) * 1000.0
+        row["speedup"] = row["refit_per_fold_ms"] / row["shared_counts_parallel_ms"]
+
+        row["cv_f1"] = shared["mean"]["f1"]
+        row["max_abs_diff_fold_f1"] = max(abs(a["f1"] - b["f1"]) for a, b in zip(naive["per_fold"], shared["per_fold"]))
+        rows.append(row)
+    return rows
+
+def neardup_comparison(path: str = DEFAULT_CORPUS, store_sizes=(2824, 11296, 45184), batch_rows: int = 300,
+                       threshold: float = 0.9) -> list:
+    """
+    Índice MinHash/LSH: firmas del store (arranque en frío), bandas y consulta de un lote de
+    variantes (1-4 palabras menos) vs comparar cada firma del lote contra todo el store.
+    `recall` es la fracción de lo que encuentra la comparación exhaustiva que también encuentra LSH.
+    """
+    import numpy as np
+    from .neardup import MinHasher, NearDupIndex
+
+    base = TextNormalizer().transform(load_corpus(path))
+    rng = random.Random(0)
+    rows = []
+    for n in store_sizes:
+        store = synthetic_corpus(base, n)
+        batch = []
+        for _ in range(batch_rows):
+            words = store[rng.randrange(n)].split()
+            for _ in range(rng.randint(1, 4)):
+                if len(words) > 3:
+                    words.pop(rng.randrange(len(words)))
+            batch.append(" ".join(words))
+
+        idx = NearDupIndex(MinHasher())
+        row = {"store_rows": n, "batch_rows": batch_rows, "threshold": threshold}
+        t0 = time.perf_counter()
+        idx.sigs = idx.hasher.signatures(store)
+        row["store_signatures_ms"] = (time.perf_counter() - t0) * 1000.0
+        idx.hashes, idx._files = np.arange(n).astype(str), ("bench",)
+        t0 = time.perf_counter()
+        idx.table(threshold)
+        row["bands_ms"] = (time.perf_counter() - t0) * 1000.0
+
+        t0 = time.perf_counter()
+        Q = idx.hasher.signatures(batch)
+        best, _ = idx.query(Q, threshold)
+        row["lsh_query_ms"] = (time.perf_counter() - t0) * 1000.0
+        t0 = time.perf_counter()
+        Q = idx.hasher.signatures(batch)
+        exhaustive = np.array([(q == idx.sigs).mean(axis=1).max() >= threshold for q in Q])
+        row["exhaustive_ms"] = (time.perf_counter() - t0) * 1000.0
+        row["speedup"] = row["exhaustive_ms"] / row["lsh_query_ms"]
+        row["near_duplicates"] = int((best >= 0).sum())
+        row["recall"] = float(((best >= 0) & exhaustive).sum() / max(exhaustive.sum(), 1))
+        rows.append(row)
+    return rows
+
+# ===== Arranque del API =====
+# corre en un intérprete nuevo: el tiempo de import solo es válido si nada se importó antes
+_STARTUP_PROBE = r"""
+import sys, json, time, asyncio
+t0 = time.perf_counter()
+import {pkg}.api as api
+import_s = time.perf_counter() - t0
+loaded = [m for m in ("sklearn", "nltk", "scipy.stats", "pandas", "fastapi") if m in sys.modules]
+from {pkg}.benchmark import _asgi_request
+
+async def main():
+    out = {{"import_seconds": import_s, "modules_after_import": loaded}}
+    async with api.app.router.lifespan_context(api.app):
+        out["warmup_seconds"] = time.perf_counter() - t0 - import_s
+        body = json.dumps({{"instances": [{{"textos": {text!r}}}]}}).encode()
+        for key in ("first_predict_ms", "second_predict_ms"):
+            t = time.perf_counter()
+            status, _ = await _asgi_request(api.app, "POST", "/predict", body)
+            out[key] = (time.perf_counter() - t) * 1000.0
+            out.setdefault("statuses", []).append(status)
+        out["time_to_first_prediction_s"] = out["import_seconds"] + out["warmup_seconds"] + out["first_predict_ms"] / 1000.0
+        out["model"] = api.registry.info()
+    return out
+
+print(json.dumps(asyncio.run(main())))
+"""
+
+def startup_comparison(modes=("sync", "off"), runs: int = 3,
+                       text: str = "El acceso al agua potable y la educación rural siguen siendo un reto") -> dict:
+    """
+    Por modo de API_WARMUP, `runs` procesos nuevos: tiempo de `import api`, del warmup (lifespan),
+    de la primera y segunda petición a /predict y el total hasta la primera predicción (medianas).
+    """
+    import numpy as np
+    pkg = __package__ or "etapa2.back"
+    root = os.path.normpath(os.path.join(BASE_DIR, "..", ".."))
+    script = _STARTUP_PROBE.format(pkg=pkg, text=text)
+    out = {}
+    for mode in modes:
+        env = dict(os.environ, API_WARMUP=mode, PYTHONWARNINGS="ignore")
+        rows = []
+        for _ in range(runs):
+            res = subprocess.run([sys.executable, "-c", script], cwd=root, env=env,
+                                 capture_output=True, text=True, timeout=600)
+            if res.returncode != 0:
+                raise RuntimeError(f"startup probe ({mode}) falló:\n{res.stderr[-2000:]}")
+            rows.append(json.loads(res.stdout.strip().splitlines()[-1]))
+        keys = ("import_seconds", "warmup_seconds", "first_predict_ms", "second_predict_ms", "time_to_first_prediction_s")
+        out[mode] = {
+            **{f"{k}_median": float(np.median([r[k] for r in rows])) for k in keys},
+            "modules_after_import": rows[0]["modules_after_import"],
+            "statuses": sorted({s for r in rows for s in r["statuses"]}),
+            "model": rows[0]["model"],
+            "runs": runs,
+        }
+    return out
+
+def _reference_scores(clf, Xv):
+    """Decisión lineal de referencia por clase (svc_calibrated: promedio de los folds)."""
+    import numpy as np
+    from sklearn.calibration import CalibratedClassifierCV
+    classes = np.asarray(clf.classes_)
+    def per_class(est):
+        d = np.asarray(est.decision_function(Xv))
+        return np.column_stack([-d, d]) if d.ndim == 1 else d
+    if isinstance(clf, CalibratedClassifierCV):
+        out = np.zeros((Xv.shape[0], len(classes)))
+        for cc in clf.calibrated_classifiers_:
+            out[:, np.searchsorted(classes, cc.estimator.classes_)] += per_class(cc.estimator)
+        return out / len(clf.calibrated_classifiers_)
+    return per_class(clf)
+
+def explain_comparison(path: str = DEFAULT_CORPUS, pipelines=("svc_calibrated", "logreg", "sgd_online"),
+                       batch_sizes=(1, 16, 256), repeats: int = 30, n_terms: int = 10) -> list:
+    """
+    Por pipeline: costo de armar el índice de /explain al publicar y latencia de la explicación vs
+    `predict_with_model` sobre el mismo lote y la misma exportación mmap que sirve el API. Paridad:
+    el score de cada clase (intercepto + suma de aportes de los no-ceros) vs la decisión lineal del
+    clasificador sklearn, y que cada término explicado aparezca en su texto.
+    """
+    import shutil
+    import numpy as np
+    from .pipelines import build_pipeline
+    from .predict import predict_with_model, _split_model
+    from .artifacts import export_model, load_export
+    from .explain import ExplainIndex, Explainer
+
+    df = pd.read_excel(path)[["textos", "labels"]].dropna()
+    X = TextNormalizer().transform(df["textos"].astype(str).tolist())
+    y = df["labels"].astype(int).to_numpy()
+    rows = []
+    for name in pipelines:
+        model = build_pipeline(name).fit(X, y)
+        tmp = tempfile.mkdtemp(prefix="bench_explain_")
+        try:
+            t0 = time.perf_counter()
+            index = ExplainIndex.from_model(model, texts=X if name == "sgd_online" else None)
+            build_ms = (time.perf_counter() - t0) * 1000.0
+            export_dir = export_model(model, os.path.join(tmp, "m.export"), explain_index=index)
+            served = load_export(export_dir)
+            explainer = Explainer(served, ExplainIndex.load(export_dir))
+
+            sample = X[:256]
+            transform, clf = _split_model(model)
+            ref = _reference_scores(clf, transform(sample))
+            n_classes = len(model.classes_)
+            got = explainer.explain(sample, top_k=n_classes, n_terms=n_terms)
+            pos = {lbl: k for k, lbl in enumerate(np.asarray(model.classes_).tolist())}
+            scores = np.zeros_like(ref)
+            for i, item in enumerate(got):
+                for e in item["explanations"]:
+                    scores[i, pos[e["label"]]] = e["score"]
+            terms_in_text = all(
+                all(part in (sample[i].split()) or " " in part for t in e["terms"] for part in t["term"].split(" | "))
+                for i, item in enumerate(got) for e in item["explanations"]
+            )
+            same_labels = [it["label"] for it in got] == [p["label"] for p in predict_with_model(served, sample)]
+
+            for bs in batch_sizes:
+                batch = X[:bs]
+                timings = {}
+                for label, fn in (("predict", lambda: predict_with_model(served, batch)),
+                                  ("explain", lambda: explainer.explain(batch, top_k=1, n_terms=n_terms))):
+                    fn()
+                    samples = []
+                    for _ in range(repeats):
+                        t0 = time.perf_counter()
+                        fn()
+                        samples.append((time.perf_counter() - t0) * 1000.0)
+                    timings[label] = _percentiles(samples)
+                rows.append({
+                    "pipeline": name, "batch_size": bs, "index_build_ms": build_ms,
+                    "index_rows": int(index.weights.shape[0]), "source": index.source,
+                    "predict_p50_ms": timings["predict"]["p50_ms"], "explain_p50_ms": timings["explain"]["p50_ms"],
+                    "overhead_ratio": timings["explain"]["p50_ms"] / timings["predict"]["p50_ms"],
+                    "max_abs_diff_score": float(np.abs(scores - ref).max()),
+                    "same_labels_as_predict": same_labels, "terms_in_text": terms_in_text,
+                })
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+    return rows
+
+# ===== Estrés: /predict y /retrain concurrentes en varios procesos =====
+_STRESS_WORKER = r"""
+import sys, json, time, asyncio
+import {pkg}.api as api
+from {pkg}.benchmark import _asgi_request
+
+with open(sys.argv[1], "r", encoding="utf-8") as f:
+    cfg = json.load(f)
+
+async def main():
+    out = {{"predict_ok": 0, "predict_errors": [], "latencies_ms": [], "versions_served": set(), "jobs": []}}
+    done = asyncio.Event()
+
+    async def predictor(i):
+        texts = cfg["texts"]
+        while not done.is_set():
+            body = json.dumps({{"instances": [{{"textos": texts[i % len(texts)]}}]}}).encode()
+            t = time.perf_counter()
+            status, resp = await _asgi_request(api.app, "POST", "/predict", body)
+            out["latencies_ms"].append((time.perf_counter() - t) * 1000.0)
+            if status == 200:
+                out["predict_ok"] += 1
+            else:
+                out["predict_errors"].append([status, resp[:300].decode(errors="replace")])
+            out["versions_served"].add(api.registry.info()["version"])
+            i += cfg["predictors"]
+
+    async def retrainer():
+        try:
+            for n, batch in enumerate(cfg["batches"]):
+                strategy = cfg["strategies"][n % len(cfg["strategies"])]
+                body = json.dumps({{"instances": batch, "strategy": strategy}}).encode()
+                t = time.perf_counter()
+                status, resp = await _asgi_request(api.app, "POST", "/retrain", body)
+                job = json.loads(resp)
+                while status == 202 and job["status"] in ("queued", "running"):
+                    await asyncio.sleep(0.2)
+                    status, resp = await _asgi_request(api.app, "GET", f"/retrain/jobs/{{job['job_id']}}")
+                    job = json.loads(resp)
+                    status = 202 if status == 200 else status
+                out["jobs"].append({{"strategy": strategy, "status": job.get("status", status),
+                                    "model_version_path": job.get("model_version_path"),
+                                    "error": job.get("error") or (None if status == 202 else str(job)),
+                                    "seconds": time.perf_counter() - t}})
+        finally:
+            done.set()
+
+    async with api.app.router.lifespan_context(api.app):
+        await asyncio.gather(retrainer(), *(predictor(i) for i in range(cfg["predictors"])))
+    out["versions_served"] = sorted(out["versions_served"])
+    return out
+
+print(json.dumps(asyncio.run(main())))
+"""
+
+def _file_md5(path: str) -> str:
+    import hashlib
+    h = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def check_workspace(ws: str, expected_hashes=(), published=()) -> dict:
+    """
+    Invariantes de una carpeta retrain_models/ tras escrituras concurrentes: índice legible con
+    todas las versiones publicadas (`published`, rutas .pkl), cada versión completa (pkl con su md5,
+    meta y exportación), store sin filas perdidas (`expected_hashes`) ni duplicadas, manifest
+    coherente con los fragmentos y sin temporales abandonados.
+    """
+    import glob
+    import pyarrow.parquet as pq
+
+    problems = []
+    with open(os.path.join(ws, "versions.json"), "r", encoding="utf-8") as f:
+        index = json.load(f)
+    ids = [os.path.splitext(os.path.basename(p))[0] for p in published]
+    if len(set(ids)) != len(ids):
+        problems.append(f"ids de versión repetidos: {len(ids) - len(set(ids))}")
+    lost = sorted(set(ids) - set(index["versions"]))
+    if lost:
+        problems.append(f"versiones publicadas ausentes del índice: {lost}")
+    if index["active"] not in index["versions"]:
+        problems.append(f"versión activa inexistente: {index['active']}")
+    for vid, v in index["versions"].items():
+        pkl = os.path.join(ws, v["file"])
+        if not os.path.isfile(pkl):
+            problems.append(f"{vid}: falta el .pkl")
+            continue
+        if v.get("md5") and _file_md5(pkl) != v["md5"]:
+            problems.append(f"{vid}: md5 del .pkl no coincide")
+        try:
+            with open(os.path.join(ws, v["meta"]), "r", encoding="utf-8") as f:
+                json.load(f)
+        except (OSError, ValueError) as e:
+            problems.append(f"{vid}: meta ilegible ({e})")
+        if v.get("export") and not os.path.isfile(os.path.join(ws, v["export"], "manifest.json")):
+            problems.append(f"{vid}: exportación incompleta")
+
+    store_dir = os.path.join(ws, "training_store")
+    with open(os.path.join(store_dir, "manifest.json"), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    listed = [s["file"] for s in manifest["segments"]]
+    orphans = sorted(set(os.path.basename(p) for p in glob.glob(os.path.join(store_dir, "part-*.parquet"))) - set(listed))
+    if orphans:
+        problems.append(f"fragmentos fuera del manifest: {orphans}")
+    hashes, rows_manifest = [], 0
+    for s in manifest["segments"]:
+        path = os.path.join(store_dir, s["file"])
+        if not os.path.isfile(path):
+            problems.append(f"fragmento del manifest inexistente: {s['file']}")
+            continue
+        col = pq.read_table(path, columns=["text_hash"]).column("text_hash").to_pylist()
+        hashes += col
+        rows_manifest += int(s["rows"])
+        if len(col) != int(s["rows"]):
+            problems.append(f"{s['file']}: {len(col)} filas, el manifest dice {s['rows']}")
+    if len(set(hashes)) != len(hashes):
+        problems.append(f"filas duplicadas en el store: {len(hashes) - len(set(hashes))}")
+    missing = set(expected_hashes) - set(hashes)
+    if missing:
+        problems.append(f"filas enviadas que no llegaron al store: {len(missing)}")
+    tmp = [os.path.relpath(p, ws) for p in glob.glob(os.path.join(ws, "**", "*.tmp"), recursive=True)]
+    if tmp:
+        problems.append(f"temporales abandonados: {tmp}")
+    return {
+        "versions": len(index["versions"]),
+        "index_generation": index.get("generation"),
+        "store_rows": len(hashes),
+        "store_segments": len(listed),
+        "problems": problems,
+    }
+
+def stress_test(path: str = DEFAULT_CORPUS, workers: int = 2, retrains: int = 3, batch_rows: int = 40,
+                predictors: int = 4, strategies=("merge_all", "online"), compact_threshold: int = 3,
+                cv_folds: int = 0, timeout: float = 1800) -> dict:
+    """
+    `workers` procesos de API (como workers de uvicorn) sobre una misma carpeta retrain_models/
+    temporal (RETRAIN_MODELS_DIR). En cada uno, `predictors` clientes golpean /predict sin pausa
+    mientras se encolan `retrains` reentrenamientos por /retrain, uno tras otro. El primer lote es
+    el mismo en todos los procesos (carrera de dedup) y la compactación del store se dispara cada
+    `compact_threshold` fragmentos. Al final se verifican los invariantes (`check_workspace`).
+    """
+    import shutil
+    import numpy as np
+    from .data_store import prepare_records
+
+    df = pd.read_excel(path)[["textos", "labels"]].dropna()
+    texts = df["textos"].astype(str).tolist()[:500]
+    data = synthetic_labeled(df, len(df) + batch_rows * (workers * retrains + 1), seed=7).iloc[len(df):]
+    data = data.assign(labels=data["labels"].astype(int)).reset_index(drop=True)
+    chunks = [data.iloc[i * batch_rows:(i + 1) * batch_rows] for i in range(workers * retrains + 1)]
+    shared, own = chunks[0], chunks[1:]
+
+    ws = tempfile.mkdtemp(prefix="bench_stress_")
+    pkg = __package__ or "etapa2.back"
+    root = os.path.normpath(os.path.join(BASE_DIR, "..", ".."))
+    env = dict(os.environ, RETRAIN_MODELS_DIR=ws, MODEL_REFRESH_SECONDS="0", MODEL_KEEP_VERSIONS="0",
+               STORE_COMPACT_THRESHOLD=str(compact_threshold), CV_FOLDS=str(cv_folds), API_WARMUP="sync",
+               PYTHONWARNINGS="ignore")
+    try:
+        procs = []
+        for w in range(workers):
+            batches = [own[w * retrains + r] for r in range(retrains)]
+            batches[0] = pd.concat([shared, batches[0]])
+            cfg = {"texts": texts, "predictors": predictors, "strategies": list(strategies),
+                   "batches": [b.to_dict(orient="records") for b in batches]}
+            cfg_path = os.path.join(ws, f"stress_worker_{w}.json")
+            with open(cfg_path, "w", encoding="utf-8") as f:
+                json.dump(cfg, f, ensure_ascii=False)
+            procs.append(subprocess.Popen([sys.executable, "-c", _STRESS_WORKER.format(pkg=pkg), cfg_path],
+                                          cwd=root, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True))
+        t0 = time.perf_counter()
+        results = []
+        for w, p in enumerate(procs):
+            stdout, stderr = p.communicate(timeout=max(1.0, timeout - (time.perf_counter() - t0)))
+            if p.returncode != 0:
+                raise RuntimeError(f"worker {w} de estrés falló:\n{stderr[-2000:]}")
+            results.append(json.loads(stdout.strip().splitlines()[-1]))
+        wall = time.perf_counter() - t0
+        for w in range(workers):
+            os.remove(os.path.join(ws, f"stress_worker_{w}.json"))
+
+        jobs = [j for r in results for j in r["jobs"]]
+        published = [j["model_version_path"] for j in jobs if j["status"] == "done"]
+        expected = set(prepare_records(pd.concat([shared, *own]))["text_hash"])
+        checks = check_workspace(ws, expected_hashes=expected, published=published)
+        errors = [e for r in results for e in r["predict_errors"]]
+        failed = [j["error"] for j in jobs if j["status"] != "done"]
+        return {
+            "workers": workers,
+            "wall_seconds": wall,
+            "predict": {
+                "requests": sum(r["predict_ok"] for r in results) + len(errors),
+                "errors": len(errors),
+                "error_examples": errors[:5],
+                "versions_served": len({v for r in results for v in r["versions_served"]}),
+                **_percentiles([x for r in results for x in r["latencies_ms"]]),
+            },
+            "retrain": {
+                "jobs": len(jobs),
+                "done": len(published),
+                "failed": len(failed),
+                "errors": failed[:5],
+                "seconds_median": float(np.median([j["seconds"] for j in jobs])) if jobs else None,
+            },
+            "checks": checks,
+            "ok": not errors and not failed and not checks["problems"],
+        }
+    finally:
+        shutil.rmtree(ws, ignore_errors=True)
+
+# ===== Suite completa (JSON comparable entre commits) =====
+SUITE_SECTIONS = ("normalize", "predict", "retrain", "http")
+
+def _percentiles(samples_ms: list) -> dict:
+    import numpy as np
+    a = np.asarray(samples_ms)
+    return {"p50_ms": float(np.percentile(a, 50)), "p95_ms": float(np.percentile(a, 95)), "mean_ms": float(a.mean())}
+
+def _run_meta() -> dict:
+    import sklearn
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR,
+                                capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "commit": commit,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sklearn": sklearn.__version__,
+        "pandas": pd.__version__,
+        "cpu_count": os.cpu_count(),
+    }
+
+def synthetic_labeled(df: pd.DataFrame, n: int, seed: int = 0) -> pd.DataFrame:
+    """
+    `n` filas etiquetadas a partir del corpus: las primeras son el corpus original y el resto
+    variantes que omiten 1-3 palabras de un documento (textos distintos con el mismo vocabulario
+    y etiqueta, para que la deduplicación del store no las colapse).
+    """
+    rng = random.Random(seed)
+    base = df[["textos", "labels"]].dropna().astype({"textos": str}).reset_index(drop=True)
+    texts, labels = base["textos"].tolist()[:n], base["labels"].tolist()[:n]
+    while len(texts) < n:
+        i = rng.randrange(len(base))
+        words = base.at[i, "textos"].split()
+        for _ in range(min(len(words) - 1, rng.randint(1, 3))):
+            words.pop(rng.randrange(len(words)))
+        texts.append(" ".join(words))
+        labels.append(base.at[i, "labels"])
+    return pd.DataFrame({"textos": texts, "labels": labels})
+
+@contextlib.contextmanager
+def isolated_workspace():
+    """Redirige retrain_models/ (modelos, índice, store, caché del test) a un temporal y restaura al salir."""
+    from . import data_store, retrain_service, versions, last_model
+    tmp = tempfile.mkdtemp(prefix="bench_ws_")
+    store_dir = os.path.join(tmp, "training_store")
+    patches = [
+        (data_store, "STORE_PATH", os.path.join(tmp, "training_store.parquet")),
+        (data_store, "STORE_DIR", store_dir),
+        (data_store, "MANIFEST_PATH", os.path.join(store_dir, "manifest.json")),
+        (data_store, "EVAL_CACHE_PATH", os.path.join(tmp, "eval_cache.parquet")),
+        (retrain_service, "RETRAIN_DIR", tmp),
+        (versions, "RETRAIN_DIR", tmp),
+        (versions, "INDEX_PATH", os.path.join(tmp, "versions.json")),
+        (last_model, "RETRAIN_DIR", tmp),
+    ]
+    saved = [(mod, name, getattr(mod, name)) for mod, name, _ in patches]
+    saved_state = (dict(data_store._hash_index), dict(data_store._eval_memo), dict(versions._cache))
+    for mod, name, value in patches:
+        setattr(mod, name, value)
+    data_store._hash_index.update({"generation": None, "hashes": None})
+    versions._cache.update({"sig": None, "index": None})
+    try:
+        yield tmp
+    finally:
+        for mod, name, value in saved:
+            setattr(mod, name, value)
+        data_store._hash_index.update(saved_state[0])
+        data_store._eval_memo.update(saved_state[1])
+        versions._cache.update(saved_state[2])
+        last_model.registry._current = None
+        import shutil
+        shutil.rmtree(tmp, ignore_errors=True)
+
+def bench_normalize(texts: list, ref_sample: int = 500) -> dict:
+    """docs/s: limpiar_texto (muestra), TextNormalizer (nltk y fast) en frío y en caliente, normalize_series."""
+    out = {"n_docs": len(texts)}
+    sample = texts[:ref_sample]
+    t0 = time.perf_counter()
+    for t in sample:
+        limpiar_texto(t)
+    out["limpiar_texto_docs_per_s"] = len(sample) / (time.perf_counter() - t0)
+
+    for engine in ("nltk", "fast"):
+        norm = TextNormalizer(engine=engine)
+        for rnd in ("cold", "warm"):
+            t0 = time.perf_counter()
+            norm.transform(texts)
+            out[f"normalizer_{engine}_{rnd}_docs_per_s"] = len(texts) / (time.perf_counter() - t0)
+
+    utils._normalizer = None
+    t0 = time.perf_counter()
+    normalize_series(pd.Series(texts))
+    out["normalize_series_docs_per_s"] = len(texts) / (time.perf_counter() - t0)
+    return out
+
+def bench_predict(df: pd.DataFrame, pipelines=("svc_calibrated", "logreg", "sgd_online"),
+                  batch_sizes=(1, 16, 256), repeats: int = 30) -> list:
+    """Latencia de `predict_with_model` por pipeline, artefacto (pipeline/export) y tamaño de lote."""
+    from .pipelines import build_pipeline
+    from .predict import predict_with_model
+    from .artifacts import export_model, load_export
+
+    X = TextNormalizer().transform(df["textos"].astype(str).tolist())
+    y = df["labels"].astype(int).to_numpy()
+    rows = []
+    for name in pipelines:
+        model = build_pipeline(name).fit(X, y)
+        variants = [("pipeline", model)]
+        tmp = tempfile.mkdtemp(prefix="bench_predict_")
+        try:
+            variants.append(("export", load_export(export_model(model, os.path.join(tmp, "m.export")))))
+            for artifact, m in variants:
+                for bs in batch_sizes:
+                    batch = X[:bs]
+                    predict_with_model(m, batch)  # calentamiento
+                    samples = []
+                    for _ in range(repeats):
+                        t0 = time.perf_counter()
+                        predict_with_model(m, batch)
+                        samples.append((time.perf_counter() - t0) * 1000.0)
+                    stats = _percentiles(samples)
+                    rows.append({"pipeline": name, "artifact": artifact, "batch_size": bs, **stats,
+                                 "texts_per_s": bs * 1000.0 / stats["mean_ms"]})
+        finally:
+            import shutil
+            shutil.rmtree(tmp, ignore_errors=True)
+    return rows
+
+def bench_retrain(df: pd.DataFrame, store_sizes=(2824, 11296), strategies=("merge_all", "reweight", "online"),
+                  batch_rows: int = 50) -> list:
+    """Tiempo de `retrain_from_dataframe` por estrategia y tamaño del store (en un workspace temporal)."""
+    from .data_store import write_store, prepare_records
+    from .retrain_service import retrain_from_dataframe
+
+    rows = []
+    for n in store_sizes:
+        data = synthetic_labeled(df, n + batch_rows, seed=n)
+        seed, batch = data.iloc[:n], data.iloc[n:]
+        for strategy in strategies:
+            with isolated_workspace():
+                write_store(prepare_records(seed).drop_duplicates(subset=["text_hash"]))
+                if strategy == "online":
+                    # con padre publicado: se mide la actualización incremental, no el arranque
+                    retrain_from_dataframe(synthetic_labeled(df, 2 * batch_rows, seed=n + 1).iloc[batch_rows:],
+                                           strategy="online")
+                t0 = time.perf_counter()
+                metrics, _ = retrain_from_dataframe(batch, strategy=strategy)
+                rows.append({"strategy": strategy, "store_rows": n, "batch_rows": batch_rows,
+                             "seconds": time.perf_counter() - t0, "f1": metrics["f1"]})
+    return rows
+
+async def _asgi_request(app, method: str, path: str, body: bytes = b"") -> tuple:
+    """Petición HTTP en proceso contra la app ASGI (sin red ni servidor)."""
+    status, chunks, sent = [None], [], [False]
+
+    async def receive():
+        if not sent[0]:
+            sent[0] = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return {"type": "http.disconnect"}
+
+    async def send(msg):
+        if msg["type"] == "http.response.start":
+            status[0] = msg["status"]
+        elif msg["type"] == "http.response.body":
+            chunks.append(msg.get("body", b""))
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+        "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"",
+        "headers": [(b"content-type", b"application/json")], "client": ("bench", 0), "server": ("bench", 80),
+    }
+    await app(scope, receive, send)
+    return status[0], b"".join(chunks)
+
+def bench_http(df: pd.DataFrame, concurrency=(1, 16), texts_per_request=(1, 16), requests_per_run: int = 200) -> list:
+    """Carga de /predict de punta a punta con la app en proceso; el modelo se publica en un workspace temporal."""
+    import joblib
+    from . import versions
+    from .api import app
+    from .last_model import registry
+    from .pipelines import build_pipeline
+
+    texts = df["textos"].astype(str).tolist()
+    rows = []
+    with isolated_workspace() as ws:
+        X = TextNormalizer().transform(texts)
+        model = build_pipeline("svc_calibrated").fit(X, df["labels"].astype(int).to_numpy())
+        path = os.path.join(ws, "model_bench.pkl")
+        joblib.dump(model, path)
+        versions.register(path, {"pipeline": "svc_calibrated"})
+        registry.refresh(force=True)
+
+        async def run(conc: int, k: int):
+            sem = asyncio.Semaphore(conc)
+            latencies, errors = [], 0
+
+            async def one(i: int):
+                nonlocal errors
+                start = (i * k) % len(texts)
+                payload = {"instances": [{"textos": t} for t in (texts * 2)[start:start + k]]}
+                async with sem:
+                    t0 = time.perf_counter()
+                    status, _ = await _asgi_request(app, "POST", "/predict", json.dumps(payload).encode())
+                    latencies.append((time.perf_counter() - t0) * 1000.0)
+                    errors += status != 200
+
+            t0 = time.perf_counter()
+            await asyncio.gather(*(one(i) for i in range(requests_per_run)))
+            return time.perf_counter() - t0, latencies, errors
+
+        for k in texts_per_request:
+            for conc in concurrency:
+                wall, lat, errors = asyncio.run(run(conc, k))
+                rows.append({"endpoint": "/predict", "texts_per_request": k, "concurrency": conc,
+                             "requests": requests_per_run, "errors": errors,
+                             "requests_per_s": requests_per_run / wall, **_percentiles(lat)})
+    return rows
+
+def run_suite(path: str = DEFAULT_CORPUS, sections=SUITE_SECTIONS, store_sizes=(2824, 11296),
+              strategies=("merge_all", "reweight", "online")) -> dict:
+    df = pd.read_excel(path)[["textos", "labels"]].dropna()
+    out = {"meta": _run_meta() | {"corpus": os.path.basename(path), "n_docs": int(len(df))}}
+    if "normalize" in sections:
+        out["normalize"] = bench_normalize(df["textos"].astype(str).tolist())
+    if "predict" in sections:
+        out["predict"] = bench_predict(df)
+    if "retrain" in sections:
+        out["retrain"] = bench_retrain(df, store_sizes=store_sizes, strategies=strategies)
+    if "http" in sections:
+        out["http"] = bench_http(df)
+    return out
+
+def _flatten(obj, prefix: str = "") -> dict:
+    """Hojas numéricas con una clave legible; las filas de listas se identifican por sus campos no medidos."""
+    id_keys = ("pipeline", "artifact", "batch_size", "strategy", "store_rows", "batch_rows",
+               "endpoint", "texts_per_request", "concurrency")
+    out = {}
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            if k != "meta":
+                out.update(_flatten(v, f"{prefix}.{k}" if prefix else k))
+    elif isinstance(obj, list):
+        for i, row in enumerate(obj):
+            ident = ",".join(f"{k}={row[k]}" for k in id_keys if isinstance(row, dict) and k in row) or str(i)
+            out.update(_flatten({k: v for k, v in row.items() if k not in id_keys} if isinstance(row, dict) else row,
+                                f"{prefix}[{ident}]"))
+    elif isinstance(obj, (int, float)) and not isinstance(obj, bool):
+        out[prefix] = float(obj)
+    return out
+
+def compare_results(old: dict, new: dict) -> list:
+    a, b = _flatten(old), _flatten(new)
+    return [
+        {"metric": k, "old": a[k], "new": b[k], "ratio": (b[k] / a[k]) if a[k] else None}
+        for k in sorted(a.keys() & b.keys())
+    ]
+
+def main():
+    ap = argparse.ArgumentParser(description="Paridad y benchmarks del backend.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("parity", help="TextNormalizer (nltk y fast) vs limpiar_texto sobre el corpus completo.")
+    p.add_argument("--input", default=DEFAULT_CORPUS)
+
+    p = sub.add_parser("clean", help="Escalado de la normalización paralela (tamaño de corpus x procesos).")
+    p.add_argument("--input", default=DEFAULT_CORPUS)
+    p.add_argument("--sizes", type=int, nargs="+", default=[2824, 11296, 45184])
+    p.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    p.add_argument("--chunk-size", type=int, default=500)
+
+    p = sub.add_parser("load", help="Carga y memoria por worker: .pkl vs exportación mmap.")
+    p.add_argument("--model", required=True, help="Ruta al .pkl")
+    p.add_argument("--workers", type=int, default=4)
+    p.add_argument("--input", default=DEFAULT_CORPUS)
+
+    p = sub.add_parser("compile", help="svc_calibrated: folds de CalibratedClassifierCV vs scorer compilado.")
+    p.add_argument("--model", required=True, help="Ruta al .pkl")
+    p.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 16, 256])
+    p.add_argument("--input", default=DEFAULT_CORPUS)
+
+    p = sub.add_parser("online", help="Estrategia online: reconstrucción vs partial_fit incremental.")
+    p.add_argument("--input", default=DEFAULT_CORPUS)
+    p.add_argument("--store-sizes", type=int, nargs="+", default=[2824, 11296, 45184])
+    p.add_argument("--batch-sizes", type=int, nargs="+", default=[30, 300])
+
+    p = sub.add_parser("features", help="TF-IDF desde conteos cacheados vs ajuste completo (paridad y tiempo).")
+    p.add_argument("--input", default=DEFAULT_CORPUS)
+    p.add_argument("--store-sizes", type=int, nargs="+", default=[2824, 11296, 45184])
+    p.add_argument("--batch-sizes", type=int, nargs="+", default=[30, 300])
+
+    p = sub.add_parser("cv", help="Validación cruzada: re-ajuste del TF-IDF por fold vs conteos compartidos.")
+    p.add_argument("--input", default=DEFAULT_CORPUS)
+    p.add_argument("--store-sizes", type=int, nargs="+", default=[2824, 11296])
+    p.add_argument("--folds", type=int, default=5)
+    p.add_argument("--pipeline", default="svc_calibrated", choices=["svc_calibrated", "logreg"])
+
+    p = sub.add_parser("neardup", help="Casi-duplicados: consulta MinHash/LSH vs comparación exhaustiva.")
+    p.add_argument("--input", default=DEFAULT_CORPUS)
+    p.add_argument("--store-sizes", type=int, nargs="+", default=[2824, 11296, 45184])
+    p.add_argument("--batch-rows", type=int, default=300)
+    p.add_argument("--threshold", type=float, default=0.9)
+
+    p = sub.add_parser("startup", help="Import del API, warmup y tiempo hasta la primera predicción (procesos nuevos).")
+    p.add_argument("--modes", nargs="+", choices=["sync", "background", "off"], default=["sync", "off"])
+    p.add_argument("--runs", type=int, default=3)
+
+    p = sub.add_parser("explain", help="/explain: índice al publicar, sobrecosto vs predict y paridad con la decisión lineal.")
+    p.add_argument("--input", default=DEFAULT_CORPUS)
+    p.add_argument("--pipelines", nargs="+", default=["svc_calibrated", "logreg", "sgd_online"],
+                   choices=["svc_calibrated", "logreg", "sgd_online"])
+    p.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 16, 256])
+
+    p = sub.add_parser("stress", help="/predict y /retrain concurrentes en varios procesos + invariantes de retrain_models/.")
+    p.add_argument("--input", default=DEFAULT_CORPUS)
+    p.add_argument("--workers", type=int, default=2)
+    p.add_argument("--retrains", type=int, default=3, help="Reentrenamientos por worker")
+    p.add_argument("--batch-rows", type=int, default=40)
+    p.add_argument("--predictors", type=int, default=4, help="Clientes de /predict por worker")
+    p.add_argument("--strategies", nargs="+", default=["merge_all", "online"],
+                   choices=["merge_all", "reweight", "online", "search"])
+    p.add_argument("--compact-threshold", type=int, default=3)
+    p.add_argument("--cv-folds", type=int, default=0)
+
+    p = sub.add_parser("suite", help="Normalización, latencia de predict, tiempo de reentrenamiento y carga HTTP (JSON).")
+    p.add_argument("--input", default=DEFAULT_CORPUS)
+    p.add_argument("--sections", nargs="+", choices=SUITE_SECTIONS, default=list(SUITE_SECTIONS))
+    p.add_argument("--store-sizes", type=int, nargs="+", default=[2824, 11296])
+    p.add_argument("--strategies", nargs="+", default=["merge_all", "reweight", "online"],
+                   choices=["merge_all", "reweight", "online", "search"])
+    p.add_argument("--output", help="Archivo JSON de salida (por defecto, stdout).")
+
+    p = sub.add_parser("compare", help="Compara dos resultados de `suite` (ratio nuevo/anterior por métrica).")
+    p.add_argument("old")
+    p.add_argument("new")
+
+    args = ap.parse_args()
+
+    if args.cmd == "parity":
+        res = normalizer_parity(args.input)
+        print(json.dumps(res, ensure_ascii=False, indent=2))
+        sys.exit(1 if res["mismatches"] else 0)
+
+    if args.cmd == "clean":
+        res = clean_scaling(args.input, sizes=args.sizes, workers=args.workers, chunk_size=args.chunk_size)
+        print(json.dumps(res, ensure_ascii=False, indent=2))
+
+    if args.cmd == "load":
+        res = load_comparison(args.model, workers=args.workers, path=args.input)
+        print(json.dumps(res, ensure_ascii=False, indent=2))
+
+    if args.cmd == "compile":
+        res = compile_comparison(args.model, batch_sizes=args.batch_sizes, path=args.input)
+        print(json.dumps(res, ensure_ascii=False, indent=2))
+        from .artifacts import COMPILE_ATOL
+        sys.exit(0 if not res["compiled"] or res["max_abs_diff"] <= COMPILE_ATOL else 1)
+
+    if args.cmd == "online":
+        res = online_comparison(args.input, store_sizes=args.store_sizes, batch_sizes=args.batch_sizes)
+        print(json.dumps(res, ensure_ascii=False, indent=2))
+
+    if args.cmd == "features":
+        res = feature_cache_comparison(args.input, store_sizes=args.store_sizes, batch_sizes=args.batch_sizes)
+        print(json.dumps(res, ensure_ascii=False, indent=2))
+        ok = all(r["same_vocabulary"] and r["same_idf"] and r["max_abs_diff_transform"] == 0.0
+                 and r["max_abs_diff_fit_transform"] <= 1e-12 for r in res)
+        sys.exit(0 if ok else 1)
+
+    if args.cmd == "cv":
+        res = cv_comparison(args.input, store_sizes=args.store_sizes, k=args.folds, pipeline=args.pipeline)
+        print(json.dumps(res, ensure_ascii=False, indent=2))
+        sys.exit(0 if all(r["max_abs_diff_fold_f1"] <= 1e-9 for r in res) else 1)
+
+    if args.cmd == "neardup":
+        res = neardup_comparison(args.input, store_sizes=args.store_sizes, batch_rows=args.batch_rows,
+                                 threshold=args.threshold)
+        print(json.dumps(res, ensure_ascii=False, indent=2))
+
+    if args.cmd == "startup":
+        res = startup_comparison(modes=args.modes, runs=args.runs)
+        print(json.dumps(res, ensure_ascii=False, indent=2))
+
+    if args.cmd == "explain":
+        res = explain_comparison(args.input, pipelines=args.pipelines, batch_sizes=args.batch_sizes)
+        print(json.dumps(res, ensure_ascii=False, indent=2))
+        ok = all(r["max_abs_diff_score"] <= 1e-4 and r["same_labels_as_predict"] and r["terms_in_text"] for r in res)
+        sys.exit(0 if ok else 1)
+
+    if args.cmd == "stress":
+        res = stress_test(args.input, workers=args.workers, retrains=args.retrains, batch_rows=args.batch_rows,
+                          predictors=args.predictors, strategies=args.strategies,
+                          compact_threshold=args.compact_threshold, cv_folds=args.cv_folds)
+        print(json.dumps(res, ensure_ascii=False, indent=2))
+        sys.exit(0 if res["ok"] else 1)
+
+    if args.cmd == "suite":
+        res = run_suite(args.input, sections=args.sections, store_sizes=args.store_sizes, strategies=args.strategies)
+        text = json.dumps(res, ensure_ascii=False, indent=2)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                f.write(text)
+        else:
+            print(text)
+
+    if args.cmd == "compare":
+        with open(args.old, "r", encoding="utf-8") as f:
+            old = json.load(f)
+        with open(args.new, "r", encoding="utf-8") as f:
+            new = json.load(f)
+        print(json.dumps(compare_results(old, new), ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
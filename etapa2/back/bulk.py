@@ -0,0 +1,158 @@
+# etapa2/back/bulk.py
+"""
+Scoring masivo por streaming: lee el archivo por bloques, normaliza y predice cada
+bloque y escribe los resultados de forma incremental. La memoria depende del tamaño
+de bloque, no del tamaño del archivo.
+"""
+import os
+import io
+import csv
+import sys
+import json
+import time
+from typing import Iterator, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+
+from .last_model import registry
+from .predict import predict_with_model
+from .utils import normalize_series
+
+BULK_CHUNK_SIZE = int(os.environ.get("BULK_CHUNK_SIZE", "10000"))
+# tamaño máximo del cuerpo de /predict/bulk (0 = sin límite)
+BULK_MAX_BYTES = int(os.environ.get("BULK_MAX_BYTES", str(512 * 1024 * 1024)))
+
+INPUT_FORMATS = ("parquet", "csv", "xlsx")
+OUTPUT_FORMATS = ("ndjson", "csv", "parquet")
+OUTPUT_FIELDS = ["row", "label", "label_name", "prob"]
+OUTPUT_SCHEMA = pa.schema([
+    ("row", pa.int64()),
+    ("label", pa.int64()),
+    ("label_name", pa.string()),
+    ("prob", pa.float64()),
+])
+
+def infer_format(path: str, allowed) -> str:
+    ext = os.path.splitext(path)[1].lower().lstrip(".")
+    fmt = {"xls": "xlsx", "jsonl": "ndjson", "pq": "parquet"}.get(ext, ext)
+    if fmt not in allowed:
+        raise ValueError(f"Formato no soportado: .{ext}. Use uno de {', '.join(allowed)}")
+    return fmt
+
+def _rechunk(batches: Iterator[List], chunk_size: int) -> Iterator[List]:
+    buf: List = []
+    for batch in batches:
+        buf.extend(batch)
+        while len(buf) >= chunk_size:
+            yield buf[:chunk_size]
+            buf = buf[chunk_size:]
+    if buf:
+        yield buf
+
+def iter_text_chunks(path: str, text_col: str = "textos", chunk_size: int = BULK_CHUNK_SIZE,
+                     fmt: Optional[str] = None) -> Iterator[List[Optional[str]]]:
+    """Bloques de `chunk_size` textos: lotes de pyarrow (parquet/csv) u openpyxl read-only (xlsx)."""
+    fmt = fmt or infer_format(path, INPUT_FORMATS)
+
+    if fmt == "parquet":
+        pf = pq.ParquetFile(path)
+        if text_col not in pf.schema_arrow.names:
+            raise ValueError(f"La columna '{text_col}' no existe en {os.path.basename(path)}")
+        batches = (b.column(0).to_pylist() for b in pf.iter_batches(batch_size=chunk_size, columns=[text_col]))
+        yield from _rechunk(batches, chunk_size)
+        return
+
+    if fmt == "csv":
+        reader = pacsv.open_csv(
+            path,
+            convert_options=pacsv.ConvertOptions(include_columns=[text_col], column_types={text_col: pa.string()}),
+        )
+        batches = (b.column(0).to_pylist() for b in reader)
+        yield from _rechunk(batches, chunk_size)
+        return
+
+    if fmt == "xlsx":
+        import openpyxl
+        wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = wb.worksheets[0].iter_rows(values_only=True)
+            header = next(rows, None) or ()
+            if text_col not in header:
+                raise ValueError(f"La columna '{text_col}' no existe en {os.path.basename(path)}")
+            j = list(header).index(text_col)
+            texts = ((r[j] if j < len(r) else None) for r in rows)
+            yield from _rechunk(([t] for t in texts), chunk_size)
+        finally:
+            wb.close()
+        return
+
+    raise ValueError(f"Formato no soportado: {fmt}")
+
+def iter_scores(chunks: Iterator[List[Optional[str]]], n_jobs: Optional[int] = 1) -> Iterator[List[dict]]:
+    """Predice bloque a bloque con una sola versión del modelo durante toda la corrida."""
+    model = registry.current().model
+    offset = 0
+    for texts in chunks:
+        s = pd.Series(["" if t is None else str(t) for t in texts])
+        X = normalize_series(s, n_jobs=n_jobs).tolist()
+        preds = predict_with_model(model, X)
+        yield [
+            {"row": offset + i, "label": p["label"], "label_name": p["label_name"], "prob": p["prob"]}
+            for i, p in enumerate(preds)
+        ]
+        offset += len(texts)
+
+def _csv_lines(rows: List[dict], header: bool) -> str:
+    buf = io.StringIO()
+    w = csv.DictWriter(buf, fieldnames=OUTPUT_FIELDS)
+    if header:
+        w.writeheader()
+    w.writerows(rows)
+    return buf.getvalue()
+
+def _ndjson_lines(rows: List[dict]) -> str:
+    return "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in rows)
+
+def stream_scores(input_path: str, text_col: str = "textos", chunk_size: int = BULK_CHUNK_SIZE,
+                  in_fmt: Optional[str] = None, out_fmt: str = "ndjson") -> Iterator[bytes]:
+    """Resultados como bytes NDJSON/CSV, bloque a bloque (para respuestas HTTP en streaming)."""
+    if out_fmt not in ("ndjson", "csv"):
+        raise ValueError("El streaming HTTP solo admite salida ndjson o csv.")
+    first = True
+    for rows in iter_scores(iter_text_chunks(input_path, text_col, chunk_size, in_fmt)):
+        text = _ndjson_lines(rows) if out_fmt == "ndjson" else _csv_lines(rows, header=first)
+        first = False
+        yield text.encode("utf-8")
+
+def score_file(input_path: str, output_path: str, text_col: str = "textos", chunk_size: int = BULK_CHUNK_SIZE,
+               in_fmt: Optional[str] = None, out_fmt: Optional[str] = None, n_jobs: Optional[int] = None,
+               log=None) -> dict:
+    """Escribe las predicciones de `input_path` en `output_path` (ndjson/csv/parquet) y retorna filas y filas/s."""
+    out_fmt = out_fmt or infer_format(output_path, OUTPUT_FORMATS)
+    if out_fmt not in OUTPUT_FORMATS:
+        raise ValueError(f"Formato de salida no soportado: {out_fmt}")
+    log = log or (lambda msg: print(msg, file=sys.stderr))
+
+    t0 = time.perf_counter()
+    n = 0
+    chunks = iter_text_chunks(input_path, text_col, chunk_size, in_fmt)
+    if out_fmt == "parquet":
+        with pq.ParquetWriter(output_path, OUTPUT_SCHEMA) as writer:
+            for rows in iter_scores(chunks, n_jobs=n_jobs):
+                writer.write_table(pa.Table.from_pylist(rows, schema=OUTPUT_SCHEMA))
+                n += len(rows)
+                log(f"{n} filas | {n / (time.perf_counter() - t0):.0f} filas/s")
+    else:
+        with open(output_path, "w", encoding="utf-8", newline="") as f:
+            first = True
+            for rows in iter_scores(chunks, n_jobs=n_jobs):
+                f.write(_ndjson_lines(rows) if out_fmt == "ndjson" else _csv_lines(rows, header=first))
+                first = False
+                n += len(rows)
+                log(f"{n} filas | {n / (time.perf_counter() - t0):.0f} filas/s")
+
+    dt = time.perf_counter() - t0
+    return {"rows": n, "seconds": dt, "rows_per_s": (n / dt) if dt > 0 else None, "output": output_path}
@@ -0,0 +1,137 @@
+# etapa2/back/cache.py
+import os
+import sys
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+# Caché de predicciones (PREDICT_CACHE_SIZE=0 la desactiva)
+PREDICT_CACHE_SIZE = int(os.environ.get("PREDICT_CACHE_SIZE", "10000"))
+PREDICT_CACHE_TTL_SECONDS = float(os.environ.get("PREDICT_CACHE_TTL_SECONDS", "3600"))
+PREDICT_CACHE_MAX_MB = float(os.environ.get("PREDICT_CACHE_MAX_MB", "64"))
+
+def text_key(texto_norm: str) -> bytes:
+    return hashlib.md5(texto_norm.encode("utf-8")).digest()
+
+def _entry_size(value: dict) -> int:
+    """Estimación (bytes) de una predicción en memoria: dict + strings + lista top."""
+    size = sys.getsizeof(value) + 16 + 64  # clave + tupla de la entrada
+    for v in value.values():
+        size += sys.getsizeof(v)
+    for item in value.get("top") or ():
+        size += sys.getsizeof(item) + sum(sys.getsizeof(v) for v in item.values())
+    return size
+
+class PredictionCache:
+    """
+    LRU + TTL acotado por número de entradas y memoria estimada.
+    Las claves son el hash del texto normalizado (+ top_k); todas las entradas pertenecen
+    al md5 de un solo modelo. Solo `set_model` (el registro de modelos al activar otro) la vacía:
+    lecturas y escrituras con el md5 de otro modelo (peticiones en vuelo durante el cambio) son
+    un fallo y se descartan, sin tocar lo cacheado para el modelo nuevo.
+    """
+    def __init__(
+        self,
+        max_entries: int = PREDICT_CACHE_SIZE,
+        ttl_seconds: float = PREDICT_CACHE_TTL_SECONDS,
+        max_bytes: int = int(PREDICT_CACHE_MAX_MB * 1024 * 1024),
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._data: "OrderedDict[tuple[bytes, Optional[int]], tuple[dict, float, int]]" = OrderedDict()
+        self._model_md5: Optional[str] = None
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = {"lru": 0, "ttl": 0, "memory": 0}
+        self.invalidations = 0
+
+    def set_model(self, model_md5: str):
+        """El modelo activo cambió: se vacía la caché y se liga al md5 nuevo."""
+        with self._lock:
+            if model_md5 != self._model_md5:
+                if self._data:
+                    self.invalidations += 1
+                self._data.clear()
+                self._bytes = 0
+                self._model_md5 = model_md5
+
+    def _is_current(self, model_md5: str) -> bool:
+        if self._model_md5 is None:  # antes del primer set_model
+            self._model_md5 = model_md5
+        return model_md5 == self._model_md5
+
+    def _remove(self, key):
+        _, _, size = self._data.pop(key)
+        self._bytes -= size
+
+    def _drop(self, key, reason: str):
+        self._remove(key)
+        self.evictions[reason] += 1
+
+    def get_many(self, model_md5: str, keys: List[bytes], top_k: Optional[int] = None) -> List[Optional[dict]]:
+        now = time.monotonic()
+        out = []
+        with self._lock:
+            if not self._is_current(model_md5):
+                self.misses += len(keys)  # petición del modelo anterior: fallo, sin vaciar
+                return [None] * len(keys)
+            for k in keys:
+                key = (k, top_k)
+                entry = self._data.get(key)
+                if entry is not None and entry[1] < now:
+                    self._drop(key, "ttl")
+                    entry = None
+                if entry is None:
+                    self.misses += 1
+                    out.append(None)
+                else:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    out.append(entry[0])
+        return out
+
+    def put_many(self, model_md5: str, keys: List[bytes], values: List[dict], top_k: Optional[int] = None):
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            if not self._is_current(model_md5):
+                return  # predicción del modelo anterior: no vacía lo cacheado para el nuevo
+            for k, v in zip(keys, values):
+                key = (k, top_k)
+                if key in self._data:
+                    self._remove(key)
+                size = _entry_size(v)
+                self._data[key] = (v, expires, size)
+                self._bytes += size
+            while len(self._data) > self.max_entries:
+                self._drop(next(iter(self._data)), "lru")
+            while self._bytes > self.max_bytes and self._data:
+                self._drop(next(iter(self._data)), "memory")
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "max_entries": self.max_entries,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "model_md5": self._model_md5,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits / total) if total else None,
+                "evictions": dict(self.evictions),
+                "invalidations": self.invalidations,
+            }
+
+prediction_cache = PredictionCache() if PREDICT_CACHE_SIZE > 0 else None
@@ -1,15 +1,65 @@
 import os
+import json
+import time
+import uuid
+import hashlib
+import threading
+from typing import List, Optional, Set
+
 import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from .utils import NORMALIZER_VERSION, normalize_series
+from .locks import FileLock
+from .versions import RETRAIN_DIR
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.normpath(os.path.join(BASE_DIR, "..", "..", "data"))
-STORE_PATH = os.path.normpath(os.path.join(BASE_DIR, "..", "retrain_models", "training_store.parquet"))
+# store antiguo de un solo archivo (se migra al store segmentado la primera vez)
+STORE_PATH = os.path.join(RETRAIN_DIR, "training_store.parquet")
+# store segmentado: un fragmento parquet por lote + manifest.json
+STORE_DIR = os.path.join(RETRAIN_DIR, "training_store")
+MANIFEST_PATH = os.path.join(STORE_DIR, "manifest.json")
+
+# a partir de cuántos fragmentos se compacta en segundo plano
+STORE_COMPACT_THRESHOLD = int(os.environ.get("STORE_COMPACT_THRESHOLD", "32"))
+STORE_BATCH_SIZE = 65_536
 
 DEFAULT_SOURCES = [
     os.path.join(DATA_DIR, "Datos_proyecto.xlsx"),
     os.path.join(DATA_DIR, "Datos_etapa 2.xlsx"),
 ]
 
+# textos: crudo | textos_norm: normalizado | text_hash: md5(textos_norm), clave de dedup
+# norm_version: versión del normalizador que produjo textos_norm (LEGACY_NORM_VERSION: sin crudo)
+STORE_COLUMNS = ["textos", "labels", "textos_norm", "text_hash", "norm_version"]
+STORE_SCHEMA = pa.schema([
+    ("textos", pa.string()),
+    ("labels", pa.int64()),
+    ("textos_norm", pa.string()),
+    ("text_hash", pa.string()),
+    ("norm_version", pa.string()),
+])
+# filas migradas de stores sin el texto crudo: no se pueden re-normalizar
+LEGACY_NORM_VERSION = "legacy"
+
+# conjunto de evaluación fijo, ya normalizado (clave: mtime/tamaño/md5 del archivo fuente)
+EVAL_CACHE_PATH = os.path.join(RETRAIN_DIR, "eval_cache.parquet")
+EVAL_COLUMNS = ["textos", "labels", "textos_norm"]
+EVAL_SCHEMA = pa.schema([
+    ("textos", pa.string()),
+    ("labels", pa.int64()),
+    ("textos_norm", pa.string()),
+])
+
+# exclusión entre hilos y procesos (workers de la API, pool de reentrenamiento) para el manifest y los fragmentos
+_lock = FileLock(lambda: STORE_DIR + ".lock")
+_hash_index = {"generation": None, "hashes": None}
+_eval_memo = {"key": None, "df": None}
+_compacting = threading.Event()
+
 def _read_any(path: str) -> pd.DataFrame:
     ext = os.path.splitext(path)[1].lower()
     if ext in (".xlsx", ".xls"):
@@ -29,11 +79,270 @@ def load_sources(paths=None) -> pd.DataFrame:
         raise FileNotFoundError("No se encontraron fuentes base en data/")
     return pd.concat(dfs, ignore_index=True)
 
-def read_store() -> pd.DataFrame:
-    if os.path.isfile(STORE_PATH):
-        return pd.read_parquet(STORE_PATH)
-    return load_sources()
+def hash_texts(texts: pd.Series) -> pd.Series:
+    return pd.Series(
+        [hashlib.md5(t.encode("utf-8")).hexdigest() for t in texts],
+        index=texts.index, name="text_hash",
+    )
+
+def prepare_records(df: pd.DataFrame) -> pd.DataFrame:
+    """['textos','labels'] crudos -> columnas del store. Solo normaliza estas filas."""
+    out = df.dropna(subset=["textos", "labels"])[["textos", "labels"]].copy()
+    out["textos"] = out["textos"].astype(str)
+    out["labels"] = out["labels"].astype(int)
+    out["textos_norm"] = normalize_series(out["textos"])
+    out["text_hash"] = hash_texts(out["textos_norm"])
+    out["norm_version"] = NORMALIZER_VERSION
+    return out[STORE_COLUMNS]
+
+def _upgrade_legacy(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Stores anteriores solo guardaban ['textos','labels'] ya normalizados y sin el crudo:
+    se adoptan tal cual como normalizados, sin crudo (`textos` nulo) y marcados con
+    LEGACY_NORM_VERSION para que `refresh_stale` no los vuelva a normalizar (los re-stemmearía).
+    """
+    df = df.dropna(subset=["textos", "labels"])[["textos", "labels"]].copy()
+    df["labels"] = df["labels"].astype(int)
+    df["textos_norm"] = df["textos"].astype(str)
+    df["textos"] = None
+    df["text_hash"] = hash_texts(df["textos_norm"])
+    df["norm_version"] = LEGACY_NORM_VERSION
+    return df[STORE_COLUMNS]
+
+def refresh_stale(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Re-normaliza desde el crudo solo las filas con otra versión del normalizador.
+    Las filas legacy (sin crudo) se conservan tal cual.
+    """
+    stale = (df["norm_version"] != NORMALIZER_VERSION) & (df["norm_version"] != LEGACY_NORM_VERSION)
+    if not stale.any():
+        return df
+    df = df.copy()
+    df.loc[stale, "textos_norm"] = normalize_series(df.loc[stale, "textos"])
+    df.loc[stale, "text_hash"] = hash_texts(df.loc[stale, "textos_norm"])
+    df.loc[stale, "norm_version"] = NORMALIZER_VERSION
+    return df
+
+# ===== Conjunto de evaluación =====
+def _file_md5(path: str) -> str:
+    h = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _eval_cache_key() -> Optional[dict]:
+    if not os.path.isfile(EVAL_CACHE_PATH):
+        return None
+    try:
+        meta = pq.read_schema(EVAL_CACHE_PATH).metadata or {}
+        return json.loads(meta[b"eval_source"])
+    except (OSError, KeyError, ValueError, pa.ArrowException):
+        return None
+
+def _write_eval_cache(df: pd.DataFrame, key: dict):
+    table = pa.Table.from_pandas(df[EVAL_COLUMNS], schema=EVAL_SCHEMA, preserve_index=False)
+    table = table.replace_schema_metadata({"eval_source": json.dumps(key)})
+    tmp = f"{EVAL_CACHE_PATH}.{uuid.uuid4().hex}.tmp"
+    pq.write_table(table, tmp)
+    os.replace(tmp, EVAL_CACHE_PATH)
+
+def load_eval_set(path: str) -> Optional[pd.DataFrame]:
+    """
+    Test fijo (textos, labels, textos_norm) leído y normalizado una sola vez.
+    - En memoria: se reutiliza mientras no cambien mtime/tamaño del archivo.
+    - En disco (eval_cache.parquet): si cambió el mtime pero no el md5, solo se actualiza la clave.
+    No modificar el DataFrame retornado (se comparte entre llamadas).
+    """
+    if not os.path.isfile(path):
+        return None
+    st = os.stat(path)
+    key = {"source": os.path.basename(path), "mtime_ns": st.st_mtime_ns, "size": st.st_size,
+           "norm_version": NORMALIZER_VERSION}
+    with _lock:
+        memo_key = _eval_memo["key"]
+        if memo_key is not None and {k: memo_key.get(k) for k in key} == key:
+            return _eval_memo["df"]
+
+        cached = _eval_cache_key()
+        same = lambda *ks: cached is not None and all(cached.get(k) == key[k] for k in ks)
+        if same("source", "mtime_ns", "size", "norm_version"):
+            key["md5"] = cached.get("md5")
+            df = pd.read_parquet(EVAL_CACHE_PATH)
+        else:
+            key["md5"] = _file_md5(path)
+            if same("source", "norm_version") and cached.get("md5") == key["md5"]:
+                df = pd.read_parquet(EVAL_CACHE_PATH)  # mismo contenido (p. ej. archivo copiado o tocado)
+            else:
+                df = _read_any(path)
+                if not {"textos", "labels"}.issubset(df.columns):
+                    return None
+                df = df[["textos", "labels"]].dropna().reset_index(drop=True)
+                df["textos"] = df["textos"].astype(str)
+                df["labels"] = df["labels"].astype(int)
+                df["textos_norm"] = normalize_series(df["textos"])
+            _write_eval_cache(df, key)
+
+        _eval_memo["key"], _eval_memo["df"] = key, df
+        return df
+
+# ===== Manifest y fragmentos =====
+def _read_manifest() -> Optional[dict]:
+    if not os.path.isfile(MANIFEST_PATH):
+        return None
+    with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _write_manifest(manifest: dict):
+    manifest["generation"] = int(manifest.get("generation", 0)) + 1
+    tmp = f"{MANIFEST_PATH}.{uuid.uuid4().hex}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, MANIFEST_PATH)
+
+def _write_segment(df: pd.DataFrame) -> dict:
+    name = f"part-{time.strftime('%Y%m%d_%H%M%S')}-{uuid.uuid4().hex[:8]}.parquet"
+    table = pa.Table.from_pandas(df[STORE_COLUMNS], schema=STORE_SCHEMA, preserve_index=False)
+    pq.write_table(table, os.path.join(STORE_DIR, name))
+    return {"file": name, "rows": int(len(df)), "norm_version": NORMALIZER_VERSION}
+
+def _segment_paths(manifest: dict) -> List[str]:
+    return [os.path.join(STORE_DIR, s["file"]) for s in manifest["segments"]]
+
+def _ensure_store() -> dict:
+    """Crea/migra el store segmentado y re-normaliza fragmentos de otra versión. Devuelve el manifest."""
+    with _lock:
+        manifest = _read_manifest()
+        if manifest is None:
+            os.makedirs(STORE_DIR, exist_ok=True)
+            if os.path.isfile(STORE_PATH):
+                df = pd.read_parquet(STORE_PATH)
+                df = _upgrade_legacy(df) if "textos_norm" not in df.columns else refresh_stale(df)
+            else:
+                df = prepare_records(load_sources())
+            df = df.drop_duplicates(subset=["text_hash"])
+            manifest = {"generation": 0, "segments": [_write_segment(df)]}
+            _write_manifest(manifest)
+            return manifest
+
+        stale = [s for s in manifest["segments"] if s.get("norm_version") != NORMALIZER_VERSION]
+        if stale:
+            segments = []
+            for seg in manifest["segments"]:
+                if seg in stale:
+                    df = refresh_stale(pd.read_parquet(os.path.join(STORE_DIR, seg["file"])))
+                    new_seg = _write_segment(df)
+                    os.remove(os.path.join(STORE_DIR, seg["file"]))
+                    seg = new_seg
+                segments.append(seg)
+            manifest["segments"] = segments
+            _write_manifest(manifest)
+        return manifest
+
+def _dataset(manifest: dict) -> ds.Dataset:
+    return ds.dataset(_segment_paths(manifest), format="parquet", schema=STORE_SCHEMA)
+
+# ===== Lectura =====
+def read_store(columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Store canónico normalizado con la versión vigente. `columns` proyecta solo
+    las columnas necesarias (p. ej. ['textos_norm','labels'] para entrenar).
+    """
+    with _lock:
+        manifest = _ensure_store()
+        return _dataset(manifest).to_table(columns=columns or STORE_COLUMNS).to_pandas()
+
+def store_size() -> int:
+    """Filas del store según el manifest (sin leer los fragmentos)."""
+    with _lock:
+        return sum(int(s["rows"]) for s in _ensure_store()["segments"])
+
+def store_segments() -> List[dict]:
+    """Fragmentos vigentes (en el orden de `read_store`), con su `path` absoluto."""
+    with _lock:
+        return [s | {"path": os.path.join(STORE_DIR, s["file"])} for s in _ensure_store()["segments"]]
+
+def store_hashes() -> Set[str]:
+    """Índice de hashes para dedup; se reconstruye por proyección solo si cambió el manifest."""
+    with _lock:
+        manifest = _ensure_store()
+        if _hash_index["generation"] != manifest["generation"]:
+            col = _dataset(manifest).to_table(columns=["text_hash"]).column("text_hash")
+            _hash_index["hashes"] = set(col.to_pylist())
+            _hash_index["generation"] = manifest["generation"]
+        return _hash_index["hashes"]
+
+# ===== Escritura =====
+def append_store(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Agrega un fragmento con las filas de `df` (columnas STORE_COLUMNS) cuyo hash no está
+    en el store. Costo O(lote). Devuelve las filas efectivamente agregadas.
+    """
+    with _lock:
+        hashes = store_hashes()
+        df = df.drop_duplicates(subset=["text_hash"])
+        df = df[~df["text_hash"].isin(hashes)]
+        if df.empty:
+            return df
+        manifest = _read_manifest()
+        manifest["segments"].append(_write_segment(df))
+        _write_manifest(manifest)
+        hashes.update(df["text_hash"])
+        _hash_index["generation"] = manifest["generation"]
+        n_segments = len(manifest["segments"])
+
+    if n_segments > STORE_COMPACT_THRESHOLD and not _compacting.is_set():
+        threading.Thread(target=compact_store, name="store-compaction", daemon=True).start()
+    return df
 
 def write_store(df: pd.DataFrame):
-    os.makedirs(os.path.dirname(STORE_PATH), exist_ok=True)
-    df.to_parquet(STORE_PATH, index=False)
+    """Reemplaza el store completo por un único fragmento con el contenido de `df`."""
+    with _lock:
+        os.makedirs(STORE_DIR, exist_ok=True)
+        old = _read_manifest()
+        manifest = {"generation": old["generation"] if old else 0, "segments": [_write_segment(df)]}
+        _write_manifest(manifest)
+        for p in (_segment_paths(old) if old else []):
+            if os.path.isfile(p):
+                os.remove(p)
+
+def compact_store():
+    """Fusiona los fragmentos actuales en uno solo, por lotes (memoria acotada)."""
+    if _compacting.is_set():
+        return
+    _compacting.set()
+    try:
+        with _lock:
+            manifest = _ensure_store()
+            segments = list(manifest["segments"])
+        if len(segments) <= 1:
+            return
+
+        name = f"part-{time.strftime('%Y%m%d_%H%M%S')}-{uuid.uuid4().hex[:8]}.parquet"
+        path = os.path.join(STORE_DIR, name)
+        rows = 0
+        src = ds.dataset([os.path.join(STORE_DIR, s["file"]) for s in segments], format="parquet", schema=STORE_SCHEMA)
+        with pq.ParquetWriter(path, STORE_SCHEMA) as writer:
+            for batch in src.to_batches(batch_size=STORE_BATCH_SIZE):
+                writer.write_batch(batch)
+                rows += batch.num_rows
+        # merged_from permite a features.py armar los conteos del fusionado sin re-tokenizar
+        merged = {"file": name, "rows": rows, "norm_version": NORMALIZER_VERSION,
+                  "merged_from": [s["file"] for s in segments]}
+
+        with _lock:
+            # fragmentos agregados mientras se compactaba se conservan detrás del fusionado
+            manifest = _read_manifest()
+            done = {s["file"] for s in segments}
+            if not done.issubset(s["file"] for s in manifest["segments"]):
+                # otro proceso compactó o reescribió el store mientras tanto: se descarta este fusionado
+                os.remove(path)
+                return
+            manifest["segments"] = [merged] + [s for s in manifest["segments"] if s["file"] not in done]
+            _write_manifest(manifest)
+            for s in segments:
+                p = os.path.join(STORE_DIR, s["file"])
+                if os.path.isfile(p):
+                    os.remove(p)
+    finally:
+        _compacting.clear()
@@ -0,0 +1,112 @@
+# etapa2/back/evaluation.py
+"""
+Validación cruzada k-fold de cada modelo candidato antes de publicarlo.
+
+- Los folds comparten la tokenización: con pipelines TF-IDF se usan los conteos de n-gramas del
+  store (features.py). Cada fold ajusta vocabulario e idf_ solo con sus filas de entrenamiento
+  (`fit_from_counts`) y transforma sus filas de validación desde los mismos conteos. Sin conteos
+  (p. ej. sgd_online, que usa HashingVectorizer) cada fold ajusta el pipeline sobre los textos.
+- Los folds corren en paralelo (joblib); las matrices de conteos llegan a los workers como memmap.
+- `groups`: filas con el mismo grupo caen en el mismo fold y solo se evalúa la primera (las copias
+  del oversampling de reweight no se filtran entre entrenamiento y validación).
+- Resultado: métricas macro por fold (media y desvío), precisión/recall/f1/soporte por clase y la
+  matriz de confusión de las predicciones fuera de fold.
+"""
+import os
+import time
+from typing import Any, Callable, Dict, Optional
+
+import numpy as np
+from joblib import Parallel, delayed, effective_n_jobs
+from sklearn.model_selection import StratifiedKFold
+from sklearn.metrics import accuracy_score, confusion_matrix, precision_recall_fscore_support
+
+from .features import Counts, fit_pipeline_from_counts, predict_pipeline_from_counts
+
+# folds de la validación cruzada (< 2 la desactiva)
+CV_FOLDS = int(os.environ.get("CV_FOLDS", "5"))
+CV_N_JOBS = int(os.environ.get("CV_N_JOBS", "-1"))
+
+def _macro(y_true, y_pred) -> Dict[str, float]:
+    p, r, f1, _ = precision_recall_fscore_support(y_true, y_pred, average="macro", zero_division=0)
+    return {"precision": float(p), "recall": float(r), "f1": float(f1), "accuracy": float(accuracy_score(y_true, y_pred))}
+
+def _splits(y: np.ndarray, groups: Optional[np.ndarray], k: int, random_state: int):
+    """(train, test) por fold; con `groups`, se parte sobre la primera fila de cada grupo."""
+    if groups is None:
+        yield from StratifiedKFold(n_splits=k, shuffle=True, random_state=random_state).split(np.zeros(len(y)), y)
+        return
+    _, first, inverse = np.unique(groups, return_index=True, return_inverse=True)
+    skf = StratifiedKFold(n_splits=k, shuffle=True, random_state=random_state)
+    for _, te_groups in skf.split(np.zeros(len(first)), y[first]):
+        in_test = np.zeros(len(first), dtype=bool)
+        in_test[te_groups] = True
+        yield np.flatnonzero(~in_test[inverse]), np.sort(first[te_groups])
+
+def _run_fold(make_pipe: Callable[[], Any], X, y, counts: Optional[Counts], tr, te):
+    t0 = time.perf_counter()
+    pipe = make_pipe()
+    if counts is not None:
+        terms, C = counts
+        fit_pipeline_from_counts(pipe, (terms, C[tr]), y[tr])
+        yhat = predict_pipeline_from_counts(pipe, (terms, C[te]))
+    else:
+        pipe.fit(X[tr], y[tr])
+        yhat = pipe.predict(X[te])
+    return np.asarray(yhat), time.perf_counter() - t0
+
+def cross_validate(
+    make_pipe: Callable[[], Any],
+    y,
+    X=None,
+    counts: Optional[Counts] = None,
+    groups=None,
+    k: int = CV_FOLDS,
+    random_state: int = 42,
+    n_jobs: int = CV_N_JOBS,
+) -> Optional[Dict[str, Any]]:
+    """
+    `make_pipe()` crea un pipeline sin ajustar (se llama en cada worker). Con `counts` (alineados con
+    `y`) los folds no re-tokenizan; si no, se usan los textos `X`. Retorna None si la CV está desactivada.
+    """
+    if k < 2:
+        return None
+    y = np.asarray(y)
+    X = None if X is None else np.asarray(X, dtype=object)
+    labels, class_counts = np.unique(y if groups is None else y[np.unique(groups, return_index=True)[1]],
+                                     return_counts=True)
+    k_eff = int(min(k, class_counts.min()))
+    if len(labels) < 2 or k_eff < 2:
+        return {"folds": k, "skipped": "hay clases con menos de 2 ejemplos"}
+
+    t0 = time.perf_counter()
+    splits = list(_splits(y, None if groups is None else np.asarray(groups), k_eff, random_state))
+    with Parallel(n_jobs=min(effective_n_jobs(n_jobs), k_eff)) as parallel:
+        results = parallel(delayed(_run_fold)(make_pipe, X, y, counts, tr, te) for tr, te in splits)
+
+    evaluated = np.concatenate([te for _, te in splits])
+    oof = np.empty(len(y), dtype=y.dtype)
+    per_fold = []
+    for i, ((tr, te), (yhat, seconds)) in enumerate(zip(splits, results)):
+        oof[te] = yhat
+        per_fold.append({"fold": i, "n_train": int(len(tr)), "n_test": int(len(te)),
+                         **_macro(y[te], yhat), "seconds": seconds})
+
+    y_eval, y_pred = y[evaluated], oof[evaluated]
+    p, r, f1, support = precision_recall_fscore_support(y_eval, y_pred, labels=labels, zero_division=0)
+    keys = ("precision", "recall", "f1", "accuracy")
+    return {
+        "folds": k_eff,
+        "features": "counts" if counts is not None else "texts",
+        "n_rows": int(len(evaluated)),
+        "mean": {m: float(np.mean([f[m] for f in per_fold])) for m in keys},
+        "std": {m: float(np.std([f[m] for f in per_fold])) for m in keys},
+        "per_fold": per_fold,
+        "labels": [lbl.item() if hasattr(lbl, "item") else lbl for lbl in labels],
+        "per_class": {
+            str(lbl): {"precision": float(p[i]), "recall": float(r[i]), "f1": float(f1[i]), "support": int(support[i])}
+            for i, lbl in enumerate(labels)
+        },
+        "confusion_matrix": confusion_matrix(y_eval, y_pred, labels=labels).tolist(),
+        "seconds": time.perf_counter() - t0,
+    }
@@ -0,0 +1,350 @@
+# etapa2/back/explain.py
+"""
+Explicaciones de `/explain`: qué n-gramas del texto empujan a cada clase.
+
+Los pipelines son lineales sobre TF-IDF (svc_calibrated, logreg) o hashing (sgd_online): el score
+de la clase c es `x · W[:, c] + b_c`, así que el aporte del término j es `x_j * W[j, c]`.
+- svc_calibrated: W es el promedio de los `coef_` de los folds de CalibratedClassifierCV (cada
+  calibrador sigmoide es monótono: el orden de los aportes se conserva). La probabilidad
+  reportada es la del modelo.
+- logreg / sgd_online: los `coef_` del clasificador.
+
+Índice (se calcula al publicar y se guarda en la exportación `model_<ts>.export/`):
+- explain_weights.npy  W como float32 (n_features, clases); para hashing solo las filas no nulas
+- explain_cols.npy     (hashing) columna de cada fila de W, ordenadas
+- explain_terms.npy    (hashing) término(s) de cada columna, acumulados desde los lotes entrenados
+- explain.json         clases, interceptos y los términos de mayor peso por clase (idf * W)
+
+Cada petición reutiliza la vectorización de la predicción y toma de W solo las filas de los
+no-ceros del lote (un gather disperso), sin perturbar el texto.
+"""
+import os
+import json
+import threading
+from typing import Any, Dict, List, Optional, Union
+
+import numpy as np
+import scipy.sparse as sp
+
+from .last_model import registry
+from .artifacts import export_path_for
+from .predict import _prepare_inputs, _split_model, _label_name, _labels_to_py
+
+EXPLAIN_FORMAT_VERSION = 1
+EXPLAIN_FILE = "explain.json"
+# términos de mayor peso por clase que se guardan en el índice
+EXPLAIN_INDEX_TOP = int(os.environ.get("EXPLAIN_INDEX_TOP", "50"))
+# términos por clase en cada explicación (valor por defecto de /explain)
+EXPLAIN_TERMS = int(os.environ.get("EXPLAIN_TERMS", "10"))
+
+_memo = {"key": None, "explainer": None}
+_memo_lock = threading.Lock()
+
+class NotExplainable(ValueError):
+    """El modelo no es un vectorizador + clasificador lineal."""
+
+def _vectorizer_kind(vec) -> Optional[str]:
+    from sklearn.feature_extraction.text import TfidfVectorizer, HashingVectorizer
+    from .artifacts import MappedTfidfVectorizer
+    if isinstance(vec, (TfidfVectorizer, MappedTfidfVectorizer)):
+        return "tfidf"
+    if isinstance(vec, HashingVectorizer):
+        return "hashing"
+    return None
+
+def _parts(model):
+    """(vectorizador, clasificador) de los pipelines del proyecto (sklearn, exportados u online)."""
+    steps = getattr(model, "steps", None)
+    if steps is not None:
+        if len(steps) != 2:
+            raise NotExplainable("Solo se explican pipelines vectorizador + clasificador.")
+        vec, clf = steps[0][1], steps[1][1]
+    else:
+        vec = getattr(model, "vectorizer", None) or getattr(model, "vec", None)
+        clf = getattr(model, "clf", None)
+    if vec is None or clf is None or _vectorizer_kind(vec) is None:
+        raise NotExplainable(f"Modelo sin vectorizador TF-IDF/hashing: {type(model).__name__}")
+    return vec, clf
+
+def _class_matrix(coef, intercept, n_classes: int):
+    """coef_ (k, n_features) -> (n_features, clases); en binario k=1 es la clase 1 y la 0 es su opuesto."""
+    coef = np.atleast_2d(coef.toarray() if sp.issparse(coef) else np.asarray(coef, dtype=np.float64))
+    intercept = np.ravel(np.asarray(intercept, dtype=np.float64))
+    if n_classes == 2 and coef.shape[0] == 1:
+        return np.vstack([-coef[0], coef[0]]).T, np.array([-intercept[0], intercept[0]])
+    return coef.T, intercept
+
+def _linear_weights(clf):
+    """(W, b, origen) del clasificador en el orden de `clf.classes_`."""
+    from sklearn.calibration import CalibratedClassifierCV
+    from .artifacts import CompiledCalibratedLinear
+    classes = np.asarray(clf.classes_)
+    n = len(classes)
+    if isinstance(clf, CalibratedClassifierCV):
+        Ws, bs = [], []
+        for cc in clf.calibrated_classifiers_:
+            est = cc.estimator
+            if not hasattr(est, "coef_"):
+                raise NotExplainable("El estimador calibrado no es lineal.")
+            W, b = _class_matrix(est.coef_, est.intercept_, n)
+            pos = np.searchsorted(classes, est.classes_)
+            Wf, bf = np.zeros((W.shape[0], n)), np.zeros(n)
+            Wf[:, pos], bf[pos] = W, b
+            Ws.append(Wf)
+            bs.append(bf)
+        return np.mean(Ws, axis=0), np.mean(bs, axis=0), "calibrated_folds_mean"
+    if isinstance(clf, CompiledCalibratedLinear):
+        # columnas (fold, clase) del scorer compilado; en binario solo hay decisiones de la clase 1
+        W, b = np.zeros((clf.coef.shape[0], n)), np.zeros(n)
+        for k in np.unique(clf.cls):
+            sel = clf.cls == k
+            W[:, k] = np.asarray(clf.coef[:, sel]).mean(axis=1)
+            b[k] = np.asarray(clf.intercept)[sel].mean()
+        if n == 2:
+            W[:, 0], b[0] = -W[:, 1], -b[1]
+        return W, b, "calibrated_folds_mean"
+    if hasattr(clf, "coef_"):
+        W, b = _class_matrix(clf.coef_, getattr(clf, "intercept_", np.zeros(len(clf.coef_))), n)
+        return W, b, "coef"
+    raise NotExplainable(f"Clasificador no lineal: {type(clf).__name__}")
+
+def _feature_names(vec):
+    """Función columnas -> términos del vocabulario TF-IDF (el array se arma una sola vez)."""
+    terms = getattr(vec, "terms", None)
+    if terms is not None:  # MappedTfidfVectorizer: términos UTF-8 ordenados + su columna
+        by_col = np.empty(vec.n_features, dtype=terms.dtype)
+        by_col[np.asarray(vec.cols)] = terms
+        return lambda cols: [t.decode("utf-8") for t in by_col[cols]]
+    names = vec.get_feature_names_out()
+    return lambda cols: names[cols].tolist()
+
+def _hashed_columns(vec, terms: List[str]) -> np.ndarray:
+    """Columna de cada término en el HashingVectorizer (se transforma cada término como documento)."""
+    if not terms:
+        return np.zeros(0, dtype=np.int64)
+    T = vec.transform(terms)
+    return T.indices.astype(np.int64) if T.nnz == len(terms) else np.array(
+        [row.indices[0] if row.nnz else -1 for row in T], dtype=np.int64)
+
+def _merge_names(names: Dict[int, set], cols: np.ndarray, terms) -> None:
+    for c, t in zip(cols.tolist(), terms):
+        if c >= 0 and t:
+            names.setdefault(c, set()).update(t.split(" | "))
+
+class ExplainIndex:
+    """Pesos por término y clase de un modelo publicado, con los términos de mayor peso por clase."""
+    def __init__(self, classes, weights, intercept, source: str, kind: str, top_terms: Dict[str, list],
+                 cols=None, terms=None):
+        self.classes = np.asarray(classes)
+        self.weights = weights      # (filas, clases); fila = columna del vectorizador o posición en `cols`
+        self.intercept = np.asarray(intercept, dtype=np.float64)
+        self.source = source
+        self.kind = kind            # "tfidf" | "hashing"
+        self.top_terms = top_terms
+        self.cols = cols            # hashing: columnas de las filas de `weights` (ordenadas)
+        self.terms = terms          # hashing: términos de cada columna (bytes UTF-8, b"" si no se conocen)
+
+    @classmethod
+    def from_model(cls_, model, texts=None, parent_dir: Optional[str] = None,
+                   top: int = EXPLAIN_INDEX_TOP) -> "ExplainIndex":
+        """
+        Índice de `model`. Para hashing, los nombres de las columnas salen de los términos de `texts`
+        (lo entrenado en esta publicación) más los del índice del padre (`parent_dir`).
+        """
+        vec, clf = _parts(model)
+        W, b, source = _linear_weights(clf)
+        W = W.astype(np.float32)
+        kind = _vectorizer_kind(vec)
+        if kind == "tfidf":
+            idf = np.asarray(vec.idf_) if getattr(vec, "idf_", None) is not None else np.ones(W.shape[0])
+            rank = W * idf[:, None]
+            names = _feature_names(vec)
+            cols = terms = None
+        else:
+            nz = np.flatnonzero(np.any(W != 0, axis=1))
+            W, cols = W[nz], nz.astype(np.int64)
+            known: Dict[int, set] = {}
+            parent = cls_.load(parent_dir, mmap_mode=None) if parent_dir else None
+            if parent is not None and parent.cols is not None:
+                _merge_names(known, parent.cols, [t.decode("utf-8") for t in parent.terms])
+            if texts is not None:
+                analyze = vec.build_analyzer()
+                seen = set()
+                for doc in texts:
+                    seen.update(analyze(doc))
+                seen = sorted(seen)
+                _merge_names(known, _hashed_columns(vec, seen), seen)
+            terms = np.array([" | ".join(sorted(known.get(c, ()))).encode("utf-8") for c in cols.tolist()])
+            rank = W.astype(np.float64)
+            names = lambda rows: [t.decode("utf-8") for t in terms[rows]]
+
+        top_terms = {}
+        for k, lbl in enumerate(_labels_to_py(np.asarray(clf.classes_))):
+            col = rank[:, k]
+            rows = np.flatnonzero(col > 0)
+            if kind == "hashing":
+                rows = rows[terms[rows] != b""]
+            rows = rows[np.argsort(-col[rows], kind="stable")[:top]]
+            top_terms[str(lbl)] = [{"term": t, "weight": float(col[r])} for t, r in zip(names(rows), rows.tolist())]
+        return cls_(clf.classes_, np.ascontiguousarray(W), b, source, kind, top_terms, cols=cols, terms=terms)
+
+    def save(self, path: str):
+        np.save(os.path.join(path, "explain_weights.npy"), self.weights)
+        if self.cols is not None:
+            np.save(os.path.join(path, "explain_cols.npy"), self.cols)
+            np.save(os.path.join(path, "explain_terms.npy"), self.terms)
+        with open(os.path.join(path, EXPLAIN_FILE), "w", encoding="utf-8") as f:
+            json.dump({
+                "format": EXPLAIN_FORMAT_VERSION,
+                "kind": self.kind,
+                "source": self.source,
+                "classes": _labels_to_py(self.classes),
+                "intercept": self.intercept.tolist(),
+                "top_terms": self.top_terms,
+            }, f, ensure_ascii=False, indent=2)
+
+    @classmethod
+    def load(cls_, path: str, mmap_mode: Optional[str] = "r") -> Optional["ExplainIndex"]:
+        """Índice guardado en la exportación `path` (None si no tiene)."""
+        try:
+            with open(os.path.join(path, EXPLAIN_FILE), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get("format") != EXPLAIN_FORMAT_VERSION:
+            return None
+        arr = lambda name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+        hashed = meta["kind"] == "hashing"
+        return cls_(np.asarray(meta["classes"]), arr("explain_weights"), meta["intercept"], meta["source"],
+                    meta["kind"], meta["top_terms"],
+                    cols=arr("explain_cols") if hashed else None, terms=arr("explain_terms") if hashed else None)
+
+    def rows_for(self, indices: np.ndarray) -> np.ndarray:
+        """Filas de W (nnz, clases) de las columnas `indices`; columnas sin peso -> 0."""
+        if self.cols is None:
+            return np.asarray(self.weights[indices], dtype=np.float64)
+        pos = np.searchsorted(self.cols, indices)
+        pos[pos >= len(self.cols)] = 0
+        hit = self.cols[pos] == indices
+        out = np.zeros((len(indices), self.weights.shape[1]))
+        out[hit] = self.weights[pos[hit]]
+        return out
+
+class Explainer:
+    """Índice + vectorizador/clasificador del modelo residente (uno por versión cargada)."""
+    def __init__(self, model, index: ExplainIndex):
+        self.model = model
+        self.index = index
+        self.transform, self.clf = _split_model(model)
+        vec, _ = _parts(model)
+        self.vec = vec
+        self._names = _feature_names(vec) if index.kind == "tfidf" else None
+        self._analyze = vec.build_analyzer() if index.kind == "hashing" else None
+        classes = np.asarray(model.classes_)
+        if not np.array_equal(np.sort(classes), np.sort(index.classes)):
+            raise NotExplainable("Las clases del índice no coinciden con las del modelo.")
+        # columna del índice de cada clase del modelo
+        self._class_pos = np.array([int(np.flatnonzero(index.classes == c)[0]) for c in classes])
+
+    def _term_names(self, X: List[str], rows: np.ndarray, cols: np.ndarray) -> List[str]:
+        """Nombre de cada no-cero elegido (fila `rows`, columna `cols`) del lote, de una sola vez."""
+        if self._names is not None:
+            return self._names(cols)
+        # hashing: nombres del índice; si la columna colisiona o no tiene nombre, los términos del texto
+        index = self.index
+        pos = np.minimum(np.searchsorted(index.cols, cols), max(len(index.cols) - 1, 0))
+        hit = index.cols[pos] == cols if len(index.cols) else np.zeros(len(cols), dtype=bool)
+        names = [t.decode("utf-8") if h else "" for h, t in zip(hit.tolist(), index.terms[pos])]
+        unresolved = sorted({int(r) for r, name in zip(rows.tolist(), names) if not name or " | " in name})
+        if unresolved:
+            row_terms = {r: set(self._analyze(X[r])) for r in unresolved}
+            terms = sorted(set().union(*row_terms.values()))
+            col_of = dict(zip(terms, _hashed_columns(self.vec, terms).tolist()))
+            for j, (r, c) in enumerate(zip(rows.tolist(), cols.tolist())):
+                if r in row_terms:
+                    found = sorted(t for t in row_terms[r] if col_of[t] == c)
+                    names[j] = " | ".join(found) if found else f"#{c}"
+        return names
+
+    def explain(self, X: List[str], top_k: int = 1, n_terms: int = EXPLAIN_TERMS) -> List[dict]:
+        Xv = sp.csr_matrix(self.transform(X))
+        classes = np.asarray(self.model.classes_)
+        n, n_classes = Xv.shape[0], len(classes)
+
+        # gather disperso: W solo en los no-ceros del lote
+        W = self.index.rows_for(Xv.indices)[:, self._class_pos]
+        contrib = W * Xv.data[:, None]
+        row_of = np.repeat(np.arange(n), np.diff(Xv.indptr))
+        scores = np.column_stack([np.bincount(row_of, weights=contrib[:, k], minlength=n) for k in range(n_classes)])
+        scores += self.index.intercept[self._class_pos]
+
+        proba = None
+        if hasattr(self.clf, "predict_proba"):
+            proba = np.asarray(self.clf.predict_proba(Xv))
+        ranking = proba if proba is not None else scores
+        order = np.argsort(-ranking, axis=1, kind="stable")[:, :max(1, min(int(top_k), n_classes))]
+
+        # aportes positivos de mayor a menor por (texto, clase), como posiciones en los no-ceros del lote
+        picks = []
+        for i in range(n):
+            start, end = Xv.indptr[i], Xv.indptr[i + 1]
+            for k in order[i].tolist():
+                c = contrib[start:end, k]
+                pick = np.flatnonzero(c > 0)
+                picks.append((i, k, start + pick[np.argsort(-c[pick], kind="stable")[:n_terms]]))
+        flat = np.concatenate([p for _, _, p in picks]) if picks else np.zeros(0, dtype=np.int64)
+        names = iter(self._term_names(X, row_of[flat], Xv.indices[flat]) if len(flat) else [])
+
+        labels = _labels_to_py(classes)
+        intercept = self.index.intercept[self._class_pos]
+        out = []
+        for i, k, pick in picks:
+            if not out or out[-1]["_row"] != i:
+                out.append({"_row": i, "explanations": []})
+            out[-1]["explanations"].append({
+                "label": labels[k],
+                "label_name": _label_name(labels[k]),
+                "prob": float(proba[i, k]) if proba is not None else None,
+                "score": float(scores[i, k]),
+                "intercept": float(intercept[k]),
+                "terms": [
+                    {"term": next(names), "value": float(Xv.data[j]), "weight": float(W[j, k]), "contribution": float(contrib[j, k])}
+                    for j in pick.tolist()
+                ],
+            })
+        for item in out:
+            top = item["explanations"][0]
+            del item["_row"]
+            item.update(label=top["label"], label_name=top["label_name"], prob=top["prob"])
+        return [{"label": it["label"], "label_name": it["label_name"], "prob": it["prob"],
+                 "explanations": it["explanations"]} for it in out]
+
+def get_explainer(loaded) -> Explainer:
+    """Explainer del modelo residente: índice de su exportación o, si no tiene, calculado del modelo."""
+    key = (loaded.path, loaded.md5)
+    with _memo_lock:
+        if _memo["key"] == key:
+            return _memo["explainer"]
+        index = ExplainIndex.load(export_path_for(loaded.path)) or ExplainIndex.from_model(loaded.model)
+        explainer = Explainer(loaded.model, index)
+        _memo["key"], _memo["explainer"] = key, explainer
+        return explainer
+
+def explain(texts: Union[str, List[str]], top_k: int = 1, n_terms: int = EXPLAIN_TERMS) -> Dict[str, Any]:
+    """Predicción + n-gramas que más aportan a las `top_k` clases más probables de cada texto."""
+    loaded = registry.current()
+    X = _prepare_inputs(texts)
+    return {"model_version": loaded.version, "predictions": get_explainer(loaded).explain(X, top_k=top_k, n_terms=n_terms)}
+
+def top_terms() -> Dict[str, Any]:
+    """Términos de mayor peso por clase del modelo activo (el índice global)."""
+    loaded = registry.current()
+    index = get_explainer(loaded).index
+    return {
+        "model_version": loaded.version,
+        "source": index.source,
+        "classes": [
+            {"label": lbl, "label_name": _label_name(lbl), "terms": index.top_terms.get(str(lbl), [])}
+            for lbl in _labels_to_py(index.classes)
+        ],
+    }
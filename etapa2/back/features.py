@@ -0,0 +1,216 @@
+# etapa2/back/features.py
+"""
+Caché de conteos de n-gramas por fragmento del store (reentrenamientos merge_all / reweight).
+
+- Junto a cada fragmento `part-*.parquet` se guarda `counts/<clave>/part-*.npz`: la matriz CSR
+  de conteos crudos por documento (int32) y su vocabulario local ordenado. La clave depende solo
+  de los parámetros de análisis del vectorizador (n-gramas, tokenización, acentos...).
+- Un reentrenamiento tokeniza solo los fragmentos sin conteos (el lote nuevo); el resto se lee
+  de disco y se fusiona en un vocabulario global.
+- `fit_from_counts` reproduce `TfidfVectorizer.fit_transform` a partir de esos conteos:
+  min_df/max_df, el corte de `max_features` (mismo orden y desempate que `_limit_features`)
+  e `idf_`. La matriz resultante es la misma que la de un ajuste desde cero.
+- `transform_counts` reproduce `transform` de un vectorizador ya ajustado (validación cruzada:
+  cada fold se ajusta y se evalúa sobre los mismos conteos, sin volver a tokenizar).
+"""
+import os
+import json
+import uuid
+import hashlib
+from typing import Iterable, List, Optional, Tuple
+from numbers import Integral
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import pyarrow.parquet as pq
+from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer, TfidfVectorizer
+
+from . import data_store
+from .utils import NORMALIZER_VERSION
+
+# FEATURE_CACHE=0 vuelve al ajuste completo del TF-IDF en cada reentrenamiento
+FEATURE_CACHE = os.environ.get("FEATURE_CACHE", "1") == "1"
+
+# parámetros que definen qué n-gramas se cuentan en cada documento (no el ajuste)
+_ANALYSIS_PARAMS = (
+    "input", "encoding", "decode_error", "strip_accents", "lowercase", "preprocessor",
+    "tokenizer", "analyzer", "stop_words", "token_pattern", "ngram_range",
+)
+
+Counts = Tuple[np.ndarray, sp.csr_matrix]  # (términos ordenados, conteos documentos x términos)
+
+def counts_dir() -> str:
+    return os.path.join(data_store.STORE_DIR, "counts")
+
+def analysis_key(vec: TfidfVectorizer) -> Optional[str]:
+    """Clave de la caché para el análisis de `vec`; None si no es cacheable (callables, vocabulario fijo)."""
+    params = {p: getattr(vec, p) for p in _ANALYSIS_PARAMS}
+    if vec.vocabulary is not None or any(callable(v) for v in params.values()):
+        return None
+    if params["stop_words"] is not None and not isinstance(params["stop_words"], str):
+        params["stop_words"] = sorted(params["stop_words"])
+    params["ngram_range"] = list(params["ngram_range"])
+    params["norm_version"] = NORMALIZER_VERSION
+    return hashlib.md5(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+def count_documents(vec: TfidfVectorizer, texts: Iterable[str]) -> Counts:
+    """Conteos crudos de `texts` con el analizador de `vec` (sin poda ni ponderación)."""
+    cv = CountVectorizer(**{p: getattr(vec, p) for p in _ANALYSIS_PARAMS}, dtype=np.int32)
+    texts = list(texts)
+    try:
+        X = cv.fit_transform(texts)
+    except ValueError:  # vocabulario vacío: documentos sin tokens
+        return np.array([], dtype=str), sp.csr_matrix((len(texts), 0), dtype=np.int32)
+    return cv.get_feature_names_out().astype(str), sp.csr_matrix(X)
+
+def merge_counts(parts: List[Counts]) -> Counts:
+    """Apila por filas conteos con vocabularios distintos sobre la unión ordenada de términos."""
+    terms = np.unique(np.concatenate([t for t, _ in parts])) if parts else np.array([], dtype=str)
+    blocks = []
+    for t, X in parts:
+        cols = np.searchsorted(terms, t)[X.indices].astype(X.indices.dtype, copy=False)
+        # el remapeo es monótono: los índices de cada fila siguen ordenados
+        blocks.append(sp.csr_matrix((X.data, cols, X.indptr), shape=(X.shape[0], len(terms))))
+    if not blocks:
+        return terms, sp.csr_matrix((0, 0), dtype=np.int32)
+    return terms, sp.vstack(blocks, format="csr")
+
+# ===== Conteos persistidos por fragmento =====
+def _save(path: str, counts: Counts):
+    terms, X = counts
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp.npz"
+    np.savez(tmp, terms=terms, data=X.data, indices=X.indices, indptr=X.indptr, shape=np.asarray(X.shape))
+    os.replace(tmp, path)
+
+def _load(path: str) -> Optional[Counts]:
+    try:
+        with np.load(path, allow_pickle=False) as z:
+            X = sp.csr_matrix((z["data"], z["indices"], z["indptr"]), shape=tuple(z["shape"]))
+            return z["terms"], X
+    except (OSError, ValueError, KeyError):
+        return None
+
+def _segment_counts(vec: TfidfVectorizer, key_dir: str, seg: dict) -> Tuple[Counts, str]:
+    path = os.path.join(key_dir, seg["file"] + ".npz")
+    counts = _load(path) if os.path.isfile(path) else None
+    if counts is not None and counts[1].shape[0] == int(seg["rows"]):
+        return counts, "cached"
+
+    # fragmento compactado: se fusionan los conteos de sus fuentes si siguen en disco
+    sources = [os.path.join(key_dir, f + ".npz") for f in seg.get("merged_from") or []]
+    if sources and all(os.path.isfile(p) for p in sources):
+        parts = [_load(p) for p in sources]
+        if all(p is not None for p in parts):
+            counts = merge_counts(parts)
+            if counts[1].shape[0] == int(seg["rows"]):
+                _save(path, counts)
+                return counts, "merged"
+
+    texts = pq.read_table(seg["path"], columns=["textos_norm"]).column(0).to_pylist()
+    counts = count_documents(vec, texts)
+    _save(path, counts)
+    return counts, "computed"
+
+def store_counts(vec: TfidfVectorizer) -> Optional[Tuple[pd.DataFrame, Counts, dict]]:
+    """
+    (store con textos_norm/labels, conteos alineados por fila, resumen) o None si el análisis de
+    `vec` no es cacheable. Solo se tokenizan los fragmentos sin conteos en disco.
+    """
+    key = analysis_key(vec)
+    if key is None:
+        return None
+    key_dir = os.path.join(counts_dir(), key)
+    os.makedirs(key_dir, exist_ok=True)
+
+    with data_store._lock:
+        segments = data_store.store_segments()
+        df = data_store.read_store(columns=["textos_norm", "labels"])
+        parts, summary = [], {"cached": 0, "merged": 0, "computed": 0}
+        for seg in segments:
+            counts, how = _segment_counts(vec, key_dir, seg)
+            parts.append(counts)
+            summary[how] += 1
+
+        # conteos de fragmentos que ya no existen (compactados, re-normalizados)
+        live = {seg["file"] + ".npz" for seg in segments}
+        for name in os.listdir(key_dir):
+            if name.endswith(".npz") and name not in live:
+                os.remove(os.path.join(key_dir, name))
+
+    terms, X = merge_counts(parts)
+    if X.shape[0] != len(df):
+        raise RuntimeError("Los conteos del store no están alineados con sus filas.")
+    return df, (terms, X), summary
+
+# ===== Ajuste del TF-IDF desde conteos =====
+def fit_from_counts(vec: TfidfVectorizer, counts: Counts):
+    """
+    Ajusta `vec` (vocabulary_ e idf_) a partir de los conteos de los documentos de entrenamiento y
+    retorna su matriz TF-IDF, igual a `vec.fit_transform(textos)`.
+    """
+    terms, X = counts
+    X = X.astype(vec.dtype)
+    # solo existen los términos que aparecen en estos documentos (orden alfabético, como _sort_features)
+    present = np.flatnonzero(np.bincount(X.indices, minlength=X.shape[1]))
+    if len(present) == 0:
+        raise ValueError("empty vocabulary; perhaps the documents only contain stop words")
+    X, terms = X[:, present], terms[present]
+    if vec.binary:
+        X.data.fill(1)
+
+    n_doc = X.shape[0]
+    max_doc_count = vec.max_df if isinstance(vec.max_df, Integral) else vec.max_df * n_doc
+    min_doc_count = vec.min_df if isinstance(vec.min_df, Integral) else vec.min_df * n_doc
+    if max_doc_count < min_doc_count:
+        raise ValueError("max_df corresponds to < documents than min_df")
+
+    # mismo criterio que CountVectorizer._limit_features (tfs en orden alfabético y argsort por defecto)
+    dfs = np.bincount(X.indices, minlength=X.shape[1])
+    mask = (dfs <= max_doc_count) & (dfs >= min_doc_count)
+    limit = vec.max_features
+    if limit is not None and mask.sum() > limit:
+        tfs = np.asarray(X.sum(axis=0)).ravel()
+        mask_inds = (-tfs[mask]).argsort()[:limit]
+        new_mask = np.zeros(len(dfs), dtype=bool)
+        new_mask[np.where(mask)[0][mask_inds]] = True
+        mask = new_mask
+    kept = np.where(mask)[0]
+    if len(kept) == 0:
+        raise ValueError("After pruning, no terms remain. Try a lower min_df or a higher max_df.")
+
+    X = X[:, kept]
+    vec.fixed_vocabulary_ = False
+    vec.vocabulary_ = {t: i for i, t in enumerate(terms[kept].tolist())}
+    vec._tfidf = TfidfTransformer(
+        norm=vec.norm, use_idf=vec.use_idf, smooth_idf=vec.smooth_idf, sublinear_tf=vec.sublinear_tf
+    ).fit(X)
+    return vec._tfidf.transform(X, copy=False)
+
+def transform_counts(vec: TfidfVectorizer, counts: Counts):
+    """Matriz TF-IDF de documentos ya contados con el vocabulario e idf_ de `vec` (= `vec.transform(textos)`)."""
+    terms, X = counts
+    vocab = vec.vocabulary_
+    cols = np.fromiter((vocab.get(t, -1) for t in terms.tolist()), dtype=np.int64, count=len(terms))
+    present = np.flatnonzero(cols >= 0)
+    X = X[:, present[np.argsort(cols[present])]].astype(vec.dtype)
+    if X.shape[1] != len(vocab):
+        raise ValueError("El vocabulario del vectorizador no está contenido en los términos de los conteos.")
+    if vec.binary:
+        X.data.fill(1)
+    return vec._tfidf.transform(X, copy=False)
+
+def fit_pipeline_from_counts(pipe, counts: Counts, y):
+    """Ajusta un Pipeline TF-IDF + clasificador usando `fit_from_counts` para el primer paso."""
+    Xt = fit_from_counts(pipe.steps[0][1], counts)
+    for _, step in pipe.steps[1:-1]:
+        Xt = step.fit_transform(Xt, y)
+    pipe.steps[-1][1].fit(Xt, y)
+    return pipe
+
+def predict_pipeline_from_counts(pipe, counts: Counts):
+    """`pipe.predict` sobre documentos ya contados (pipeline ajustado con `fit_pipeline_from_counts`)."""
+    Xt = transform_counts(pipe.steps[0][1], counts)
+    for _, step in pipe.steps[1:-1]:
+        Xt = step.transform(Xt)
+    return pipe.steps[-1][1].predict(Xt)
@@ -0,0 +1,218 @@
+# etapa2/back/jobs.py
+import os
+import time
+import uuid
+import threading
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from .last_model import registry
+from . import metrics as prom
+
+# reentrenamientos simultáneos (procesos del pool dedicado)
+RETRAIN_MAX_CONCURRENCY = int(os.environ.get("RETRAIN_MAX_CONCURRENCY", "1"))
+# trabajos terminados que se conservan para consulta
+RETRAIN_JOBS_HISTORY = int(os.environ.get("RETRAIN_JOBS_HISTORY", "100"))
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+@dataclass
+class RetrainJob:
+    id: str
+    strategy: str
+    pipeline: str
+    records: List[Dict[str, Any]] = field(default_factory=list, repr=False)
+    status: str = "queued"  # queued | running | done | failed
+    progress: Optional[str] = None
+    n_records: int = 0
+    n_requests: int = 1
+    created_at: str = field(default_factory=_now)
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+    metrics: Optional[Dict[str, float]] = None
+    model_path: Optional[str] = None
+    error: Optional[str] = None
+    started_mono: float = field(default=0.0, repr=False)
+
+    def info(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "progress": self.progress,
+            "strategy": self.strategy,
+            "pipeline": self.pipeline,
+            "n_records": self.n_records,
+            "n_requests": self.n_requests,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "metrics": self.metrics,
+            "model_version_path": self.model_path,
+            "error": self.error,
+        }
+
+def _run_job(job_id: str, records, strategy: str, pipeline: str, progress) -> Dict[str, Any]:
+    """Se ejecuta en un proceso del pool; reporta la etapa actual en el dict compartido."""
+    from .retrain_service import retrain_from_records
+
+    clock = prom.StageClock()
+
+    def report(stage: str):
+        clock.mark(stage.split(" ")[0])  # "buscando 3/15" -> "buscando"
+        progress[job_id] = stage
+
+    metrics, paths = retrain_from_records(records, strategy=strategy, pipeline_name=pipeline, progress=report)
+    return {"metrics": metrics, "model_path": paths["model_path"], "stage_seconds": clock.finish()}
+
+class RetrainJobQueue:
+    """
+    Cola de reentrenamientos en un pool de procesos dedicado.
+    - `submit` devuelve el trabajo al instante; como máximo `max_concurrency` corren a la vez.
+    - Peticiones que llegan mientras otra espera con la misma estrategia/pipeline se
+      fusionan (coalescing) en ese trabajo pendiente: un solo fit con todos los registros.
+    """
+    def __init__(self, max_concurrency: int = RETRAIN_MAX_CONCURRENCY):
+        self.max_concurrency = max(1, max_concurrency)
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, RetrainJob] = {}
+        self._queue: List[RetrainJob] = []
+        self._running = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._manager = None
+        self._progress = None
+        self._refresh_wanted = threading.Event()
+        self._refresher: Optional[threading.Thread] = None
+
+    def _request_refresh(self):
+        """
+        Pide recargar el modelo activo en el hilo `model-refresh`: la carga no corre en el hilo de
+        callbacks del pool, que también entrega los resultados de los demás trabajos. Varias
+        publicaciones seguidas se resuelven con una sola recarga.
+        """
+        self._refresh_wanted.set()
+        with self._lock:
+            if self._refresher is None:
+                self._refresher = threading.Thread(target=self._refresh_loop, name="model-refresh", daemon=True)
+                self._refresher.start()
+
+    def _refresh_loop(self):
+        while True:
+            self._refresh_wanted.wait()
+            self._refresh_wanted.clear()
+            try:
+                registry.refresh()
+            except Exception:
+                pass
+
+    def _ensure_executor(self):
+        if self._executor is None:
+            self._manager = mp.Manager()
+            self._progress = self._manager.dict()
+            self._executor = ProcessPoolExecutor(max_workers=self.max_concurrency)
+
+    def _discard_executor(self, executor: Optional[ProcessPoolExecutor] = None):
+        """
+        Descarta el pool roto (un worker murió: OOM, segfault); el próximo trabajo crea uno nuevo.
+        Con `executor`, solo si sigue siendo el actual: los demás trabajos del pool roto no tiran el nuevo.
+        """
+        if self._executor is not None and (executor is None or executor is self._executor):
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def submit(self, records: List[Dict[str, Any]], strategy: str, pipeline: str) -> RetrainJob:
+        with self._lock:
+            for job in self._queue:
+                if job.strategy == strategy and job.pipeline == pipeline:
+                    job.records.extend(records)
+                    job.n_records = len(job.records)
+                    job.n_requests += 1
+                    return job
+            job = RetrainJob(id=uuid.uuid4().hex, strategy=strategy, pipeline=pipeline, records=list(records), n_records=len(records))
+            self._jobs[job.id] = job
+            self._queue.append(job)
+            self._prune()
+            self._dispatch()
+            return job
+
+    def _dispatch(self):
+        """Arranca trabajos de la cola mientras haya cupo (con el lock tomado)."""
+        retried = False
+        while self._queue and self._running < self.max_concurrency:
+            self._ensure_executor()
+            executor = self._executor
+            job = self._queue.pop(0)
+            job.status = "running"
+            job.started_at = _now()
+            job.started_mono = time.monotonic()
+            self._running += 1
+            try:
+                fut = executor.submit(_run_job, job.id, job.records, job.strategy, job.pipeline, self._progress)
+            except (BrokenProcessPool, RuntimeError) as e:
+                # no arrancó: se deshace el estado y se reintenta una vez con un pool nuevo
+                self._running -= 1
+                self._discard_executor(executor)
+                if not retried:
+                    retried = True
+                    job.status, job.started_at = "queued", None
+                    self._queue.insert(0, job)
+                    continue
+                job.status, job.error, job.records, job.finished_at = "failed", str(e), [], _now()
+                prom.inc("retrain_jobs_total", strategy=job.strategy, status="failed")
+                continue
+            fut.add_done_callback(lambda f, job=job, executor=executor: self._finish(job, f, executor))
+
+    def _finish(self, job: RetrainJob, fut, executor: Optional[ProcessPoolExecutor] = None):
+        status, error, res, broken = "done", None, None, False
+        try:
+            res = fut.result()
+            # el modelo se publicó en otro proceso: se activa ya, sin esperar al intervalo
+            self._request_refresh()
+        except BrokenProcessPool as e:
+            status, error, broken = "failed", f"El proceso del reentrenamiento terminó abruptamente: {e}", True
+        except Exception as e:
+            status, error = "failed", str(e)
+        # el trabajo corre en otro proceso: las métricas se registran aquí con lo que retornó
+        prom.inc("retrain_jobs_total", strategy=job.strategy, status=status)
+        prom.observe("retrain_duration_seconds", time.monotonic() - job.started_mono, strategy=job.strategy)
+        for stage, secs in ((res or {}).get("stage_seconds") or {}).items():
+            prom.observe("retrain_stage_seconds", secs, strategy=job.strategy, stage=stage)
+        with self._lock:
+            if res is not None:
+                job.metrics = res["metrics"]
+                job.model_path = res["model_path"]
+            job.error = error
+            job.records = []  # ya no se necesitan; solo se conserva el conteo
+            job.progress = self._progress.pop(job.id, job.progress)
+            job.finished_at = _now()
+            job.status = status
+            self._running -= 1
+            if broken:
+                self._discard_executor(executor)
+            self._dispatch()
+
+    def _prune(self):
+        finished = [j for j in self._jobs.values() if j.status in ("done", "failed")]
+        for j in finished[:max(0, len(finished) - RETRAIN_JOBS_HISTORY)]:
+            del self._jobs[j.id]
+
+    def get(self, job_id: str) -> Optional[RetrainJob]:
+        job = self._jobs.get(job_id)
+        if job is not None and job.status == "running" and self._progress is not None:
+            job.progress = self._progress.get(job.id, job.progress)
+        return job
+
+    def list_jobs(self) -> List[RetrainJob]:
+        return [self.get(j) for j in list(self._jobs)]
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._manager.shutdown()
+            self._executor = self._manager = self._progress = None
+
+retrain_jobs = RetrainJobQueue()
@@ -1,30 +1,175 @@
 # etapa2/back/last_model.py
 import os
-import glob
+import json
+import time
+import hashlib
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Callable, List, Optional
+
 import joblib
 
+from .artifacts import export_path_for, load_export, load_stem_table
+from .utils import get_normalizer
+from . import versions
+from .versions import RETRAIN_DIR
+from . import metrics
+
 # carpetas relativas a /etapa2/back
 BACK_DIR = os.path.dirname(os.path.abspath(__file__))
 FIRST_MODEL = os.path.normpath(os.path.join(BACK_DIR, "..", "first_model.pkl"))
-RETRAIN_DIR = os.path.normpath(os.path.join(BACK_DIR, "..", "retrain_models"))
+
+# cada cuántos segundos, como máximo, se revisa retrain_models/ en busca de una versión nueva
+MODEL_REFRESH_SECONDS = float(os.environ.get("MODEL_REFRESH_SECONDS", "5"))
+# "auto": usa la exportación mmap (model_<ts>.export/) si existe; "pkl": siempre el pickle
+MODEL_LOAD_FORMAT = os.environ.get("MODEL_LOAD_FORMAT", "auto")
 
 def get_last_model_path() -> str:
-    os.makedirs(RETRAIN_DIR, exist_ok=True)
-    # solo modelos .pkl (ignora .gitkeep y otros)
-    candidates = sorted(
-        glob.glob(os.path.join(RETRAIN_DIR, "*.pkl")),
-        key=os.path.getctime
-    )
-    return candidates[-1] if candidates else FIRST_MODEL
+    """Modelo activo según el índice de versiones (versions.json); sin versiones, first_model.pkl."""
+    path = versions.active_model_path()
+    return path if path and os.path.isfile(path) else FIRST_MODEL
 
-def get_last_model():
-    path = get_last_model_path()
+def _file_md5(path: str) -> str:
+    h = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _model_md5(path: str) -> str:
+    """md5 publicado en el .meta.json; si no existe, se calcula sobre el .pkl."""
+    meta_path = os.path.splitext(path)[0] + ".meta.json"
+    if os.path.isfile(meta_path):
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                md5 = json.load(f).get("md5")
+            if md5:
+                return md5
+        except (OSError, ValueError):
+            pass
+    return _file_md5(path)
+
+def _signature(path: str):
+    """Identifica una versión en disco: ruta + mtime + tamaño."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return (path, None, None)
+    return (path, st.st_mtime_ns, st.st_size)
+
+@dataclass(frozen=True)
+class LoadedModel:
+    model: Any
+    path: str
+    version: str
+    md5: str
+    loaded_at: str
+    artifact: str = "pkl"
+
+    def info(self) -> dict:
+        return {"version": self.version, "path": self.path, "md5": self.md5,
+                "loaded_at": self.loaded_at, "artifact": self.artifact}
+
+def load_model_file(path: str):
+    """Carga el modelo de `path`; con MODEL_LOAD_FORMAT=auto prefiere su exportación mmap. Retorna (modelo, artefacto)."""
+    export_dir = export_path_for(path)
+    # la tabla token -> forma del modelo evita el stemmer para su vocabulario desde la primera petición
+    get_normalizer().load_stem_table(load_stem_table(export_dir))
+    if MODEL_LOAD_FORMAT != "pkl" and os.path.isfile(os.path.join(export_dir, "manifest.json")):
+        return load_export(export_dir, mmap_mode="r"), "export"
+    return joblib.load(path), "pkl"
+
+def _load(path: str, model=None, md5: Optional[str] = None) -> LoadedModel:
     if not os.path.isfile(path):
         raise FileNotFoundError(
             f"No se encontró un modelo en '{path}'. "
             "Asegura 'etapa2/first_model.pkl' o genera uno en 'etapa2/retrain_models/'."
         )
-    return joblib.load(path)
+    artifact = "memory"
+    if model is None:
+        t0 = time.perf_counter()
+        model, artifact = load_model_file(path)
+        metrics.observe("model_load_seconds", time.perf_counter() - t0, artifact=artifact)
+        metrics.inc("model_loads_total", artifact=artifact)
+    return LoadedModel(
+        model=model,
+        path=path,
+        version=os.path.splitext(os.path.basename(path))[0],
+        md5=md5 or _model_md5(path),
+        loaded_at=datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        artifact=artifact,
+    )
+
+class ModelRegistry:
+    """
+    Mantiene residente el pipeline activo del proceso.
+    - Revisa el índice de versiones como máximo cada `refresh_seconds` (un stat de versions.json).
+    - El reemplazo es atómico: se cambia una sola referencia a un LoadedModel inmutable,
+      así que las peticiones en curso terminan con el modelo que ya tenían.
+    - `on_change` registra funciones que se llaman con el LoadedModel nuevo en cada cambio
+      (p. ej. la caché de predicciones se vacía solo entonces).
+    """
+    def __init__(self, refresh_seconds: float = MODEL_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._current: Optional[LoadedModel] = None
+        self._signature = None
+        self._last_check = 0.0
+        self._listeners: List[Callable[[LoadedModel], None]] = []
+
+    def on_change(self, fn: Callable[[LoadedModel], None]):
+        self._listeners.append(fn)
+        if self._current is not None:
+            fn(self._current)
+
+    def _set_current(self, loaded: LoadedModel, sig):
+        self._current = loaded
+        self._signature = sig
+        for fn in self._listeners:
+            fn(loaded)
+
+    def current(self) -> LoadedModel:
+        cur = self._current
+        if cur is None:
+            return self.refresh()
+        if time.monotonic() - self._last_check >= self.refresh_seconds:
+            # si otro hilo ya está revisando/cargando, se sigue con el modelo actual
+            if self._lock.acquire(blocking=False):
+                try:
+                    self._refresh_locked()
+                finally:
+                    self._lock.release()
+            return self._current
+        return cur
+
+    def refresh(self, force: bool = False) -> LoadedModel:
+        with self._lock:
+            return self._refresh_locked(force=force)
+
+    def _refresh_locked(self, force: bool = False) -> LoadedModel:
+        self._last_check = time.monotonic()
+        path = get_last_model_path()
+        sig = _signature(path)
+        if force or self._current is None or sig != self._signature:
+            self._set_current(_load(path), sig)
+        return self._current
+
+    def publish(self, path: str, model=None, md5: Optional[str] = None) -> LoadedModel:
+        """Activa una versión recién guardada sin esperar al siguiente intervalo de revisión."""
+        with self._lock:
+            self._set_current(_load(path, model=model, md5=md5), _signature(path))
+            self._last_check = time.monotonic()
+            return self._current
+
+    def info(self) -> Optional[dict]:
+        cur = self._current
+        return cur.info() if cur is not None else None
+
+registry = ModelRegistry()
+
+def get_last_model():
+    return registry.current().model
 
 if __name__ == "__main__":
     # smoke test opcional
@@ -0,0 +1,103 @@
+# etapa2/back/locks.py
+"""
+Locks entre procesos para lo que se escribe en retrain_models/ (store e índice de versiones).
+
+Varios workers de uvicorn y los procesos del pool de reentrenamiento comparten la carpeta:
+un `threading.Lock` no alcanza. `FileLock` toma un `flock` exclusivo sobre un archivo `.lock`
+además de un RLock del proceso:
+- Reentrante dentro del hilo que lo tiene (el flock se toma solo en el primer nivel).
+- El kernel lo libera si el proceso muere: no quedan locks huérfanos que expirar.
+- Los procesos hijos creados con fork arrancan con el lock libre.
+Sin `fcntl` (Windows) solo excluye entre hilos del mismo proceso.
+"""
+import os
+import time
+import threading
+from typing import Callable, Union
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# segundos máximos de espera por un lock antes de fallar (< 0 espera indefinidamente)
+FILE_LOCK_TIMEOUT = float(os.environ.get("FILE_LOCK_TIMEOUT", "600"))
+_POLL_SECONDS = 0.01
+
+class LockTimeout(TimeoutError):
+    """No se obtuvo el lock dentro del plazo."""
+
+class FileLock:
+    """
+    `path` puede ser una función: se evalúa al tomar el lock, así la ruta sigue a los
+    módulos cuyas carpetas se redirigen en ejecución (p. ej. el workspace de benchmark.py).
+    """
+    def __init__(self, path: Union[str, Callable[[], str]], timeout: float = FILE_LOCK_TIMEOUT):
+        self._path = path
+        self.timeout = timeout
+        self._reset()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        fd = getattr(self, "_fd", None)
+        if fd is not None:
+            # hijo de un fork con el lock tomado: se cierra la copia del descriptor sin LOCK_UN,
+            # que liberaría el lock del padre (el flock es de la descripción de archivo compartida)
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        self._rlock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    @property
+    def path(self) -> str:
+        return self._path() if callable(self._path) else self._path
+
+    def _flock(self, deadline: float) -> int:
+        path = self.path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return fd
+                except BlockingIOError:
+                    if deadline is not None and time.monotonic() >= deadline:
+                        raise LockTimeout(f"No se obtuvo el lock {path} en {self.timeout:.0f}s")
+                    time.sleep(_POLL_SECONDS)
+        except BaseException:
+            os.close(fd)
+            raise
+
+    def acquire(self) -> "FileLock":
+        deadline = time.monotonic() + self.timeout if self.timeout >= 0 else None
+        if not self._rlock.acquire(timeout=self.timeout if self.timeout >= 0 else -1):
+            raise LockTimeout(f"No se obtuvo el lock {self.path} en {self.timeout:.0f}s")
+        try:
+            if self._depth == 0 and fcntl is not None:
+                self._fd = self._flock(deadline)
+        except BaseException:
+            self._rlock.release()
+            raise
+        self._depth += 1
+        return self
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0 and self._fd is not None:
+            fd, self._fd = self._fd, None
+            try:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            finally:
+                os.close(fd)
+        self._rlock.release()
+
+    def __enter__(self) -> "FileLock":
+        return self.acquire()
+
+    def __exit__(self, *exc):
+        self.release()
@@ -0,0 +1,218 @@
+# etapa2/back/metrics.py
+"""
+Métricas en proceso expuestas en formato de texto Prometheus (`GET /metrics`).
+
+- `timer("predict_stage_seconds", stage="normalize")` mide un bloque; `inc` y `observe`
+  registran contadores e histogramas con etiquetas.
+- METRICS_ENABLED=0 desactiva todo: `timer` devuelve un contexto nulo compartido y
+  `inc`/`observe` retornan de inmediato.
+- Los valores que ya llevan otros componentes (caché, micro-batching, modelo activo) se
+  leen al momento del scrape mediante colectores.
+"""
+import os
+import time
+import threading
+from contextlib import nullcontext
+from typing import Callable, Dict, List, Optional, Tuple
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") == "1"
+
+# límites por defecto de los histogramas de duración (segundos)
+DURATION_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+RETRAIN_BUCKETS = [0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800]
+SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128, 256, 1024, 4096]
+
+_NULL = nullcontext()
+
+class Histogram:
+    """Conteos por cubetas con límite superior (le); la última es +Inf."""
+    def __init__(self, bounds: List[float]):
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0.0
+        self.n = 0
+
+    def observe(self, value: float):
+        i = 0
+        while i < len(self.bounds) and value > self.bounds[i]:
+            i += 1
+        self.counts[i] += 1
+        self.total += value
+        self.n += 1
+
+    def snapshot(self) -> dict:
+        labels = [str(b) for b in self.bounds] + ["+Inf"]
+        return {
+            "buckets": dict(zip(labels, self.counts)),
+            "count": self.n,
+            "sum": self.total,
+            "avg": (self.total / self.n) if self.n else None,
+        }
+
+Labels = Tuple[Tuple[str, str], ...]
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._buckets: Dict[str, List[float]] = {}
+        self._help: Dict[str, str] = {}
+        self._collectors: List[Callable[[], list]] = []
+
+    def describe(self, name: str, help_text: str, buckets: Optional[List[float]] = None):
+        self._help[name] = help_text
+        if buckets is not None:
+            self._buckets[name] = list(buckets)
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            h = series.get(key)
+            if h is None:
+                h = series[key] = Histogram(self._buckets.get(name, DURATION_BUCKETS))
+            h.observe(value)
+
+    def add_collector(self, fn: Callable[[], list]):
+        """`fn()` retorna [(nombre, tipo, ayuda, [(labels_dict, valor), ...]), ...] al momento del scrape."""
+        self._collectors.append(fn)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                _header(lines, name, "counter", self._help.get(name))
+                for key, v in series.items():
+                    lines.append(f"{name}{_fmt_labels(key)} {_fmt(v)}")
+            for name, series in sorted(self._histograms.items()):
+                _header(lines, name, "histogram", self._help.get(name))
+                for key, h in series.items():
+                    _histogram_lines(lines, name, key, h)
+        for fn in self._collectors:
+            try:
+                families = fn()
+            except Exception:
+                continue
+            for name, kind, help_text, samples in families:
+                _header(lines, name, kind, help_text)
+                for labels, v in samples:
+                    if isinstance(v, Histogram):
+                        _histogram_lines(lines, name, tuple(sorted(labels.items())), v)
+                    elif v is not None:
+                        lines.append(f"{name}{_fmt_labels(tuple(sorted(labels.items())))} {_fmt(v)}")
+        return "\n".join(lines) + "\n"
+
+def _header(lines: List[str], name: str, kind: str, help_text: Optional[str]):
+    if help_text:
+        lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {kind}")
+
+def _escape(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _fmt_labels(key: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(key) + ([extra] if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+def _fmt(v: float) -> str:
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+def _histogram_lines(lines: List[str], name: str, key: Labels, h: Histogram):
+    cumulative = 0
+    for bound, count in zip(h.bounds + ["+Inf"], h.counts):
+        cumulative += count
+        le = bound if bound == "+Inf" else _fmt(bound)
+        lines.append(f"{name}_bucket{_fmt_labels(key, ('le', le))} {cumulative}")
+    lines.append(f"{name}_sum{_fmt_labels(key)} {_fmt(h.total)}")
+    lines.append(f"{name}_count{_fmt_labels(key)} {h.n}")
+
+registry = MetricsRegistry()
+registry.describe("predict_requests_total", "Llamadas a predict() por resultado.")
+registry.describe("predict_texts_total", "Textos clasificados.")
+registry.describe("predict_stage_seconds", "Duración de cada etapa de predict().")
+registry.describe("predict_batch_size", "Textos por llamada a predict().", SIZE_BUCKETS)
+registry.describe("model_loads_total", "Modelos cargados desde disco por artefacto.")
+registry.describe("model_load_seconds", "Duración de la carga de un modelo.")
+registry.describe("retrain_jobs_total", "Reentrenamientos terminados por estrategia y estado.")
+registry.describe("retrain_duration_seconds", "Duración total de un reentrenamiento.", RETRAIN_BUCKETS)
+registry.describe("retrain_stage_seconds", "Duración de cada etapa de retrain_from_dataframe.", RETRAIN_BUCKETS)
+registry.describe("http_requests_total", "Peticiones HTTP por ruta, método y código.")
+registry.describe("http_request_seconds", "Duración de las peticiones HTTP (incluye serialización).")
+
+# ===== API de instrumentación (no-op si METRICS_ENABLED=0) =====
+class _Timer:
+    __slots__ = ("name", "labels", "t0")
+
+    def __init__(self, name: str, labels: dict):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        registry.observe(self.name, time.perf_counter() - self.t0, **self.labels)
+        return False
+
+def timer(name: str, **labels):
+    return _Timer(name, labels) if METRICS_ENABLED else _NULL
+
+def inc(name: str, value: float = 1.0, **labels):
+    if METRICS_ENABLED:
+        registry.inc(name, value, **labels)
+
+def observe(name: str, value: float, **labels):
+    if METRICS_ENABLED:
+        registry.observe(name, value, **labels)
+
+class StageClock:
+    """Duración entre avisos de etapa consecutivos (p. ej. el callback `progress` del reentrenamiento)."""
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self._current: Optional[str] = None
+        self._t0 = time.perf_counter()
+
+    def mark(self, stage: Optional[str]):
+        now = time.perf_counter()
+        if self._current is not None:
+            self.stages[self._current] = self.stages.get(self._current, 0.0) + (now - self._t0)
+        self._current, self._t0 = stage, now
+
+    def finish(self) -> Dict[str, float]:
+        self.mark(None)
+        return self.stages
+
+class PrometheusMiddleware:
+    """Middleware ASGI: cuenta y mide cada petición HTTP (la ruta es la plantilla, no el path crudo)."""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = {"code": 500}
+
+        async def send_wrapper(msg):
+            if msg["type"] == "http.response.start":
+                status["code"] = msg["status"]
+            await send(msg)
+
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            labels = {"path": path, "method": scope["method"], "status": status["code"]}
+            registry.inc("http_requests_total", **labels)
+            registry.observe("http_request_seconds", time.perf_counter() - t0, path=path, method=scope["method"])
@@ -0,0 +1,373 @@
+# etapa2/back/neardup.py
+"""
+Índice MinHash/LSH de casi-duplicados sobre `textos_norm` del store de entrenamiento.
+
+- Firma por documento: `NEAR_DUP_NUM_PERM` mínimos de sus shingles (3 palabras seguidas) bajo
+  hashes multiply-shift. La fracción de posiciones iguales entre dos firmas estima su Jaccard.
+- LSH: la firma se parte en bandas (número y ancho elegidos para el umbral); dos textos son
+  candidatos si coinciden en una banda entera. Cada banda es un array ordenado de claves, así que
+  consultar un lote cuesta un `searchsorted` por banda, no una comparación contra todo el store.
+- Persistencia: `minhash/<clave>/part-*.npz` junto a cada fragmento del store (como los conteos
+  de features.py): un reentrenamiento solo calcula las firmas del fragmento nuevo.
+- NEAR_DUP_MODE="flag" reporta en el meta del modelo los textos nuevos casi idénticos a uno del
+  store o a uno anterior del mismo lote; "drop" además los descarta antes de agregarlos; "off".
+"""
+import os
+import json
+import uuid
+import zlib
+import hashlib
+import argparse
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from . import data_store
+from .utils import NORMALIZER_VERSION
+
+NEAR_DUP_MODE = os.environ.get("NEAR_DUP_MODE", "flag")
+# similitud de Jaccard (estimada) a partir de la cual dos textos se consideran casi-duplicados
+NEAR_DUP_THRESHOLD = float(os.environ.get("NEAR_DUP_THRESHOLD", "0.9"))
+NEAR_DUP_NUM_PERM = int(os.environ.get("NEAR_DUP_NUM_PERM", "128"))
+SHINGLE_SIZE = 3
+
+_SEED = 20251011
+_EMPTY = np.uint32(0xFFFFFFFF)  # firma de un texto sin tokens (no se indexa ni se consulta)
+_MAX_CELLS = 4_000_000  # shingles x permutaciones por bloque al calcular firmas (~32 MB)
+_MAX_PAIRS = 200_000  # pares candidatos verificados por bloque
+_K = np.uint64(0x9E3779B97F4A7C15)
+# np.trapezoid existe desde NumPy 2.0; np.trapz es el nombre anterior (deprecado en 2.x)
+_trapezoid = getattr(np, "trapezoid", None) or np.trapz
+
+# ===== Firmas =====
+class MinHasher:
+    """Firmas MinHash (uint32) de textos normalizados; deterministas entre procesos."""
+    def __init__(self, num_perm: int = NEAR_DUP_NUM_PERM, shingle: int = SHINGLE_SIZE, seed: int = _SEED):
+        rng = np.random.default_rng(seed)
+        self.num_perm, self.shingle, self.seed = num_perm, shingle, seed
+        self.a = rng.integers(1, 2 ** 63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self.b = rng.integers(0, 2 ** 63, size=num_perm, dtype=np.uint64)
+        self._token_hash: Dict[str, int] = {}
+
+    def key(self) -> str:
+        params = {"num_perm": self.num_perm, "shingle": self.shingle, "seed": self.seed,
+                  "norm_version": NORMALIZER_VERSION}
+        return hashlib.md5(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+    def _hash_tokens(self, text: str) -> List[int]:
+        cache = self._token_hash
+        out = []
+        for t in text.split():
+            h = cache.get(t)
+            if h is None:
+                h = cache[t] = zlib.crc32(t.encode("utf-8"))
+            out.append(h)
+        return out
+
+    def _shingles(self, texts: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """Hash (32 bits) de cada shingle, concatenados, y cuántos tiene cada texto (1 si es más corto que un shingle)."""
+        toks = [self._hash_tokens(t) for t in texts]
+        lens = np.fromiter((len(t) for t in toks), dtype=np.int64, count=len(toks))
+        flat = np.fromiter((h for t in toks for h in t), dtype=np.uint64, count=int(lens.sum()))
+        k = self.shingle
+        n_sh = np.where(lens > 0, np.maximum(lens - k + 1, 1), 0)
+        starts = np.cumsum(lens) - lens
+        # posición de inicio de cada shingle y fin de su documento
+        first = np.repeat(starts, n_sh) + (np.arange(n_sh.sum()) - np.repeat(np.cumsum(n_sh) - n_sh, n_sh))
+        end = np.repeat(starts + lens, n_sh)
+        padded = np.concatenate([flat, np.zeros(k, dtype=np.uint64)])
+        x = np.zeros(len(first), dtype=np.uint64)
+        for j in range(k):
+            inside = (first + j) < end  # un texto corto forma un único shingle con los tokens que tiene
+            x = x * _K + np.where(inside, padded[first + j], np.uint64(0))
+        x ^= x >> np.uint64(32)
+        return x & np.uint64(0xFFFFFFFF), n_sh
+
+    def signatures(self, texts: List[str]) -> np.ndarray:
+        sh, n_sh = self._shingles([str(t) for t in texts])
+        sigs = np.full((len(n_sh), self.num_perm), _EMPTY, dtype=np.uint32)
+        offsets = np.cumsum(n_sh) - n_sh
+        docs = np.flatnonzero(n_sh)
+        i = 0
+        while i < len(docs):
+            # bloque de documentos con a lo sumo _MAX_CELLS celdas (o uno solo si es más grande)
+            budget = _MAX_CELLS // self.num_perm
+            lo = offsets[docs[i]]
+            j = i + 1
+            while j < len(docs) and offsets[docs[j]] + n_sh[docs[j]] - lo <= budget:
+                j += 1
+            block = docs[i:j]
+            hi = offsets[block[-1]] + n_sh[block[-1]]
+            V = (sh[lo:hi, None] * self.a + self.b) >> np.uint64(32)
+            sigs[block] = np.minimum.reduceat(V, offsets[block] - lo, axis=0)
+            i = j
+        return sigs
+
+def lsh_params(threshold: float, num_perm: int, fn_weight: float = 0.95) -> Tuple[int, int]:
+    """
+    (bandas, filas por banda) que minimizan la suma ponderada de falsos positivos y falsos negativos
+    para `threshold`. Los falsos positivos pesan poco: cada candidato se verifica con su firma
+    completa, mientras que un par que no llega a ser candidato se pierde.
+    """
+    best, best_err = (1, num_perm), None
+    s_lo, s_hi = np.linspace(0, threshold, 200), np.linspace(threshold, 1, 200)
+    for b in range(1, num_perm + 1):
+        r = num_perm // b
+        fp = _trapezoid(1 - (1 - s_lo ** r) ** b, s_lo)
+        fn = _trapezoid((1 - s_hi ** r) ** b, s_hi)
+        err = (1 - fn_weight) * fp + fn_weight * fn
+        if best_err is None or err < best_err:
+            best, best_err = (b, r), err
+    return best
+
+# ===== Bandas (arrays ordenados) =====
+def _band_keys(sigs: np.ndarray, bands: int, rows: int) -> np.ndarray:
+    coef = np.random.default_rng(_SEED + 1).integers(1, 2 ** 63, size=rows, dtype=np.uint64) | np.uint64(1)
+    X = sigs[:, :bands * rows].reshape(len(sigs), bands, rows).astype(np.uint64)
+    return (X * coef).sum(axis=2)  # la suma en uint64 da la vuelta: es un hash de la banda
+
+def _band_table(keys: np.ndarray, ids: np.ndarray) -> List[Tuple[np.ndarray, np.ndarray]]:
+    table = []
+    for j in range(keys.shape[1]):
+        order = np.argsort(keys[:, j], kind="stable")
+        table.append((keys[order, j], ids[order]))
+    return table
+
+def _candidates(table, qkeys: np.ndarray, n_ids: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Pares únicos (consulta, id) que comparten al menos una banda."""
+    found = []
+    for j, (keys, ids) in enumerate(table):
+        lo = np.searchsorted(keys, qkeys[:, j], side="left")
+        n = np.searchsorted(keys, qkeys[:, j], side="right") - lo
+        if not n.any():
+            continue
+        total = int(n.sum())
+        qi = np.repeat(np.arange(len(qkeys), dtype=np.int64), n)
+        pos = np.repeat(lo, n) + (np.arange(total) - np.repeat(np.cumsum(n) - n, n))
+        found.append(qi * n_ids + ids[pos])
+    if not found:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    pairs = np.unique(np.concatenate(found))
+    return pairs // n_ids, pairs % n_ids
+
+def _similarity(A: np.ndarray, B: np.ndarray, qi: np.ndarray, di: np.ndarray) -> np.ndarray:
+    out = np.empty(len(qi))
+    for s in range(0, len(qi), _MAX_PAIRS):
+        e = s + _MAX_PAIRS
+        out[s:e] = (A[qi[s:e]] == B[di[s:e]]).mean(axis=1)
+    return out
+
+def _best(qi: np.ndarray, di: np.ndarray, sim: np.ndarray, n: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Por consulta: id más parecido (-1 si ninguno) y su similitud."""
+    best_id, best_sim = np.full(n, -1, dtype=np.int64), np.zeros(n)
+    order = np.lexsort((-sim, qi))  # por consulta, la mayor similitud primero
+    qi, di, sim = qi[order], di[order], sim[order]
+    first = np.r_[True, qi[1:] != qi[:-1]] if len(qi) else np.array([], dtype=bool)
+    best_id[qi[first]], best_sim[qi[first]] = di[first], sim[first]
+    return best_id, best_sim
+
+# ===== Índice del store =====
+class NearDupIndex:
+    """
+    Firmas de todo el store (en el orden de `read_store`) y sus bandas por umbral. `sync()` carga o
+    calcula solo las firmas de fragmentos nuevos; las bandas se reconstruyen cuando cambia el store.
+    """
+    def __init__(self, hasher: Optional[MinHasher] = None):
+        self.hasher = hasher or MinHasher()
+        self._segments: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._files: Optional[tuple] = None
+        self.sigs = np.zeros((0, self.hasher.num_perm), dtype=np.uint32)
+        self.hashes = np.array([], dtype=str)
+        self._tables: Dict[float, tuple] = {}
+
+    def sidecar_dir(self) -> str:
+        return os.path.join(data_store.STORE_DIR, "minhash", self.hasher.key())
+
+    def _segment(self, key_dir: str, seg: dict) -> Tuple[Tuple[np.ndarray, np.ndarray], str]:
+        path = os.path.join(key_dir, seg["file"] + ".npz")
+        got = _load(path) if os.path.isfile(path) else None
+        if got is not None and got[0].shape[0] == int(seg["rows"]):
+            return got, "cached"
+
+        # fragmento compactado: sus filas son las de las fuentes concatenadas en orden
+        sources = [os.path.join(key_dir, f + ".npz") for f in seg.get("merged_from") or []]
+        if sources and all(os.path.isfile(p) for p in sources):
+            parts = [_load(p) for p in sources]
+            if all(p is not None for p in parts):
+                got = (np.concatenate([p[0] for p in parts]), np.concatenate([p[1] for p in parts]))
+                if got[0].shape[0] == int(seg["rows"]):
+                    _save(path, got)
+                    return got, "merged"
+
+        t = pq.read_table(seg["path"], columns=["textos_norm", "text_hash"])
+        got = (self.hasher.signatures(t.column("textos_norm").to_pylist()),
+               np.asarray(t.column("text_hash").to_pylist(), dtype=str))
+        _save(path, got)
+        return got, "computed"
+
+    def sync(self) -> dict:
+        """Alinea el índice con los fragmentos vigentes del store. Retorna cuántos se leyeron/calcularon."""
+        key_dir = self.sidecar_dir()
+        os.makedirs(key_dir, exist_ok=True)
+        summary = {"cached": 0, "merged": 0, "computed": 0, "memory": 0}
+        with data_store._lock:
+            segments = data_store.store_segments()
+            files = tuple(seg["file"] for seg in segments)
+            if files == self._files:
+                summary["memory"] = len(files)
+                return summary
+            loaded = {}
+            for seg in segments:
+                got = self._segments.get(seg["file"])
+                if got is not None and got[0].shape[0] == int(seg["rows"]):
+                    how = "memory"
+                else:
+                    got, how = self._segment(key_dir, seg)
+                loaded[seg["file"]] = got
+                summary[how] += 1
+
+            live = {f + ".npz" for f in files}
+            for name in os.listdir(key_dir):
+                if name.endswith(".npz") and name not in live:
+                    os.remove(os.path.join(key_dir, name))
+
+        self._segments = loaded
+        parts = [loaded[f] for f in files]
+        self.sigs = np.concatenate([p[0] for p in parts]) if parts else self.sigs[:0]
+        self.hashes = np.concatenate([p[1] for p in parts]) if parts else self.hashes[:0]
+        self._tables = {}
+        self._files = files
+        return summary
+
+    def table(self, threshold: float):
+        t = self._tables.get(threshold)
+        if t is None:
+            bands, rows = lsh_params(threshold, self.hasher.num_perm)
+            ids = np.flatnonzero(self.sigs[:, 0] != _EMPTY) if len(self.sigs) else np.array([], dtype=np.int64)
+            t = self._tables[threshold] = (bands, rows, _band_table(_band_keys(self.sigs[ids], bands, rows), ids))
+        return t
+
+    def query(self, sigs: np.ndarray, threshold: float) -> Tuple[np.ndarray, np.ndarray]:
+        """Fila del store más parecida a cada firma (-1 si ninguna llega a `threshold`) y su similitud."""
+        bands, rows, table = self.table(threshold)
+        live = np.flatnonzero(sigs[:, 0] != _EMPTY)
+        qi, di = _candidates(table, _band_keys(sigs[live], bands, rows), max(len(self.sigs), 1))
+        qi = live[qi]
+        sim = _similarity(sigs, self.sigs, qi, di)
+        keep = sim >= threshold
+        return _best(qi[keep], di[keep], sim[keep], len(sigs))
+
+    def self_pairs(self, sigs: np.ndarray, threshold: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Pares (i, j) con j < i dentro de `sigs` que superan `threshold`."""
+        bands, rows = lsh_params(threshold, self.hasher.num_perm)
+        live = np.flatnonzero(sigs[:, 0] != _EMPTY)
+        keys = _band_keys(sigs[live], bands, rows)
+        qi, di = _candidates(_band_table(keys, live), keys, max(len(sigs), 1))
+        qi = live[qi]
+        earlier = di < qi
+        qi, di = qi[earlier], di[earlier]
+        sim = _similarity(sigs, sigs, qi, di)
+        keep = sim >= threshold
+        return qi[keep], di[keep], sim[keep]
+
+def _save(path: str, got: Tuple[np.ndarray, np.ndarray]):
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp.npz"
+    np.savez(tmp, sigs=got[0], hashes=got[1])
+    os.replace(tmp, path)
+
+def _load(path: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    try:
+        with np.load(path, allow_pickle=False) as z:
+            return z["sigs"], z["hashes"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+index = NearDupIndex()
+
+# ===== Reentrenamiento =====
+def screen_batch(df: pd.DataFrame, mode: Optional[str] = None,
+                 threshold: Optional[float] = None) -> Tuple[pd.DataFrame, Optional[dict]]:
+    """
+    Filas de `df` (columnas del store) casi-duplicadas de una del store o de una anterior del mismo
+    lote. Con mode="drop" se quitan (se conserva la primera aparición). Retorna (df, resumen).
+    Las filas idénticas a una del store no se cuentan: ya las descarta `append_store`.
+    """
+    mode = mode or NEAR_DUP_MODE
+    threshold = NEAR_DUP_THRESHOLD if threshold is None else threshold
+    if mode == "off" or df.empty:
+        return df, None
+    if mode not in ("flag", "drop"):
+        raise ValueError(f"NEAR_DUP_MODE desconocido: {mode}")
+    if not 0.0 < threshold <= 1.0:
+        raise ValueError("NEAR_DUP_THRESHOLD debe estar en (0, 1].")
+
+    index.sync()
+    new = df[~df["text_hash"].isin(data_store.store_hashes())]
+    sigs = index.hasher.signatures(new["textos_norm"].tolist())
+    store_id, store_sim = index.query(sigs, threshold)
+    bi, bj, bsim = index.self_pairs(sigs, threshold)
+    batch_id, batch_sim = _best(bi, bj, bsim, len(new))
+
+    flagged = (store_id >= 0) | (batch_id >= 0)
+    examples = []
+    for i in np.flatnonzero(flagged)[:10]:
+        if store_id[i] >= 0 and store_sim[i] >= batch_sim[i]:
+            examples.append({"text_hash": new["text_hash"].iat[i], "match": str(index.hashes[store_id[i]]),
+                             "source": "store", "similarity": round(float(store_sim[i]), 4)})
+        else:
+            examples.append({"text_hash": new["text_hash"].iat[i], "match": new["text_hash"].iat[batch_id[i]],
+                             "source": "batch", "similarity": round(float(batch_sim[i]), 4)})
+    summary = {
+        "mode": mode, "threshold": threshold, "checked": int(len(new)),
+        "near_duplicates": int(flagged.sum()),
+        "of_store": int((store_id >= 0).sum()), "in_batch": int(((batch_id >= 0) & (store_id < 0)).sum()),
+        "dropped": int(flagged.sum()) if mode == "drop" else 0,
+        "index_rows": int(len(index.sigs)), "examples": examples,
+    }
+    if mode == "drop" and flagged.any():
+        df = df.drop(index=new.index[flagged])
+    return df, summary
+
+def sync_index(mode: Optional[str] = None):
+    """Tras agregar un fragmento al store: calcula y persiste sus firmas (no-op con NEAR_DUP_MODE=off)."""
+    if (mode or NEAR_DUP_MODE) != "off":
+        index.sync()
+
+# ===== Store completo =====
+def scan_store(threshold: float = NEAR_DUP_THRESHOLD) -> dict:
+    """Casi-duplicados ya presentes en el store: filas con una anterior parecida (se conservaría la primera)."""
+    index.sync()
+    qi, di, sim = index.self_pairs(index.sigs, threshold)
+    dup_id, dup_sim = _best(qi, di, sim, len(index.sigs))
+    rows = np.flatnonzero(dup_id >= 0)
+    return {
+        "threshold": threshold, "store_rows": int(len(index.sigs)), "pairs": int(len(qi)),
+        "near_duplicate_rows": int(len(rows)),
+        "rows": rows,
+        "examples": [{"text_hash": str(index.hashes[i]), "match": str(index.hashes[dup_id[i]]),
+                      "similarity": round(float(dup_sim[i]), 4)} for i in rows[:10]],
+    }
+
+def prune_store(threshold: float = NEAR_DUP_THRESHOLD) -> dict:
+    """Reescribe el store sin sus casi-duplicados (conserva la primera aparición de cada grupo)."""
+    with data_store._lock:
+        res = scan_store(threshold)
+        if res["near_duplicate_rows"]:
+            df = data_store.read_store()
+            data_store.write_store(df.drop(index=df.index[res["rows"]]))
+            index.sync()
+    return res
+
+def main():
+    ap = argparse.ArgumentParser(description="Índice de casi-duplicados del store de entrenamiento.")
+    ap.add_argument("cmd", choices=["scan", "prune"])
+    ap.add_argument("--threshold", type=float, default=NEAR_DUP_THRESHOLD)
+    args = ap.parse_args()
+    res = (scan_store if args.cmd == "scan" else prune_store)(args.threshold)
+    res.pop("rows")
+    print(json.dumps(res, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
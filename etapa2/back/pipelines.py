@@ -40,34 +40,49 @@ class OnlineSGDPipeline:
     def predict_proba(self, X):
         return self.clf.predict_proba(self.vec.transform(list(X)))
 
-def build_pipeline(name: PipelineName = "svc_calibrated", random_state: int = 42):
-    vectorizer = TfidfVectorizer(
-        ngram_range=(1, 2),
-        min_df=2,
-        max_features=50000,
-        lowercase=False,
-        strip_accents=None,
-    )
+# configuración base del TF-IDF; `build_pipeline(vectorizer_params=...)` sobreescribe claves
+VECTORIZER_DEFAULTS = {
+    "ngram_range": (1, 2),
+    "min_df": 2,
+    "max_features": 50000,
+    "lowercase": False,
+    "strip_accents": None,
+}
+
+def build_vectorizer(params: Optional[dict] = None) -> TfidfVectorizer:
+    return TfidfVectorizer(**{**VECTORIZER_DEFAULTS, **(params or {})})
+
+def build_classifier(name: PipelineName = "svc_calibrated", random_state: int = 42, params: Optional[dict] = None):
+    """Paso de clasificación de `name`; `params` sobreescribe hiperparámetros del estimador base."""
+    params = params or {}
 
     if name == "svc_calibrated":
-        base = LinearSVC(C=1.0, class_weight="balanced", random_state=random_state)
+        base = LinearSVC(**{"C": 1.0, "class_weight": "balanced", "random_state": random_state, **params})
         try:
-            clf = CalibratedClassifierCV(estimator=base, method="sigmoid", cv=3)
+            return CalibratedClassifierCV(estimator=base, method="sigmoid", cv=3)
         except TypeError:
-            clf = CalibratedClassifierCV(base_estimator=base, method="sigmoid", cv=3)
-        return Pipeline([("tfidf", vectorizer), ("clf", clf)])
+            return CalibratedClassifierCV(base_estimator=base, method="sigmoid", cv=3)
 
     if name == "logreg":
-        clf = LogisticRegression(
-            max_iter=1000,
-            class_weight="balanced",
-            random_state=random_state,
-            solver="lbfgs",
-            multi_class="auto",
-        )
-        return Pipeline([("tfidf", vectorizer), ("clf", clf)])
+        kwargs = {"max_iter": 1000, "class_weight": "balanced", "random_state": random_state, "solver": "lbfgs", **params}
+        try:
+            return LogisticRegression(multi_class="auto", **kwargs)
+        except TypeError:
+            # scikit-learn >= 1.8 ya no acepta multi_class (siempre es multinomial)
+            return LogisticRegression(**kwargs)
 
+    raise ValueError(f"Pipeline no soportado: {name}")
+
+def build_pipeline(
+    name: PipelineName = "svc_calibrated",
+    random_state: int = 42,
+    vectorizer_params: Optional[dict] = None,
+    clf_params: Optional[dict] = None,
+):
     if name == "sgd_online":
         return OnlineSGDPipeline(random_state=random_state)
 
-    raise ValueError(f"Pipeline no soportado: {name}")
+    return Pipeline([
+        ("tfidf", build_vectorizer(vectorizer_params)),
+        ("clf", build_classifier(name, random_state=random_state, params=clf_params)),
+    ])
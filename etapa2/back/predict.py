@@ -1,8 +1,14 @@
-from typing import List, Union
+from typing import List, Optional, Union
 import numpy as np
 
-from .last_model import get_last_model
-from .utils import limpiar_texto
+from .last_model import registry
+from .utils import get_normalizer
+from .cache import prediction_cache, text_key
+from . import metrics
+
+# la caché se vacía solo cuando el registro activa otro modelo, no por una petición en vuelo del anterior
+if prediction_cache is not None:
+    registry.on_change(lambda loaded: prediction_cache.set_model(loaded.md5))
 
 # Ajusta este diccionario a tus clases reales
 DICT_ODS = {
@@ -21,44 +27,129 @@ def _prepare_inputs(texts: Union[str, List[str]]) -> List[str]:
     if not isinstance(texts, (list, tuple)):
         raise TypeError("texts debe ser str o List[str].")
     # Limpieza por elemento (no se eliminan duplicados ni cortos)
-    return [limpiar_texto(t if t is not None else "") for t in texts]
+    return get_normalizer().transform([t if t is not None else "" for t in texts])
+
+def _label_name(lbl) -> str:
+    return DICT_ODS.get(lbl, str(lbl))
+
+def _labels_to_py(labels: np.ndarray) -> list:
+    """Etiquetas como int nativo si es posible (por si el modelo devuelve strings)."""
+    labels = np.asarray(labels)
+    if labels.dtype.kind in "iu":
+        return labels.tolist()
+    out = []
+    for lbl in labels.tolist():
+        try:
+            out.append(int(lbl))
+        except Exception:
+            out.append(lbl)
+    return out
 
-def predict(texts: Union[str, List[str]]) -> List[dict]:
+def _split_model(model):
     """
-    Retorna una lista de dicts con: label, label_name y prob (si disponible).
-    Mantiene el mismo orden y número de instancias que la entrada.
+    (vectorizar, clasificador) para medir cada etapa por separado; `vectorizar` es None si
+    el modelo no expone sus pasos (entonces todo cuenta como "classify").
     """
-    model = get_last_model()
-    X = _prepare_inputs(texts)
+    steps = getattr(model, "steps", None)
+    if steps:
+        def transform(X):
+            for _, step in steps[:-1]:
+                X = step.transform(X)
+            return X
+        return transform, steps[-1][1]
+    vec = getattr(model, "vectorizer", None) or getattr(model, "vec", None)
+    clf = getattr(model, "clf", None)
+    if vec is not None and clf is not None:
+        return (lambda X: vec.transform(list(X))), clf
+    return None, model
 
-    y = model.predict(X)
+def predict_with_model(model, X: List[str], top_k: Optional[int] = None) -> List[dict]:
+    """
+    Una sola pasada por el modelo: `predict_proba` (una transformación TF-IDF) y la
+    etiqueta como argmax sobre `classes_`. Sin `predict_proba`, solo `predict`.
+    Con `top_k`, agrega en "top" las k clases más probables (k >= n_clases -> distribución completa).
+    """
+    transform, clf = _split_model(model)
+    with metrics.timer("predict_stage_seconds", stage="vectorize"):
+        Xv = transform(X) if transform is not None else X
 
-    # Probabilidades si el modelo las expone (p. ej., CalibratedClassifierCV/LogisticRegression)
     proba = None
-    if hasattr(model, "predict_proba"):
-        try:
-            proba = model.predict_proba(X)
-        except Exception:
-            proba = None
+    classes = getattr(model, "classes_", None)
+    with metrics.timer("predict_stage_seconds", stage="classify"):
+        if classes is not None and hasattr(clf, "predict_proba"):
+            try:
+                proba = np.asarray(clf.predict_proba(Xv))
+            except Exception:
+                proba = None
+        if proba is None:
+            labels = clf.predict(Xv)
 
-    out = []
-    for i, lbl in enumerate(y):
-        try:
-            lbl_int = int(lbl)
-        except Exception:
-            lbl_int = lbl  # por si el modelo devuelve strings
-
-        item = {
-            "label": lbl_int,
-            "label_name": DICT_ODS.get(lbl_int, str(lbl)),
-        }
-        if proba is not None:
-            item["prob"] = float(np.max(proba[i]))
-        else:
-            item["prob"] = None  # si tu pipeline no expone predict_proba
-        out.append(item)
+    with metrics.timer("predict_stage_seconds", stage="postprocess"):
+        return _format(proba, classes, labels if proba is None else None, top_k)
+
+def _format(proba, classes, labels, top_k: Optional[int]) -> List[dict]:
+    if proba is None:
+        # camino rápido para pipelines sin probabilidades
+        labels = _labels_to_py(labels)
+        return [{"label": lbl, "label_name": _label_name(lbl), "prob": None} for lbl in labels]
 
+    classes = np.asarray(classes)
+    idx = proba.argmax(axis=1)
+    labels = _labels_to_py(classes[idx])
+    probs = proba[np.arange(len(idx)), idx].tolist()
+    out = [
+        {"label": lbl, "label_name": _label_name(lbl), "prob": p}
+        for lbl, p in zip(labels, probs)
+    ]
+
+    if top_k:
+        k = min(int(top_k), proba.shape[1])
+        order = np.argsort(-proba, axis=1, kind="stable")[:, :k]
+        class_labels = _labels_to_py(classes)
+        top_probs = np.take_along_axis(proba, order, axis=1).tolist()
+        for item, row, row_p in zip(out, order.tolist(), top_probs):
+            item["top"] = [
+                {"label": class_labels[j], "label_name": _label_name(class_labels[j]), "prob": p}
+                for j, p in zip(row, row_p)
+            ]
     return out
 
+def predict(texts: Union[str, List[str]], top_k: Optional[int] = None) -> List[dict]:
+    """
+    Retorna una lista de dicts con: label, label_name y prob (si disponible).
+    Mantiene el mismo orden y número de instancias que la entrada.
+    Con `top_k`, cada dict incluye "top" con las k clases más probables.
+    """
+    try:
+        with metrics.timer("predict_stage_seconds", stage="model"):
+            loaded = registry.current()
+        with metrics.timer("predict_stage_seconds", stage="normalize"):
+            X = _prepare_inputs(texts)
+        metrics.observe("predict_batch_size", len(X))
+        metrics.inc("predict_texts_total", len(X))
+        out = _predict_cached(loaded, X, top_k)
+    except Exception:
+        metrics.inc("predict_requests_total", outcome="error")
+        raise
+    metrics.inc("predict_requests_total", outcome="ok")
+    return out
+
+def _predict_cached(loaded, X: List[str], top_k: Optional[int]) -> List[dict]:
+    if prediction_cache is None:
+        return predict_with_model(loaded.model, X, top_k=top_k)
+
+    # Caché por hash del texto normalizado, ligada al md5 del modelo activo
+    with metrics.timer("predict_stage_seconds", stage="cache"):
+        keys = [text_key(x) for x in X]
+        out = prediction_cache.get_many(loaded.md5, keys, top_k)
+        miss = [i for i, v in enumerate(out) if v is None]
+    if miss:
+        fresh = predict_with_model(loaded.model, [X[i] for i in miss], top_k=top_k)
+        with metrics.timer("predict_stage_seconds", stage="cache"):
+            prediction_cache.put_many(loaded.md5, [keys[i] for i in miss], fresh, top_k)
+        for i, v in zip(miss, fresh):
+            out[i] = v
+    return [dict(v) for v in out]
+
 if __name__ == "__main__":
     print(predict("La salud en Colombia está mal"))
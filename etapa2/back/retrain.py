@@ -6,6 +6,7 @@ import joblib
 from .utils import clean_df
 from .pipelines import build_pipeline
 from .retrain_service import retrain_from_dataframe
+from .bulk import score_file, BULK_CHUNK_SIZE, OUTPUT_FORMATS
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 FIRST_MODEL_PATH = os.path.normpath(os.path.join(BASE_DIR, "..", "first_model.pkl"))
@@ -40,20 +41,36 @@ def make_first_model(df: pd.DataFrame, pipeline_name: str = "svc_calibrated", ra
     print(f"✅ first_model.pkl guardado en: {FIRST_MODEL_PATH}")
 
 def main():
-    ap = argparse.ArgumentParser(description="Generar modelo base o re-entrenar.")
+    ap = argparse.ArgumentParser(description="Generar modelo base, re-entrenar o clasificar archivos grandes.")
     ap.add_argument("--input", default=os.path.normpath(os.path.join(BASE_DIR, "..", "..", "data", "datos_originales_totales.xlsx")),
                     help="Ruta a .xlsx/.csv con columnas de texto y etiqueta.")
     ap.add_argument("--text-col", default="textos", help="Nombre de la columna de texto en el archivo de entrada.")
     ap.add_argument("--label-col", default="labels", help="Nombre de la columna de etiqueta en el archivo de entrada.")
     ap.add_argument("--pipeline", default="svc_calibrated", choices=["svc_calibrated", "logreg"])
+    ap.add_argument("--strategy", default="merge_all", choices=["merge_all", "reweight", "online", "search"],
+                    help="Solo para --retrain. 'search' prueba la grilla de search.py y publica el mejor.")
     ap.add_argument("--random-state", type=int, default=42)
     ap.add_argument("--test-size", type=float, default=0.20, help="Solo para --retrain.")
     ap.add_argument("--make-first-model", action="store_true", help="Entrena y guarda etapa2/first_model.pkl")
     ap.add_argument("--retrain", action="store_true", help="Re-entrena y guarda en retrain_models/")
+    ap.add_argument("--score", metavar="OUTPUT",
+                    help="Clasifica --input (.parquet/.csv/.xlsx) por bloques y escribe OUTPUT (.ndjson/.csv/.parquet).")
+    ap.add_argument("--format", choices=OUTPUT_FORMATS, help="Formato de salida de --score (por defecto, según la extensión).")
+    ap.add_argument("--chunk-size", type=int, default=BULK_CHUNK_SIZE, help="Filas por bloque para --score.")
+    ap.add_argument("--n-jobs", type=int, default=None, help="Procesos para normalizar en --score (por defecto CLEAN_N_JOBS).")
     args = ap.parse_args()
 
-    if not (args.make_first_model or args.retrain):
-        ap.error("Debe indicar --make-first-model o --retrain")
+    if not (args.make_first_model or args.retrain or args.score):
+        ap.error("Debe indicar --make-first-model, --retrain o --score")
+
+    if args.score:
+        # streaming: no se carga el archivo completo
+        stats = score_file(args.input, args.score, text_col=args.text_col, chunk_size=args.chunk_size,
+                           out_fmt=args.format, n_jobs=args.n_jobs)
+        print(f"✅ {stats['rows']} filas clasificadas en {stats['seconds']:.1f}s "
+              f"({stats['rows_per_s']:.0f} filas/s) -> {stats['output']}")
+        if not (args.make_first_model or args.retrain):
+            return
 
     df_raw = load_table(args.input)
     df_std = standardize_columns(df_raw, args.text_col, args.label_col)
@@ -64,6 +81,7 @@ def main():
     if args.retrain:
         metrics, paths = retrain_from_dataframe(
             df_std,
+            strategy=args.strategy,
             test_size=args.test_size,
             random_state=args.random_state,
             pipeline_name=args.pipeline,
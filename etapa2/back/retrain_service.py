@@ -1,150 +1,374 @@
 # etapa2/back/retrain_service.py
-import os, json, time, hashlib
-from typing import Dict, Any, Tuple, List, Optional, Literal
+import os, json, uuid, hashlib
+from typing import Dict, Any, Tuple, List, Optional, Literal, Callable
 import joblib, pandas as pd, numpy as np
-from sklearn.model_selection import train_test_split, StratifiedKFold
+from functools import partial
+from sklearn.model_selection import train_test_split
 from sklearn.metrics import precision_recall_fscore_support
+from sklearn.base import clone
+from sklearn.pipeline import Pipeline
+from sklearn.feature_extraction.text import TfidfVectorizer
 from .pipelines import build_pipeline
-from .utils import clean_df
-from .data_store import read_store, write_store
+from .data_store import read_store, append_store, prepare_records, store_size, load_eval_set
+from .last_model import registry
+from .utils import get_normalizer
+from .artifacts import export_model, export_path_for, load_stem_table
+from .features import FEATURE_CACHE, store_counts, count_documents, merge_counts, fit_pipeline_from_counts
+from .neardup import screen_batch, sync_index
+from .evaluation import cross_validate
+from .explain import ExplainIndex, NotExplainable
+from . import versions
+from .versions import RETRAIN_DIR
 
-Strategy = Literal["merge_all", "reweight", "online"]
+Strategy = Literal["merge_all", "reweight", "online", "search"]
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-RETRAIN_DIR = os.path.normpath(os.path.join(BASE_DIR, "..", "retrain_models"))
 TEST_PATH = os.path.normpath(os.path.join(BASE_DIR, "..", "..", "data", "Datos de prueba_proyecto.xlsx"))
 os.makedirs(RETRAIN_DIR, exist_ok=True)
 
+# columnas del store que necesita el entrenamiento (proyección al leer)
+TRAIN_COLUMNS = ["textos_norm", "labels"]
+
+# estrategia online: pasadas y tamaño de mini-lote del partial_fit (0 = el lote completo)
+ONLINE_EPOCHS = int(os.environ.get("ONLINE_EPOCHS", "1"))
+ONLINE_BATCH_SIZE = int(os.environ.get("ONLINE_BATCH_SIZE", "0"))
+
 def _load_test() -> Optional[pd.DataFrame]:
-    if os.path.isfile(TEST_PATH):
-        df = pd.read_excel(TEST_PATH)
-        if {"textos", "labels"}.issubset(df.columns):
-            return df[["textos", "labels"]].dropna().copy()
-    return None
-
-def _save_model_with_metadata(model, metrics: Dict[str, float], extra_meta: Optional[Dict[str, Any]] = None) -> Dict[str, str]:
-    ts = time.strftime("%Y%m%d_%H%M%S")
-    model_path = os.path.join(RETRAIN_DIR, f"model_{ts}.pkl")
-    meta_path  = os.path.join(RETRAIN_DIR, f"model_{ts}.meta.json")
-    joblib.dump(model, model_path)
-    h = hashlib.md5()
-    with open(model_path, "rb") as f:
-        for chunk in iter(lambda: f.read(1 << 20), b""):
-            h.update(chunk)
-    meta = {"created_at": ts, "model_path": model_path, "metrics": metrics, "md5": h.hexdigest()}
+    """Test fijo con `textos_norm` (cacheado en parquet; se normaliza igual que el entrenamiento)."""
+    return load_eval_set(TEST_PATH)
+
+def _stem_table() -> Optional[dict]:
+    """Tabla del normalizador a persistir: la de la versión activa + lo normalizado en este proceso."""
+    norm = get_normalizer()
+    if norm.engine != "fast":
+        return None
+    active = versions.active_version()
+    if active and active.get("export"):
+        norm.load_stem_table(load_stem_table(os.path.join(RETRAIN_DIR, active["export"])))
+    return norm.stem_table()
+
+def _explain_index(model, parent: Optional[str], train_texts=None):
+    """Índice de /explain; los modelos con hashing heredan del padre los nombres de sus columnas."""
+    entry = versions.load_index()["versions"].get(parent) if parent else None
+    parent_dir = os.path.join(RETRAIN_DIR, entry["export"]) if entry and entry.get("export") else None
+    try:
+        return ExplainIndex.from_model(model, texts=train_texts, parent_dir=parent_dir)
+    except NotExplainable:
+        return None
+
+def _save_model_with_metadata(model, metrics: Dict[str, float], extra_meta: Optional[Dict[str, Any]] = None,
+                              train_texts=None) -> Dict[str, str]:
+    """
+    Publica el modelo: .pkl, exportación y .meta.json se escriben a temporales y se renombran
+    (os.replace); recién entonces se registra la versión en el índice. Un lector nunca ve un
+    artefacto a medio escribir y el id único evita que dos reentrenamientos se pisen.
+    `train_texts` (sgd_online): textos entrenados en esta publicación, para nombrar las columnas
+    del índice de /explain.
+    """
+    version, created_at = versions.new_version_id()
+    # el padre se resuelve antes de que exista el .pkl nuevo: si el índice aún no existe, el
+    # bootstrap lo arma con los .pkl en disco y no debe encontrar (y activar) esta misma versión
+    active = versions.active_version()
+    parent = active["id"] if active and active["id"] != version else None
+    model_path = os.path.join(RETRAIN_DIR, f"{version}.pkl")
+    meta_path  = os.path.join(RETRAIN_DIR, f"{version}.meta.json")
+    tmp = f"{model_path}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            joblib.dump(model, f)
+            f.flush()
+            os.fsync(f.fileno())
+        h = hashlib.md5()
+        with open(tmp, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        os.replace(tmp, model_path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    # rutas relativas a retrain_models/ (el índice y los metas deben sobrevivir a mover la carpeta)
+    meta = {"created_at": created_at, "model_path": os.path.basename(model_path), "metrics": metrics, "md5": h.hexdigest(),
+            "parent": parent}
     if extra_meta: meta.update(extra_meta)
-    with open(meta_path, "w", encoding="utf-8") as f: json.dump(meta, f, ensure_ascii=False, indent=2)
+    # exportación mmap (carga rápida y memoria compartida entre workers); el .pkl sigue siendo la referencia
+    try:
+        meta["export_path"] = os.path.basename(export_model(
+            model, export_path_for(model_path), stem_table=_stem_table(),
+            explain_index=_explain_index(model, meta.get("parent"), train_texts),
+        ))
+    except Exception as e:
+        print(f"⚠️ No se pudo exportar el modelo en formato mmap: {e}")
+    tmp = f"{meta_path}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, meta_path)
+    versions.register(model_path, meta)
+    # el proceso que entrena activa la versión nueva de inmediato (los demás la ven por el índice)
+    registry.publish(model_path, model=model, md5=meta["md5"])
     return {"model_path": model_path, "meta_path": meta_path}
 
+def online_update(pipe, X, y, epochs: int = ONLINE_EPOCHS, batch_size: int = ONLINE_BATCH_SIZE,
+                  random_state: int = 42) -> int:
+    """`partial_fit` sobre (X, y) en `epochs` pasadas y mini-lotes de `batch_size`. Retorna cuántas llamadas hizo."""
+    n = len(y)
+    size = batch_size if batch_size and batch_size > 0 else n
+    rng = np.random.default_rng(random_state)
+    calls = 0
+    for epoch in range(max(1, epochs)):
+        order = rng.permutation(n) if epoch > 0 or size < n else np.arange(n)
+        for i in range(0, n, size):
+            idx = order[i:i + size]
+            pipe.partial_fit(X[idx], y[idx])
+            calls += 1
+    return calls
+
 def _evaluate(pipe, Xte, yte) -> Dict[str, float]:
     yhat = pipe.predict(Xte)
     p, r, f1, _ = precision_recall_fscore_support(yte, yhat, average="macro", zero_division=0)
     return {"precision": float(p), "recall": float(r), "f1": float(f1)}
 
+def _read_store_features(pipe, report):
+    """
+    Store de entrenamiento y, si el pipeline es TF-IDF (y FEATURE_CACHE=1), sus conteos de n-gramas
+    por fragmento (features.py): solo se tokenizan los fragmentos nuevos. Retorna (df, conteos, resumen).
+    """
+    vec = pipe.steps[0][1] if isinstance(pipe, Pipeline) else None
+    if FEATURE_CACHE and isinstance(vec, TfidfVectorizer):
+        report("contando_ngramas")
+        res = store_counts(vec)
+        if res is not None:
+            return res
+    return read_store(columns=TRAIN_COLUMNS), None, None
+
+def _cross_validate(make_pipe, y, report, metrics: Dict[str, float], **kwargs) -> Optional[Dict[str, Any]]:
+    """k-fold del candidato (evaluation.py); agrega `cv_f1` / `cv_f1_std` a `metrics`."""
+    report("validacion_cruzada")
+    cv = cross_validate(make_pipe, y, **kwargs)
+    if cv and "mean" in cv:
+        metrics["cv_f1"], metrics["cv_f1_std"] = cv["mean"]["f1"], cv["std"]["f1"]
+    return cv
+
+def _fit(pipe, X, y, counts, rows):
+    """Ajuste completo o, con conteos, TF-IDF desde los conteos de `rows` (misma matriz) + clasificador."""
+    if counts is None:
+        return pipe.fit(X, y)
+    terms, C = counts
+    return fit_pipeline_from_counts(pipe, (terms, C[rows]), y)
+
 def retrain_from_dataframe(
     df_new: pd.DataFrame,
     strategy: Strategy = "merge_all",
     random_state: int = 42,
     pipeline_name: str = "svc_calibrated",
     test_size: float = 0.20,
+    progress: Optional[Callable[[str], None]] = None,
+    search_candidates: Optional[List[Dict[str, Any]]] = None,
+    epochs: int = ONLINE_EPOCHS,
+    batch_size: int = ONLINE_BATCH_SIZE,
 ) -> Tuple[Dict[str, float], Dict[str, str]]:
+    """
+    `progress` (opcional) recibe el nombre de cada etapa; lo usa la cola de trabajos.
+    `search_candidates` (solo strategy="search") reemplaza la grilla por defecto de search.py.
+    `epochs` / `batch_size` (solo strategy="online") controlan el partial_fit del lote nuevo.
+    """
+    report = progress or (lambda stage: None)
 
     required = {"textos", "labels"}
     if not required.issubset(df_new.columns):
         raise ValueError("retrain_from_dataframe espera columnas ['textos','labels'].")
 
-    # Limpieza (no filtramos por longitud en reentrenamiento)
-    df_new = clean_df(df_new.dropna(subset=["textos", "labels"]).copy(), use_nltk=True, use_short_text=True)
+    report("normalizando")
+    # Normalización solo del lote nuevo (no filtramos por longitud en reentrenamiento)
+    df_new = prepare_records(df_new).drop_duplicates(subset=["text_hash"])
     if df_new.empty:
         raise ValueError("No hay datos nuevos válidos para reentrenar.")
 
-    # Dataset canónico acumulado
-    df_store = read_store()
-    df_store = clean_df(df_store.dropna(subset=["textos","labels"]).copy(), use_nltk=True, use_short_text=True)
+    # Casi-duplicados (MinHash/LSH) contra el store y dentro del lote: se reportan o descartan
+    report("casi_duplicados")
+    df_new, near_dups = screen_batch(df_new)
+    if df_new.empty:
+        raise ValueError("Todos los textos nuevos son casi-duplicados de textos del store.")
 
     # Test fijo si existe; si no, se hará split estratificado
+    report("cargando_test")
     df_test_fixed = _load_test()
-    X_fixed, y_fixed = (df_test_fixed["textos"], df_test_fixed["labels"]) if df_test_fixed is not None else (None, None)
+    X_fixed, y_fixed = (
+        (df_test_fixed["textos_norm"].to_numpy(), df_test_fixed["labels"].to_numpy())
+        if df_test_fixed is not None else (None, None)
+    )
 
-    extra_meta = {"strategy": strategy, "pipeline": pipeline_name, "n_new": int(len(df_new))}
+    extra_meta = {"strategy": strategy, "pipeline": pipeline_name, "n_new": int(len(df_new)),
+                  "near_duplicates": near_dups}
 
     # ---- Estrategias ----
     if strategy == "merge_all":
-        df_all = pd.concat([df_store, df_new], ignore_index=True).drop_duplicates(subset=["textos"])
-        write_store(df_all)  # persistimos el “conocimiento”
-        X = df_all["textos"].values
-        y = df_all["labels"].astype(int).values
-        Xtr, Xte, ytr, yte = train_test_split(X, y, test_size=test_size, random_state=random_state,
-                                             stratify=y if (pd.Series(y).value_counts()>=2).all() else None)
+        report("actualizando_store")
+        append_store(df_new)  # persistimos el “conocimiento” (solo filas nuevas, O(lote))
+        sync_index()  # firmas MinHash solo del fragmento nuevo
         pipe = build_pipeline(name=pipeline_name, random_state=random_state)
-        pipe.fit(Xtr, ytr)
+        df_all, counts, feature_cache = _read_store_features(pipe, report)
+        X = df_all["textos_norm"].to_numpy()
+        y = df_all["labels"].astype(int).values
+        # se parten índices (mismo split que partir X) para tomar las mismas filas de los conteos
+        itr, ite = train_test_split(np.arange(len(y)), test_size=test_size, random_state=random_state,
+                                    stratify=y if (pd.Series(y).value_counts()>=2).all() else None)
+        Xtr, Xte, ytr, yte = X[itr], X[ite], y[itr], y[ite]
+        report("entrenando")
+        _fit(pipe, Xtr, ytr, counts, itr)
+        report("evaluando")
         metrics = _evaluate(pipe, X_fixed if X_fixed is not None else Xte,
                                   y_fixed if y_fixed is not None else yte)
-        paths = _save_model_with_metadata(pipe, metrics, extra_meta | {"n_total": int(len(df_all))})
+        cv = _cross_validate(partial(build_pipeline, name=pipeline_name, random_state=random_state), y, report,
+                             metrics, X=X, counts=counts, random_state=random_state)
+        report("guardando")
+        paths = _save_model_with_metadata(
+            pipe, metrics, extra_meta | {"n_total": int(len(df_all)), "feature_cache": feature_cache, "cv": cv}
+        )
         return metrics, paths
 
     if strategy == "reweight":
-        # 1) Unión histórica + nuevo (dedup) y persistir store limpio
-        df_all = pd.concat([df_store, df_new], ignore_index=True).drop_duplicates(subset=["textos"])
-        write_store(df_all)
+        # 1) Unión histórica + nuevo (dedup por hash al agregar al store)
+        report("actualizando_store")
+        append_store(df_new)
+        sync_index()
+        pipe = build_pipeline(name=pipeline_name, random_state=random_state)
+        df_all, counts, feature_cache = _read_store_features(pipe, report)
 
         # 2) Crear dataset de entrenamiento con oversampling de lo nuevo (p.ej., k=2)
         k = 2
         df_train = pd.concat([df_all, *([df_new] * (k-1))], ignore_index=True)
+        if counts is not None:
+            counts_new = count_documents(pipe.steps[0][1], df_new["textos_norm"])
+            counts = merge_counts([counts, *([counts_new] * (k-1))])
 
         # 3) Split y entrenamiento
-        X = df_train["textos"].values
+        X = df_train["textos_norm"].to_numpy()
         y = df_train["labels"].astype(int).values
-        Xtr, Xte, ytr, yte = train_test_split(
-            X, y, test_size=test_size, random_state=random_state,
+        itr, ite = train_test_split(
+            np.arange(len(y)), test_size=test_size, random_state=random_state,
             stratify=y if (pd.Series(y).value_counts() >= 2).all() else None
         )
+        Xtr, Xte, ytr, yte = X[itr], X[ite], y[itr], y[ite]
 
-        pipe = build_pipeline(name=pipeline_name, random_state=random_state)
-        pipe.fit(Xtr, ytr)  # sin sample_weight (CalibratedSVC suele ignorarlo)
+        report("entrenando")
+        _fit(pipe, Xtr, ytr, counts, itr)  # sin sample_weight (CalibratedSVC suele ignorarlo)
 
         # 4) Evaluación (test fijo si existe)
+        report("evaluando")
         metrics = _evaluate(pipe, X_fixed if X_fixed is not None else Xte,
                                 y_fixed if y_fixed is not None else yte)
 
+        # 5) k-fold: cada copia del oversampling queda en el fold de su original
+        pos = {t: i for i, t in enumerate(df_all["textos_norm"])}
+        groups = np.r_[np.arange(len(df_all)), np.tile([pos[t] for t in df_new["textos_norm"]], k - 1)]
+        cv = _cross_validate(partial(build_pipeline, name=pipeline_name, random_state=random_state), y, report,
+                             metrics, X=X, counts=counts, groups=groups, random_state=random_state)
+
+        report("guardando")
         paths = _save_model_with_metadata(
             pipe, metrics,
-            extra_meta | {"n_total": int(len(df_all)), "oversample_k": k}
+            extra_meta | {"n_total": int(len(df_all)), "oversample_k": k, "feature_cache": feature_cache, "cv": cv}
         )
         return metrics, paths
 
 
     if strategy == "online":
-        # 1) Inicializa con el store para fijar las clases
-        X0 = df_store["textos"].astype(str).values
-        y0 = df_store["labels"].astype(int).values
-
-        pipe = build_pipeline(name="sgd_online", random_state=random_state)
-        pipe.fit(X0, y0)
-
-        # 2) Actualiza con el lote nuevo
-        Xn = df_new["textos"].astype(str).values
+        # Reanuda desde el último sgd_online publicado: solo partial_fit del lote nuevo (O(lote)).
+        # Sin padre (o con etiquetas que el padre no conoce) se reconstruye desde el store.
+        report("actualizando_store")
+        append_store(df_new)
+        sync_index()
+        Xn = df_new["textos_norm"].astype(str).to_numpy()
         yn = df_new["labels"].astype(int).values
-        pipe.partial_fit(Xn, yn)
 
-        # 3) Evalúa
-        if df_test_fixed is not None:
-            Xt = df_test_fixed["textos"].astype(str).values
-            yt = df_test_fixed["labels"].astype(int).values
-            metrics = _evaluate(pipe, Xt, yt)
+        report("entrenando")
+        parent = versions.latest(pipeline="sgd_online")
+        pipe = joblib.load(os.path.join(RETRAIN_DIR, parent["file"])) if parent else None
+        if pipe is not None and set(np.unique(yn)) <= set(np.asarray(pipe.classes_).tolist()):
+            n_calls = online_update(pipe, Xn, yn, epochs=epochs, batch_size=batch_size, random_state=random_state)
+            online = {"mode": "incremental", "epochs": epochs, "batch_size": batch_size, "partial_fit_calls": n_calls}
+            n_total = store_size()
+            X0 = y0 = None
+        else:
+            df_store = read_store(columns=TRAIN_COLUMNS)
+            X0 = df_store["textos_norm"].astype(str).to_numpy()
+            y0 = df_store["labels"].astype(int).values
+            pipe = build_pipeline(name="sgd_online", random_state=random_state)
+            pipe.fit(X0, y0)  # el store ya incluye el lote nuevo
+            online = {"mode": "rebuild", "reason": "sin modelo padre" if parent is None else "clases nuevas"}
+            parent = None
+            n_total = len(df_store)
+
+        # Evalúa
+        report("evaluando")
+        if X_fixed is not None:
+            metrics = _evaluate(pipe, X_fixed, y_fixed)
         else:
             # fallback: holdout sobre store
+            if X0 is None:
+                df_store = read_store(columns=TRAIN_COLUMNS)
+                X0 = df_store["textos_norm"].astype(str).to_numpy()
+                y0 = df_store["labels"].astype(int).values
             Xtr, Xte, ytr, yte = train_test_split(
                 X0, y0, test_size=test_size, random_state=random_state,
                 stratify=y0 if (pd.Series(y0).value_counts() >= 2).all() else None
             )
             metrics = _evaluate(pipe, Xte, yte)
 
+        # k-fold del pipeline reconstruido; la actualización incremental no se re-valida desde cero
+        if online["mode"] == "rebuild":
+            cv = _cross_validate(partial(build_pipeline, name="sgd_online", random_state=random_state), y0, report,
+                                 metrics, X=X0, random_state=random_state)
+        else:
+            cv = {"skipped": "actualización incremental (partial_fit del lote)"}
+
+        report("guardando")
+        lineage = {"parent": None}
+        if parent:
+            lineage = {"parent": parent["id"], "parent_md5": parent.get("md5")}
         paths = _save_model_with_metadata(
-            pipe, metrics, extra_meta | {"n_total": int(len(df_store))}
+            pipe, metrics,
+            extra_meta | {"pipeline": "sgd_online", "n_total": int(n_total), "online": online, "cv": cv} | lineage,
+            train_texts=Xn if online["mode"] == "incremental" else X0,
+        )
+        return metrics, paths
+
+    if strategy == "search":
+        from .search import run_search
+
+        report("actualizando_store")
+        append_store(df_new)
+        sync_index()
+        df_all = read_store(columns=TRAIN_COLUMNS)
+        X = df_all["textos_norm"].to_numpy()
+        y = df_all["labels"].astype(int).values
+        Xtr, Xte, ytr, yte = train_test_split(X, y, test_size=test_size, random_state=random_state,
+                                             stratify=y if (pd.Series(y).value_counts()>=2).all() else None)
+        if X_fixed is not None:
+            Xte, yte = X_fixed, y_fixed
+
+        report("entrenando")
+        pipe, summary = run_search(Xtr, ytr, Xte, yte, candidates=search_candidates,
+                                   random_state=random_state, progress=report)
+        winner = summary["leaderboard"][0]
+        metrics = dict(winner["metrics"])
+
+        # k-fold del ganador: conteos del store con su configuración de TF-IDF (se cachean por análisis)
+        df_cv, counts, _ = _read_store_features(clone(pipe), report)
+        cv = _cross_validate(partial(clone, pipe), df_cv["labels"].astype(int).values, report, metrics,
+                             X=df_cv["textos_norm"].to_numpy(), counts=counts, random_state=random_state)
+
+        report("guardando")
+        paths = _save_model_with_metadata(
+            pipe, metrics,
+            extra_meta | {"pipeline": winner["pipeline"], "n_total": int(len(df_all)), "search": summary, "cv": cv}
         )
         return metrics, paths
 
+    raise ValueError(f"Estrategia no soportada: {strategy}")
 
 def retrain_from_records(records: List[Dict[str, Any]], **kwargs):
     df = pd.DataFrame(records)
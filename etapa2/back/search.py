@@ -0,0 +1,156 @@
+# etapa2/back/search.py
+"""
+Búsqueda de hiperparámetros/pipelines para la estrategia de reentrenamiento "search".
+
+- Cada candidato es una variante de `build_pipeline` (configuración del TF-IDF + clasificador).
+- El ajuste del TF-IDF se cachea con joblib.Memory por configuración del vectorizador:
+  las variantes del clasificador reutilizan la matriz ya vectorizada.
+- Los candidatos se evalúan en un pool de procesos por tandas; si el mejor f1 no mejora en
+  `patience` tandas seguidas, la búsqueda se detiene (early stopping sobre el test fijo).
+"""
+import os
+import time
+import random
+import itertools
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from joblib import Memory, Parallel, delayed, effective_n_jobs
+from sklearn.pipeline import Pipeline
+from sklearn.metrics import precision_recall_fscore_support
+
+from .pipelines import build_vectorizer, build_classifier
+from .versions import RETRAIN_DIR
+
+SEARCH_CACHE_DIR = os.environ.get("SEARCH_CACHE_DIR", os.path.join(RETRAIN_DIR, "search_cache"))
+SEARCH_CACHE_MAX_MB = int(os.environ.get("SEARCH_CACHE_MAX_MB", "512"))
+SEARCH_N_JOBS = int(os.environ.get("SEARCH_N_JOBS", "-1"))
+SEARCH_PATIENCE = int(os.environ.get("SEARCH_PATIENCE", "3"))
+SEARCH_MIN_DELTA = float(os.environ.get("SEARCH_MIN_DELTA", "0.001"))
+
+# grilla por defecto: configuraciones del TF-IDF x variantes del clasificador
+SEARCH_VECTORIZERS: List[Dict[str, Any]] = [
+    {},  # VECTORIZER_DEFAULTS: (1,2)-gramas, max_features=50000
+    {"ngram_range": (1, 1), "max_features": 30000},
+    {"ngram_range": (1, 2), "max_features": 100000, "sublinear_tf": True},
+]
+SEARCH_CLASSIFIERS: List[Tuple[str, Dict[str, Any]]] = [
+    ("svc_calibrated", {"C": 0.5}),
+    ("svc_calibrated", {"C": 1.0}),
+    ("svc_calibrated", {"C": 2.0}),
+    ("logreg", {"C": 1.0}),
+    ("logreg", {"C": 4.0}),
+]
+
+def build_candidates(
+    vectorizers: Optional[List[dict]] = None,
+    classifiers: Optional[List[Tuple[str, dict]]] = None,
+    n_iter: Optional[int] = None,
+    random_state: int = 42,
+) -> List[Dict[str, Any]]:
+    """Producto cartesiano de la grilla; con `n_iter`, una muestra aleatoria de ese tamaño."""
+    grid = [
+        {"pipeline": name, "vectorizer": dict(v), "classifier": dict(c)}
+        for v, (name, c) in itertools.product(vectorizers or SEARCH_VECTORIZERS, classifiers or SEARCH_CLASSIFIERS)
+    ]
+    if n_iter is not None and n_iter < len(grid):
+        grid = random.Random(random_state).sample(grid, n_iter)
+    return grid
+
+def _fit_vectorizer(vectorizer_params: dict, X_train: np.ndarray):
+    vec = build_vectorizer(vectorizer_params)
+    Xv = vec.fit_transform(X_train)
+    return vec, Xv
+
+def _cached_vectorizer(memory: Memory):
+    return memory.cache(_fit_vectorizer)
+
+def _evaluate_candidate(cand: dict, X_train, y_train, X_eval, y_eval, random_state: int, cache_dir: str) -> dict:
+    """Ajusta un candidato (TF-IDF desde la caché) y lo evalúa; corre dentro de un worker."""
+    t0 = time.perf_counter()
+    vec, Xv = _cached_vectorizer(Memory(cache_dir, verbose=0))(cand["vectorizer"], X_train)
+    clf = build_classifier(cand["pipeline"], random_state=random_state, params=cand["classifier"])
+    clf.fit(Xv, y_train)
+    yhat = clf.predict(vec.transform(X_eval))
+    p, r, f1, _ = precision_recall_fscore_support(y_eval, yhat, average="macro", zero_division=0)
+    return {
+        **cand,
+        "metrics": {"precision": float(p), "recall": float(r), "f1": float(f1)},
+        "fit_seconds": time.perf_counter() - t0,
+        "model": Pipeline([("tfidf", vec), ("clf", clf)]),
+    }
+
+def _json_params(params: dict) -> dict:
+    return {k: (list(v) if isinstance(v, tuple) else v) for k, v in params.items()}
+
+def run_search(
+    X_train: np.ndarray,
+    y_train: np.ndarray,
+    X_eval: np.ndarray,
+    y_eval: np.ndarray,
+    candidates: Optional[List[Dict[str, Any]]] = None,
+    random_state: int = 42,
+    n_jobs: int = SEARCH_N_JOBS,
+    patience: int = SEARCH_PATIENCE,
+    min_delta: float = SEARCH_MIN_DELTA,
+    cache_dir: str = SEARCH_CACHE_DIR,
+    progress=None,
+) -> Tuple[Pipeline, dict]:
+    """
+    Retorna (pipeline ganador, resumen). El resumen trae el leaderboard completo de los
+    candidatos evaluados (ordenado por f1 macro) y si hubo early stopping.
+    """
+    report = progress or (lambda stage: None)
+    candidates = list(candidates or build_candidates(random_state=random_state))
+    memory = Memory(cache_dir, verbose=0)
+    fit_vec = _cached_vectorizer(memory)
+
+    with Parallel(n_jobs=n_jobs) as parallel:
+        # 1) un ajuste de TF-IDF por configuración: llena la caché antes de repartir clasificadores
+        report("vectorizando")
+        vec_configs = {repr(sorted(c["vectorizer"].items())): c["vectorizer"] for c in candidates}
+        parallel(delayed(fit_vec)(v, X_train) for v in vec_configs.values())
+
+        # 2) candidatos por tandas del tamaño del pool, con early stopping entre tandas
+        wave = max(1, effective_n_jobs(n_jobs))
+        best_model, best_f1, results, stale, stopped_early = None, -np.inf, [], 0, False
+        for i in range(0, len(candidates), wave):
+            report(f"buscando {i}/{len(candidates)}")
+            batch = parallel(
+                delayed(_evaluate_candidate)(c, X_train, y_train, X_eval, y_eval, random_state, cache_dir)
+                for c in candidates[i:i + wave]
+            )
+            prev_f1 = best_f1
+            for res in batch:
+                model = res.pop("model")
+                results.append(res)
+                if res["metrics"]["f1"] > best_f1:
+                    best_model, best_f1 = model, res["metrics"]["f1"]
+            stale = 0 if best_f1 > prev_f1 + min_delta else stale + 1
+            if stale >= patience and i + wave < len(candidates):
+                stopped_early = True
+                break
+
+    try:
+        memory.reduce_size(bytes_limit=SEARCH_CACHE_MAX_MB * 1024 * 1024)
+    except TypeError:  # joblib < 1.4
+        pass
+
+    leaderboard = sorted(results, key=lambda r: r["metrics"]["f1"], reverse=True)
+    summary = {
+        "n_candidates": len(candidates),
+        "n_evaluated": len(results),
+        "stopped_early": stopped_early,
+        "leaderboard": [
+            {
+                "rank": i + 1,
+                "pipeline": r["pipeline"],
+                "vectorizer": _json_params(r["vectorizer"]),
+                "classifier": _json_params(r["classifier"]),
+                "metrics": r["metrics"],
+                "fit_seconds": r["fit_seconds"],
+            }
+            for i, r in enumerate(leaderboard)
+        ],
+    }
+    return best_model, summary
@@ -0,0 +1,22 @@
+# etapa2/back/tests/conftest.py
+"""
+Recursos NLTK mínimos y locales para las pruebas: sin descargas y con el mismo camino en cualquier
+máquina. Con `tokenizers/punkt*` presentes `_ensure_nltk` no descarga nada y `word_tokenize`
+(preserve_line=True) no los lee; las stopwords son una lista corta real; `wordnet` vacío hace que el
+lematizador quede desactivado igual en `limpiar_texto` y en `TextNormalizer`.
+"""
+import pytest
+
+STOPWORDS_ES = ["de", "la", "que", "el", "en", "y", "a", "los", "del", "se", "las", "por", "un",
+                "para", "con", "no", "una", "su", "al", "lo", "como", "más", "pero", "sus", "le", "es"]
+
+@pytest.fixture(scope="session", autouse=True)
+def nltk_data(tmp_path_factory):
+    import nltk
+    root = tmp_path_factory.mktemp("nltk_data")
+    for sub in ("tokenizers/punkt", "tokenizers/punkt_tab", "corpora/stopwords", "corpora/wordnet"):
+        (root / sub).mkdir(parents=True)
+    (root / "corpora" / "stopwords" / "spanish").write_text("\n".join(STOPWORDS_ES) + "\n", encoding="utf-8")
+    nltk.data.path.insert(0, str(root))
+    yield root
+    nltk.data.path.remove(str(root))
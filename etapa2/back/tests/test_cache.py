@@ -0,0 +1,19 @@
+# etapa2/back/tests/test_cache.py
+"""Caché de predicciones durante un cambio de modelo: solo el registro la vacía."""
+from etapa2.back.cache import PredictionCache
+
+def test_stale_model_requests_do_not_clear_the_cache():
+    cache = PredictionCache(max_entries=100, ttl_seconds=60, max_bytes=1 << 20)
+    cache.set_model("old")
+    cache.put_many("old", [b"a"], [{"label": 1}])
+    cache.set_model("new")  # el registro activó otro modelo
+    assert cache.stats()["invalidations"] == 1
+    cache.put_many("new", [b"a"], [{"label": 4}])
+
+    # peticiones en vuelo con el modelo anterior: fallo y escritura descartada, sin vaciar
+    assert cache.get_many("old", [b"a"]) == [None]
+    cache.put_many("old", [b"b"], [{"label": 3}])
+
+    assert cache.get_many("new", [b"a", b"b"]) == [{"label": 4}, None]
+    st = cache.stats()
+    assert st["model_md5"] == "new" and st["entries"] == 1 and st["invalidations"] == 1
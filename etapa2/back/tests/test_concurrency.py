@@ -0,0 +1,177 @@
+# etapa2/back/tests/test_concurrency.py
+"""
+Estrés de lo que comparten procesos e hilos: índice de versiones y store con varios procesos
+escribiendo a la vez, el micro-batcher con peticiones canceladas y el pool de reentrenamientos
+con workers que mueren. Versión corta y determinista de `benchmark stress`.
+"""
+import os
+import time
+import random
+import asyncio
+import hashlib
+import multiprocessing as mp
+
+import pandas as pd
+import pytest
+
+from etapa2.back import data_store, jobs, versions
+from etapa2.back.batching import MicroBatcher
+from etapa2.back.benchmark import isolated_workspace
+from etapa2.back.utils import NORMALIZER_VERSION
+
+WRITERS = 4
+PER_WRITER = 8
+
+fork = pytest.mark.skipif("fork" not in mp.get_all_start_methods(), reason="requiere fork")
+
+@pytest.fixture
+def workspace():
+    with isolated_workspace() as ws:
+        yield ws
+
+def _rows(tag: str, n: int) -> pd.DataFrame:
+    texts = [f"texto {tag} numero {i}" for i in range(n)]
+    return pd.DataFrame({
+        "textos": texts,
+        "labels": [1 + i % 3 for i in range(n)],
+        "textos_norm": texts,
+        "text_hash": [hashlib.md5(t.encode("utf-8")).hexdigest() for t in texts],
+        "norm_version": NORMALIZER_VERSION,
+    })
+
+def _register_many(writer: int):
+    for _ in range(PER_WRITER):
+        version, created_at = versions.new_version_id()
+        path = os.path.join(versions.RETRAIN_DIR, f"{version}.pkl")
+        with open(path, "wb") as f:
+            f.write(b"x")
+        versions.register(path, {"created_at": created_at, "pipeline": f"w{writer}"})
+
+def _append_many(writer: int):
+    for i in range(PER_WRITER):
+        data_store.append_store(_rows(f"{writer}-{i}", 5))
+
+def _run_processes(target):
+    ctx = mp.get_context("fork")
+    procs = [ctx.Process(target=target, args=(w,)) for w in range(WRITERS)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(120)
+    assert all(p.exitcode == 0 for p in procs)
+
+@fork
+def test_concurrent_register_keeps_every_version(workspace, monkeypatch):
+    monkeypatch.setattr(versions, "gc", lambda *a, **k: [])
+    _run_processes(_register_many)
+    versions._cache.update({"sig": None, "index": None})
+    index = versions.load_index()
+    assert len(index["versions"]) == WRITERS * PER_WRITER
+    assert index["active"] in index["versions"]
+    assert index["generation"] == WRITERS * PER_WRITER + 1  # bootstrap + un registro cada uno
+
+@fork
+def test_concurrent_appends_keep_every_row(workspace, monkeypatch):
+    monkeypatch.setattr(data_store, "STORE_COMPACT_THRESHOLD", 4)  # compactaciones durante las escrituras
+    data_store.write_store(_rows("seed", 10))
+    _run_processes(_append_many)
+    data_store._hash_index.update({"generation": None, "hashes": None})
+    df = data_store.read_store(columns=["text_hash"])
+    assert len(df) == 10 + WRITERS * PER_WRITER * 5
+    assert df["text_hash"].is_unique
+    assert data_store.store_size() == len(df)
+    assert all(os.path.isfile(s["path"]) for s in data_store.store_segments())
+
+def test_batcher_survives_cancelled_requests():
+    def fn(texts):
+        time.sleep(0.002)
+        return [{"t": t} for t in texts]
+
+    batcher = MicroBatcher(fn, window_ms=2, max_texts=16, queue_depth=1024)
+    rng = random.Random(0)
+
+    async def main():
+        tasks = [asyncio.ensure_future(batcher.submit_async([f"x{i}"])) for i in range(300)]
+        cancelled = set()
+        for i in rng.sample(range(300), 100):  # en cola, en curso o ya resueltas
+            await asyncio.sleep(rng.random() * 0.002)
+            if tasks[i].cancel():
+                cancelled.add(i)
+        # con el hilo del batcher caído las pendientes no se resuelven nunca: falla por timeout
+        results = await asyncio.wait_for(asyncio.gather(*tasks, return_exceptions=True), 30)
+        for i, r in enumerate(results):
+            if i not in cancelled:
+                assert r == [{"t": f"x{i}"}]
+        # el hilo sigue vivo y atiende peticiones nuevas
+        return await asyncio.wait_for(batcher.submit_async(["despues"]), 5)
+
+    assert asyncio.run(main()) == [{"t": "despues"}]
+    assert batcher._thread.is_alive()
+
+def _job_ok(job_id, records, strategy, pipeline, progress):
+    time.sleep(0.05)
+    return {"metrics": {"n": len(records)}, "model_path": f"{pipeline}.pkl", "stage_seconds": {}}
+
+def _job_dies(job_id, records, strategy, pipeline, progress):
+    os._exit(9)  # OOM / segfault del worker
+
+def _wait(queue, job_list, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while any(queue.get(j.id).status in ("queued", "running") for j in job_list):
+        assert time.monotonic() < deadline, [j.info() for j in job_list]
+        time.sleep(0.02)
+
+class _NoRegistry:
+    def refresh(self, *a, **k):
+        return None
+
+@fork
+def test_job_pool_recovers_from_dead_workers(monkeypatch):
+    monkeypatch.setattr(jobs, "registry", _NoRegistry())
+    queue = jobs.RetrainJobQueue(max_concurrency=2)
+    try:
+        monkeypatch.setattr(jobs, "_run_job", _job_dies)
+        dead = [queue.submit([{"i": i}], "merge_all", f"p{i}") for i in range(3)]
+        _wait(queue, dead)
+        assert all(j.status == "failed" for j in dead)
+        assert queue._running == 0
+
+        monkeypatch.setattr(jobs, "_run_job", _job_ok)
+        alive = [queue.submit([{"i": i}], "merge_all", f"p{i % 4}") for i in range(40)]
+        _wait(queue, alive)
+        assert all(j.status == "done" for j in alive)
+        # los pendientes con la misma estrategia/pipeline se fusionan: ningún registro se pierde
+        merged = {j.id: j for j in alive}.values()
+        assert sum(j.n_records for j in merged) == 40
+        assert queue._running == 0
+    finally:
+        queue.shutdown()
+
+class _SlowRegistry:
+    def __init__(self):
+        self.calls = 0
+
+    def refresh(self, *a, **k):
+        self.calls += 1
+        time.sleep(1.0)  # carga de un modelo grande
+
+@fork
+def test_slow_model_refresh_does_not_delay_jobs(monkeypatch):
+    slow = _SlowRegistry()
+    monkeypatch.setattr(jobs, "registry", slow)
+    monkeypatch.setattr(jobs, "_run_job", _job_ok)
+    queue = jobs.RetrainJobQueue(max_concurrency=1)
+    try:
+        t0 = time.monotonic()
+        done = [queue.submit([{"i": 0}], "merge_all", "p0")]
+        _wait(queue, done)
+        done.append(queue.submit([{"i": 1}], "merge_all", "p1"))
+        done.append(queue.submit([{"i": 2}], "merge_all", "p2"))
+        _wait(queue, done)
+        # las recargas (1 s cada una) no demoran el estado ni el arranque de los siguientes
+        assert time.monotonic() - t0 < 2.5
+        assert all(j.status == "done" for j in done)
+        time.sleep(0.1)
+        assert 1 <= slow.calls <= 3
+    finally:
+        queue.shutdown()
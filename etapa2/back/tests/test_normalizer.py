@@ -0,0 +1,42 @@
+# etapa2/back/tests/test_normalizer.py
+"""Paridad byte a byte de TextNormalizer (engines nltk y fast) con limpiar_texto sobre una muestra fija."""
+import json
+
+import pytest
+
+from etapa2.back.benchmark import PARITY_EDGE_CASES
+from etapa2.back.utils import TextNormalizer, limpiar_texto
+
+SAMPLE = [
+    "La educación de calidad es la base para mejorar la vida de las personas y el desarrollo sostenible.",
+    "Poner fin a la pobreza en todas sus formas: el 10% de la población vive con menos de 2 dólares al día.",
+    "Garantizar una vida sana y promover el bienestar para todos en todas las edades (ODS 3).",
+    "Los niños y niñas de zonas rurales abandonan la escuela antes de terminar la secundaria.",
+    "¿Cómo reducir la mortalidad materna? Más hospitales, más médicos, más vacunas.",
+    "Acceso universal a servicios de salud reproductiva; planificación familiar e información.",
+    "Pingüinos, cigüeñas y ñandúes: especies afectadas por el cambio climático en el sur.",
+    "EL GOBIERNO APROBÓ LA LEY DE PROTECCIÓN SOCIAL PARA HOGARES VULNERABLES",
+    "docentes\tcapacitados\n\nen   pedagogía   inclusiva",
+    None,
+] + PARITY_EDGE_CASES
+
+def test_resources_are_not_fallbacks():
+    # la paridad solo vale algo si tokenizador, stopwords y stemmer reales están activos
+    res = TextNormalizer(engine="fast")._resources()
+    assert res == {"tokenizer": "nltk", "stopwords": True, "stemmer": True, "lemmatizer": False}
+    assert limpiar_texto("La educación de calidad") == "educ calid"
+
+@pytest.mark.parametrize("engine", ["nltk", "fast"])
+def test_parity_with_limpiar_texto(engine):
+    expected = [limpiar_texto(t) for t in SAMPLE]
+    norm = TextNormalizer(engine=engine)
+    assert norm.transform(SAMPLE) == expected
+    assert norm.transform(SAMPLE) == expected  # en caliente (tabla / memo ya poblados)
+
+def test_stem_table_roundtrip():
+    norm = TextNormalizer(engine="fast")
+    expected = norm.transform(SAMPLE)
+    fresh = TextNormalizer(engine="fast")
+    assert fresh.load_stem_table(json.loads(json.dumps(norm.stem_table()))) > 0
+    assert fresh.transform(SAMPLE) == expected
+    assert fresh.oov_lookups == 0
@@ -0,0 +1,49 @@
+# etapa2/back/tests/test_publish.py
+"""Publicación de versiones (`_save_model_with_metadata`) contra un retrain_models/ sin índice."""
+import os
+import json
+import shutil
+
+import pytest
+
+from etapa2.back import versions
+from etapa2.back.benchmark import isolated_workspace
+from etapa2.back.pipelines import build_pipeline
+from etapa2.back.retrain_service import _save_model_with_metadata
+
+TEXTS = ["educ calid escuel docent", "salud hospital medic vacun", "pobrez ingres hogar vulner"] * 4
+LABELS = [4, 3, 1] * 4
+
+@pytest.fixture
+def model():
+    return build_pipeline("logreg").fit(TEXTS, LABELS)
+
+def _publish(model) -> dict:
+    paths = _save_model_with_metadata(model, {"f1": 1.0}, {"pipeline": "logreg", "strategy": "merge_all"})
+    with open(paths["meta_path"], encoding="utf-8") as f:
+        return json.load(f) | {"id": os.path.splitext(os.path.basename(paths["model_path"]))[0]}
+
+def test_first_publish_without_index_has_no_self_parent(model):
+    with isolated_workspace() as ws:
+        assert not os.path.exists(versions.INDEX_PATH)
+        first = _publish(model)
+        assert first["parent"] != first["id"]
+        assert first["parent"] is None
+        with pytest.raises(versions.VersionNotFound):
+            versions.rollback()  # sin historial ni padre: no "vuelve" a sí misma
+
+        second = _publish(model)
+        assert second["parent"] == first["id"]
+        assert versions.rollback()["id"] == first["id"]
+
+def test_parent_is_the_preexisting_model(model):
+    # un checkout nuevo: modelos versionados en disco, sin versions.json (está en .gitignore)
+    with isolated_workspace() as ws:
+        with open(os.path.join(ws, "model_20251011_142854.pkl"), "wb") as f:
+            f.write(b"x")
+        meta = _publish(model)
+        assert meta["parent"] == "model_20251011_142854"
+        index = versions.load_index()
+        assert index["versions"]["model_20251011_142854"]["pinned"]
+        assert not index["versions"][meta["id"]]["pinned"]
+        assert index["active"] == meta["id"]
@@ -1,14 +1,17 @@
+import os
 import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Union
 import pandas as pd
 
-# NLTK: carga perezosa y robusta
-import nltk
-from nltk.tokenize import word_tokenize
-from nltk.corpus import stopwords
-from nltk.stem import SnowballStemmer, WordNetLemmatizer
+# NLTK: carga perezosa y robusta. `import nltk` arrastra scipy.stats (~0.5 s), así que se importa
+# dentro de las funciones: el API lo carga en el warmup, no al importar el módulo.
 
 def _ensure_nltk():
     """Verifica y descarga recursos necesarios (idempotente)."""
+    import nltk
     # punkt (modelo) y punkt_tab (tablas) — algunas versiones usan ambos
     try:
         nltk.data.find("tokenizers/punkt")
@@ -72,6 +75,10 @@ def limpiar_texto(texto: str) -> str:
     texto = re.sub(r"[^a-záéíóúñü\s]", " ", texto)
     texto = re.sub(r"\s+", " ", texto).strip()
 
+    from nltk.tokenize import word_tokenize
+    from nltk.corpus import stopwords
+    from nltk.stem import SnowballStemmer, WordNetLemmatizer
+
     # Tokenización robusta
     tokens = []
     try:
@@ -105,10 +112,241 @@ def limpiar_texto(texto: str) -> str:
 
     return " ".join(tokens)
 
-def clean_df(df: pd.DataFrame, use_nltk: bool = True, use_short_text: bool = False) -> pd.DataFrame:
+# Se incrementa cuando cambia la salida de la normalización; el store re-normaliza las filas con otra versión
+NORMALIZER_VERSION = "1"
+
+# "fast": split + tabla token -> forma (Snowball solo para tokens nuevos); "nltk": word_tokenize + memo LRU
+NORMALIZER_ENGINE = os.environ.get("NORMALIZER_ENGINE", "fast")
+
+_RE_NO_LETRAS = re.compile(r"[^a-záéíóúñü\s]")
+_RE_ESPACIOS = re.compile(r"\s+")
+
+# Tras quitar todo salvo letras y espacios, lo único que word_tokenize (NLTKWordTokenizer) todavía
+# altera son estas contracciones inglesas cuando forman un token completo; el resto es un split.
+_CONTRACTIONS = {
+    "cannot": ("can", "not"),
+    "gimme": ("gim", "me"),
+    "gonna": ("gon", "na"),
+    "gotta": ("got", "ta"),
+    "lemme": ("lem", "me"),
+    "wanna": ("wan", "na"),
+}
+_MISS = object()
+
+class TextNormalizer:
+    """
+    Misma salida (byte a byte) que `limpiar_texto`, pero pensada para lotes:
+    - recursos NLTK verificados y cargados una sola vez (stopwords como set, un stemmer, un lematizador)
+    - engine="fast": tokeniza con `str.split` y resuelve cada token en una tabla token -> forma final
+      (None si es stopword); Snowball/WordNet solo se llaman para tokens fuera de la tabla.
+      La tabla se persiste con el modelo (`stem_table` / `load_stem_table`)
+    - engine="nltk": `word_tokenize` con memo LRU acotado (camino original)
+    - `transform` procesa una lista o una Series completa
+    """
+    def __init__(self, cache_size: int = 200_000, engine: Optional[str] = None):
+        self.engine = engine or NORMALIZER_ENGINE
+        if self.engine not in ("fast", "nltk"):
+            raise ValueError(f"engine desconocido: {self.engine}")
+        from nltk.corpus import stopwords
+        from nltk.stem import SnowballStemmer, WordNetLemmatizer
+        self._tokenize = self._load_tokenizer()
+        self._nltk_tokens = self._tokenize is not str.split
+
+        try:
+            self._stopwords = frozenset(stopwords.words("spanish"))
+        except LookupError:
+            self._stopwords = None
+
+        try:
+            self._stem = SnowballStemmer("spanish").stem
+        except Exception:
+            self._stem = None
+
+        # WordNet falla en la primera llamada si falta el corpus; limpiar_texto entonces no lematiza
+        try:
+            lem = WordNetLemmatizer()
+            lem.lemmatize("prueba")
+            self._lemmatize = lem.lemmatize
+        except Exception:
+            self._lemmatize = None
+
+        self.cache_size = cache_size
+        self._token_form = lru_cache(maxsize=cache_size)(self._compute_token_form)
+        self._forms: Dict[str, Optional[str]] = {}
+        self._new_forms: Dict[str, Optional[str]] = {}
+        self.oov_lookups = 0
+        if self.engine == "fast":
+            self.normalize = self._normalize_fast
+
+    @staticmethod
+    def _load_tokenizer():
+        try:
+            _ensure_nltk()
+        except Exception:
+            return str.split
+        from nltk.tokenize import word_tokenize
+        return lambda texto: word_tokenize(texto, language="spanish", preserve_line=True)
+
+    def _compute_token_form(self, token: str) -> Optional[str]:
+        if self._stopwords is not None and token in self._stopwords:
+            return None
+        if self._stem is not None:
+            token = self._stem(token)
+        if self._lemmatize is not None:
+            token = self._lemmatize(token)
+        return token
+
+    def normalize(self, texto) -> str:
+        if texto is None:
+            return ""
+        texto = _RE_NO_LETRAS.sub(" ", str(texto).lower())
+        texto = _RE_ESPACIOS.sub(" ", texto).strip()
+        form = self._token_form
+        return " ".join([f for f in map(form, self._tokenize(texto)) if f is not None])
+
+    # ===== engine "fast" =====
+    def _oov_form(self, token: str) -> Optional[str]:
+        """Forma de un token fuera de la tabla (una contracción se guarda ya unida: "gonna" -> "gon na")."""
+        form = self._forms.get(token, _MISS)  # pudo agregarse antes en el mismo documento
+        if form is not _MISS:
+            return form
+        self.oov_lookups += 1
+        parts = _CONTRACTIONS.get(token, (token,)) if self._nltk_tokens else (token,)
+        kept = [f for f in map(self._compute_token_form, parts) if f is not None]
+        form = " ".join(kept) if kept else None
+        if len(self._forms) < self.cache_size:
+            self._forms[token] = form
+            self._new_forms[token] = form
+        return form
+
+    def _normalize_fast(self, texto) -> str:
+        if texto is None:
+            return ""
+        # str.split ya colapsa espacios y recorta los extremos
+        tokens = _RE_NO_LETRAS.sub(" ", str(texto).lower()).split()
+        get = self._forms.get
+        forms = [get(t, _MISS) for t in tokens]
+        if _MISS in forms:
+            forms = [self._oov_form(t) if f is _MISS else f for t, f in zip(tokens, forms)]
+        return " ".join([f for f in forms if f is not None])
+
+    def _resources(self) -> dict:
+        """Qué recursos produjeron las formas: una tabla solo es válida con los mismos."""
+        return {
+            "tokenizer": "nltk" if self._nltk_tokens else "split",
+            "stopwords": self._stopwords is not None,
+            "stemmer": self._stem is not None,
+            "lemmatizer": self._lemmatize is not None,
+        }
+
+    def stem_table(self) -> dict:
+        """Tabla token -> forma para persistir con el modelo."""
+        return {"norm_version": NORMALIZER_VERSION, "resources": self._resources(), "forms": dict(self._forms)}
+
+    def load_stem_table(self, table: Optional[dict]) -> int:
+        """Precarga una tabla persistida (se ignora si cambió la versión o los recursos); retorna las entradas nuevas."""
+        if (
+            self.engine != "fast"
+            or not table
+            or table.get("norm_version") != NORMALIZER_VERSION
+            or table.get("resources") != self._resources()
+        ):
+            return 0
+        return self.merge_forms(table.get("forms") or {})
+
+    def merge_forms(self, forms: Dict[str, Optional[str]]) -> int:
+        added = 0
+        for token, form in forms.items():
+            if len(self._forms) >= self.cache_size:
+                break
+            if token not in self._forms:
+                self._forms[token] = form
+                added += 1
+        return added
+
+    def take_new_forms(self) -> Dict[str, Optional[str]]:
+        """Formas calculadas desde la última llamada (los workers de `normalize_series` las devuelven al padre)."""
+        out, self._new_forms = self._new_forms, {}
+        return out
+
+    def transform(self, texts: Union[pd.Series, Iterable[str]]) -> Union[pd.Series, List[str]]:
+        """Normaliza un lote; conserva orden, cardinalidad e índice (si es Series)."""
+        normalize = self.normalize
+        if isinstance(texts, pd.Series):
+            return pd.Series([normalize(t) for t in texts], index=texts.index, name=texts.name)
+        return [normalize(t) for t in texts]
+
+    def cache_info(self):
+        if self.engine == "fast":
+            return {"table_size": len(self._forms), "oov_lookups": self.oov_lookups, "maxsize": self.cache_size}
+        return self._token_form.cache_info()
+
+_normalizer: Optional[TextNormalizer] = None
+_normalizer_lock = threading.Lock()
+
+def get_normalizer() -> TextNormalizer:
+    """Normalizador compartido por el proceso (se construye en el primer uso)."""
+    global _normalizer
+    if _normalizer is None:
+        with _normalizer_lock:
+            if _normalizer is None:
+                _normalizer = TextNormalizer()
+    return _normalizer
+
+# Normalización en paralelo (clean_df / reentrenamiento)
+# CLEAN_N_JOBS: procesos (<=0 -> todos los núcleos, 1 -> serial)
+CLEAN_N_JOBS = int(os.environ.get("CLEAN_N_JOBS", "-1"))
+CLEAN_CHUNK_SIZE = int(os.environ.get("CLEAN_CHUNK_SIZE", "500"))
+# por debajo de este número de textos el arranque del pool cuesta más de lo que ahorra
+CLEAN_PARALLEL_MIN_ROWS = int(os.environ.get("CLEAN_PARALLEL_MIN_ROWS", "4000"))
+
+def _resolve_n_jobs(n_jobs: Optional[int]) -> int:
+    n_jobs = CLEAN_N_JOBS if n_jobs is None else n_jobs
+    if n_jobs <= 0:
+        n_jobs = os.cpu_count() or 1
+    return n_jobs
+
+def _normalize_chunk(texts: List[str]):
+    norm = get_normalizer()
+    return norm.transform(texts), norm.take_new_forms()
+
+def normalize_series(
+    s: pd.Series,
+    n_jobs: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+    min_rows: Optional[int] = None,
+) -> pd.Series:
+    """
+    Normaliza una Series con `TextNormalizer`, repartiendo bloques de `chunk_size`
+    textos en un pool de procesos. Cae a serial si hay un solo proceso o pocos textos.
+    """
+    n_jobs = _resolve_n_jobs(n_jobs)
+    chunk_size = max(1, chunk_size or CLEAN_CHUNK_SIZE)
+    min_rows = CLEAN_PARALLEL_MIN_ROWS if min_rows is None else min_rows
+    if n_jobs <= 1 or len(s) < max(min_rows, 2 * chunk_size):
+        return get_normalizer().transform(s)
+
+    values = s.tolist()
+    chunks = [values[i:i + chunk_size] for i in range(0, len(values), chunk_size)]
+    norm, out = get_normalizer(), []
+    with ProcessPoolExecutor(max_workers=min(n_jobs, len(chunks))) as ex:
+        for part, forms in ex.map(_normalize_chunk, chunks):
+            out.extend(part)
+            # el vocabulario visto por los workers queda en la tabla del proceso (se persiste con el modelo)
+            norm.merge_forms(forms)
+    return pd.Series(out, index=s.index, name=s.name)
+
+def clean_df(
+    df: pd.DataFrame,
+    use_nltk: bool = True,
+    use_short_text: bool = False,
+    n_jobs: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+) -> pd.DataFrame:
     """
     - Si use_short_text=False: elimina < 300 chars (para entrenamiento).
     - Si use_short_text=True: NO elimina cortos (para predicción).
+    - n_jobs / chunk_size: normalización en paralelo (ver `normalize_series`).
     """
     df_ = df.copy()
     drop_nans(df_)
@@ -116,5 +354,5 @@ def clean_df(df: pd.DataFrame, use_nltk: bool = True, use_short_text: bool = Fal
     if not use_short_text:
         drop_short_texts(df_, min_length=300)
     if use_nltk:
-        df_["textos"] = df_["textos"].apply(limpiar_texto)
+        df_["textos"] = normalize_series(df_["textos"], n_jobs=n_jobs, chunk_size=chunk_size)
     return df_
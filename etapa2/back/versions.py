@@ -0,0 +1,264 @@
+# etapa2/back/versions.py
+"""
+Índice de versiones de modelos (`retrain_models/versions.json`).
+
+Cada versión registra su archivo (.pkl, relativo a retrain_models/), meta, exportación,
+padre, métricas y md5; `active` apunta explícitamente al modelo servido y `history`
+guarda los activos anteriores para `rollback`. Las versiones `pinned` (las que ya estaban en disco
+al crear el índice, p. ej. los modelos versionados en el repositorio) nunca las borra la retención. El índice se escribe de forma atómica
+(temporal + os.replace) y el modelo activo se resuelve con un `stat` del índice.
+Las modificaciones (leer-modificar-escribir) toman un lock de archivo: varios workers y el
+pool de reentrenamiento pueden registrar versiones a la vez sin perder entradas.
+"""
+import os
+import re
+import glob
+import json
+import time
+import uuid
+import shutil
+import argparse
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from .locks import FileLock
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# carpeta compartida por todos los procesos (RETRAIN_MODELS_DIR la redirige, p. ej. a un volumen común);
+# el resto de los módulos la importa de aquí
+RETRAIN_DIR = os.environ.get("RETRAIN_MODELS_DIR") or os.path.normpath(os.path.join(BASE_DIR, "..", "retrain_models"))
+INDEX_PATH = os.path.join(RETRAIN_DIR, "versions.json")
+INDEX_FORMAT = 1
+
+# versiones a conservar en disco (además de la activa); 0 desactiva la limpieza
+MODEL_KEEP_VERSIONS = int(os.environ.get("MODEL_KEEP_VERSIONS", "10"))
+HISTORY_MAX = 50
+# temporales (.tmp) de escrituras interrumpidas que gc borra pasado este tiempo
+TMP_MAX_AGE_SECONDS = 3600
+
+_lock = FileLock(lambda: INDEX_PATH + ".lock")
+_cache = {"sig": None, "index": None}
+_TS_RE = re.compile(r"model_(\d{8}_\d{6})")
+
+class VersionNotFound(KeyError):
+    """La versión pedida no está en el índice."""
+
+def _sig():
+    try:
+        st = os.stat(INDEX_PATH)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+def new_version_id() -> Tuple[str, str]:
+    """
+    (id, created_at) de una versión nueva. El id lleva un sufijo aleatorio (`model_<ts>_<hex>`):
+    dos reentrenamientos en el mismo segundo, en procesos distintos, no pisan sus archivos.
+    created_at agrega microsegundos para ordenar versiones del mismo segundo.
+    """
+    now = datetime.now()
+    ts = now.strftime("%Y%m%d_%H%M%S")
+    return f"model_{ts}_{uuid.uuid4().hex[:8]}", f"{ts}_{now.microsecond:06d}"
+
+def _entry_from_meta(version: str, meta: dict, pinned: bool = False) -> dict:
+    export = f"{version}.export"
+    ts = _TS_RE.match(version)
+    return {
+        "id": version,
+        "file": f"{version}.pkl",
+        "meta": f"{version}.meta.json",
+        "export": export if os.path.isdir(os.path.join(RETRAIN_DIR, export)) else None,
+        "created_at": meta.get("created_at") or (ts.group(1) if ts else None),
+        "pipeline": meta.get("pipeline"),
+        "strategy": meta.get("strategy"),
+        "parent": meta.get("parent"),
+        "metrics": meta.get("metrics"),
+        "md5": meta.get("md5"),
+        "pinned": pinned,
+    }
+
+def _bootstrap() -> dict:
+    """
+    Arma el índice desde los .meta.json existentes (ignora metas sin .pkl y rutas absolutas).
+    Esas versiones quedan fijadas: son anteriores al índice (p. ej. versionadas con git).
+    """
+    versions = {}
+    for pkl in glob.glob(os.path.join(RETRAIN_DIR, "*.pkl")):
+        version = os.path.splitext(os.path.basename(pkl))[0]
+        meta = {}
+        meta_path = os.path.join(RETRAIN_DIR, f"{version}.meta.json")
+        if os.path.isfile(meta_path):
+            try:
+                with open(meta_path, "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                meta = {}
+        versions[version] = _entry_from_meta(version, meta, pinned=True)
+    ordered = sorted(versions.values(), key=lambda v: str(v["created_at"] or ""))
+    return {
+        "format": INDEX_FORMAT,
+        "generation": 0,
+        "active": ordered[-1]["id"] if ordered else None,
+        "history": [],
+        "versions": {v["id"]: v for v in ordered},
+    }
+
+def _write(index: dict):
+    index["generation"] = int(index.get("generation", 0)) + 1
+    os.makedirs(RETRAIN_DIR, exist_ok=True)
+    tmp = f"{INDEX_PATH}.{uuid.uuid4().hex}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, INDEX_PATH)
+    _cache["sig"], _cache["index"] = _sig(), index
+
+def load_index() -> dict:
+    """
+    Índice vigente; solo se relee si cambió el archivo (stat). Se crea desde los metas si no existe.
+    El dict retornado es compartido: no modificarlo.
+    """
+    with _lock:
+        sig = _sig()
+        if sig is None:
+            _write(_bootstrap())
+            return _cache["index"]
+        if sig != _cache["sig"]:
+            with open(INDEX_PATH, "r", encoding="utf-8") as f:
+                _cache["index"] = json.load(f)
+            _cache["sig"] = sig
+        return _cache["index"]
+
+def active_version() -> Optional[dict]:
+    index = load_index()
+    return index["versions"].get(index["active"]) if index["active"] else None
+
+def active_model_path() -> Optional[str]:
+    """Ruta del .pkl activo (None si el índice está vacío)."""
+    v = active_version()
+    return os.path.join(RETRAIN_DIR, v["file"]) if v else None
+
+def list_versions() -> List[dict]:
+    index = load_index()
+    return [v | {"active": v["id"] == index["active"]} for v in sorted(
+        index["versions"].values(), key=lambda v: str(v["created_at"] or ""), reverse=True)]
+
+def latest(pipeline: Optional[str] = None) -> Optional[dict]:
+    """Versión más reciente (opcionalmente de un pipeline) cuyo .pkl sigue en disco."""
+    for v in list_versions():
+        if (pipeline is None or v["pipeline"] == pipeline) and os.path.isfile(os.path.join(RETRAIN_DIR, v["file"])):
+            return v
+    return None
+
+def _activate(index: dict, version: str):
+    if index["active"] and index["active"] != version:
+        index["history"] = (index["history"] + [index["active"]])[-HISTORY_MAX:]
+    index["active"] = version
+
+def register(model_path: str, meta: dict, activate: bool = True) -> dict:
+    """Agrega la versión recién guardada (y la activa); luego aplica la retención."""
+    version = os.path.splitext(os.path.basename(model_path))[0]
+    with _lock:
+        index = json.loads(json.dumps(load_index()))  # copia: el caché solo cambia al escribir
+        index["versions"][version] = _entry_from_meta(version, meta)
+        if activate:
+            _activate(index, version)
+        _write(index)
+    gc()
+    return index["versions"][version]
+
+def promote(version: str) -> dict:
+    with _lock:
+        index = json.loads(json.dumps(load_index()))
+        if version not in index["versions"]:
+            raise VersionNotFound(version)
+        _activate(index, version)
+        _write(index)
+        return index["versions"][version]
+
+def rollback() -> dict:
+    """Vuelve al activo anterior (history); sin historial, al padre de la versión activa."""
+    with _lock:
+        index = json.loads(json.dumps(load_index()))
+        target = None
+        while index["history"] and target is None:
+            cand = index["history"].pop()
+            target = cand if cand in index["versions"] else None
+        if target is None:
+            active = index["versions"].get(index["active"]) or {}
+            target = active.get("parent") if active.get("parent") in index["versions"] else None
+        if target is None:
+            raise VersionNotFound("No hay una versión anterior a la cual volver.")
+        index["active"] = target
+        _write(index)
+        return index["versions"][target]
+
+def _remove_stale_tmp(max_age: float = TMP_MAX_AGE_SECONDS):
+    """Temporales de publicaciones interrumpidas (un proceso que murió entre escribir y renombrar)."""
+    cutoff = time.time() - max_age
+    for p in glob.glob(os.path.join(RETRAIN_DIR, "*.tmp")):
+        try:
+            if os.path.getmtime(p) >= cutoff:
+                continue  # puede ser de una publicación en curso
+            if os.path.isdir(p):
+                shutil.rmtree(p, ignore_errors=True)
+            else:
+                os.remove(p)
+        except OSError:
+            pass
+
+def gc(keep: int = MODEL_KEEP_VERSIONS) -> List[str]:
+    """
+    Borra .pkl/.meta.json/.export de las versiones fuera de las `keep` más recientes (nunca la activa
+    ni las fijadas) y los temporales abandonados. Las entradas sin el campo `pinned` (índices
+    anteriores a él) se tratan como fijadas.
+    """
+    _remove_stale_tmp()
+    if keep <= 0:
+        return []
+    with _lock:
+        index = json.loads(json.dumps(load_index()))
+        candidates = [v for v in index["versions"].values() if not v.get("pinned", True)]
+        ordered = sorted(candidates, key=lambda v: str(v["created_at"] or ""), reverse=True)
+        keep_ids = {v["id"] for v in ordered[:keep]} | {index["active"]}
+        removed = [v for v in ordered if v["id"] not in keep_ids]
+        if not removed:
+            return []
+        for v in removed:
+            del index["versions"][v["id"]]
+        index["history"] = [h for h in index["history"] if h in index["versions"]]
+        _write(index)
+
+    for v in removed:
+        for name in (v["file"], v["meta"]):
+            p = os.path.join(RETRAIN_DIR, name)
+            if os.path.isfile(p):
+                os.remove(p)
+        if v.get("export"):
+            shutil.rmtree(os.path.join(RETRAIN_DIR, v["export"]), ignore_errors=True)
+    return [v["id"] for v in removed]
+
+def main():
+    ap = argparse.ArgumentParser(description="Índice de versiones de modelos.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("list", help="Lista las versiones (la activa primero marcada).")
+    p = sub.add_parser("promote", help="Activa una versión.")
+    p.add_argument("version")
+    sub.add_parser("rollback", help="Vuelve a la versión activa anterior.")
+    p = sub.add_parser("gc", help="Aplica la política de retención.")
+    p.add_argument("--keep", type=int, default=MODEL_KEEP_VERSIONS)
+    args = ap.parse_args()
+
+    if args.cmd == "list":
+        out = list_versions()
+    elif args.cmd == "promote":
+        out = promote(args.version)
+    elif args.cmd == "rollback":
+        out = rollback()
+    else:
+        out = {"removed": gc(keep=args.keep)}
+    print(json.dumps(out, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
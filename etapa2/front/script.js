@@ -102,12 +102,27 @@ async function reentrenarDesdeArchivo() {
     });
 
     console.log("Respuesta recibida, procesando...");
-    const res = await response.json();
+    let job = await response.json();
     if (!response.ok) {
-      console.error("Error HTTP en reentrenamiento:", response.status, response.statusText, res.detail || res);
-      throw new Error(JSON.stringify(res.detail || res));
+      console.error("Error HTTP en reentrenamiento:", response.status, response.statusText, job.detail || job);
+      throw new Error(JSON.stringify(job.detail || job));
     }
 
+    // El backend encola el reentrenamiento: se consulta el estado del trabajo hasta que termine
+    while (job.status === "queued" || job.status === "running") {
+      predElem.textContent = `Reentrenando... (${job.progress || job.status})`;
+      await new Promise(resolve => setTimeout(resolve, 2000));
+      const statusResponse = await fetch(`${API_URL}/retrain/jobs/${job.job_id}`);
+      job = await statusResponse.json();
+      if (!statusResponse.ok) {
+        throw new Error(JSON.stringify(job.detail || job));
+      }
+    }
+    if (job.status === "failed") {
+      throw new Error(job.error);
+    }
+
+    const res = job.metrics;
     predElem.textContent = "Modelo reentrenado exitosamente.";
     probElem.textContent = `F1: ${res.f1.toFixed(3)} | Precision: ${res.precision.toFixed(
       3